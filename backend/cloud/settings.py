@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'myapp.middleware.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'myapp.middleware.ProxyDeliveryMiddleware',
 ]
 
 # Настройки CORS
@@ -86,6 +88,12 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'content-range',
+    'upload-offset',
+    'range',
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
 ]
 
 # CSRF settings
@@ -121,7 +129,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Токен первым: по нему DRF строит WWW-Authenticate, и отклоненный токен дает 401, а не 403 -
+    # клиент по 401 понимает, что нужно обновить токен
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'myapp.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -134,6 +145,11 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 1209600  # 2 недели в секундах
 SESSION_COOKIE_NAME = 'sessionid'
 
+# Подписанные токены доступа для API-клиентов (Authorization: Bearer <токен>)
+AUTH_TOKEN_TTL = 900  # Время жизни токена доступа, секунд
+AUTH_TOKEN_USER_CACHE_SIZE = 10000  # Пользователей в кеше процесса
+AUTH_TOKEN_USER_CACHE_TTL = 30  # Через сколько секунд отзыв токенов виден в других процессах
+
 ROOT_URLCONF = 'cloud.urls'
 
 TEMPLATES = [
@@ -233,12 +249,167 @@ for directory in STORAGE_DIRS:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+# Где хранится содержимое файлов: 'local' - MEDIA_ROOT, 's3' - S3-совместимое хранилище.
+# Временные файлы загрузок в любом случае пишутся в MEDIA_ROOT узла.
+FILE_STORAGE_BACKEND = os.environ.get('FILE_STORAGE_BACKEND', 'local')
+
+# Холодный уровень: отдельный (дешевый) том для давно не скачивавшихся файлов
+COLD_STORAGE_ROOT = os.environ.get('COLD_STORAGE_ROOT', os.path.join(BASE_DIR, 'cold'))
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'myapp.storage_backends.S3Storage' if FILE_STORAGE_BACKEND == 's3'
+        else 'myapp.storage_backends.LocalStorage',
+    },
+    'cold': {
+        'BACKEND': 'myapp.storage_backends.LocalStorage',
+        'OPTIONS': {'location': COLD_STORAGE_ROOT},
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Настройки S3 (нужен пакет boto3)
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # MinIO, Ceph и т.п.
+S3_REGION = os.environ.get('S3_REGION') or None
+S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID') or None
+S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY') or None
+S3_LOCATION = os.environ.get('S3_LOCATION', '')  # Префикс ключей внутри бакета
+S3_MULTIPART_THRESHOLD = 16777216  # 16MB, крупнее - multipart
+S3_MULTIPART_PART_SIZE = 8388608  # 8MB
+S3_UPLOAD_WORKERS = 8  # Частей, отправляемых параллельно
+S3_MAX_POOL_CONNECTIONS = 32  # Размер пула HTTP-соединений клиента
+S3_READ_WINDOW = 8388608  # Байт на один ranged GET при чтении
+S3_URL_EXPIRY = 300  # Время жизни подписанных ссылок, секунд
+
+# Сжатие содержимого в хранилище (zstd, нужен пакет zstandard). Решение принимается
+# при загрузке по пробному сжатию; size файла всегда остается исходным размером.
+STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', '') == '1'
+STORAGE_COMPRESSION_LEVEL = 3
+STORAGE_COMPRESSION_FRAME_SIZE = 1048576  # 1MB исходных данных на кадр - гранулярность Range
+STORAGE_COMPRESSION_MIN_SIZE = 4096  # Файлы меньше не сжимаются
+STORAGE_COMPRESSION_PROBE_SIZE = 65536  # Байт в каждом пробном куске
+STORAGE_COMPRESSION_MAX_RATIO = 0.8  # Сжимать, если проба ужимается хотя бы до 80%
+
+# Перенос на холодный уровень (команда tier_storage)
+TIERING_COLD_AFTER_DAYS = 90  # Без скачиваний (или с загрузки) дольше - на холодный уровень
+TIERING_COMPRESS = True  # Сжимать при переносе, если проба это оправдывает
+TIERING_MAX_RATE = 52428800  # 50MB/s, ограничение скорости переноса
+TIERING_BATCH_SIZE = 100
+TIERING_REHYDRATE_ON_DOWNLOAD = True  # Возвращать файл на горячий уровень при скачивании
+TIERING_SOURCE_GRACE = 300  # Сколько секунд хранить старую копию после переноса (для идущих ответов)
+
+# Обработка файлов после загрузки в пуле процессов (MIME, SHA-256, превью)
+UPLOAD_PIPELINE_ENABLED = True
+UPLOAD_PIPELINE_WORKERS = 2
+UPLOAD_PIPELINE_RETRIES = 3  # Повторов стадии при ошибке
+UPLOAD_PIPELINE_RETRY_DELAY = 1  # Секунд до первого повтора, дальше удваивается
+UPLOAD_PIPELINE_MAX_ATTEMPTS = 5  # После стольких запусков process_uploads файл больше не берет
+UPLOAD_PIPELINE_STAGES = [
+    'myapp.pipeline.sniff_mime',
+    'myapp.pipeline.compute_checksum',
+    'myapp.pipeline.make_thumbnail',
+]
+THUMBNAIL_SIZE = 320  # Длинная сторона превью, px
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_MAX_SOURCE_SIZE = 52428800  # 50MB, для файлов крупнее превью не делается
+THUMBNAIL_CACHE_MAX_AGE = 31536000  # Превью не меняется, кешируется на год
+
 # Настройки для загрузки файлов
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# Квоты хранилища: квота пользователя (CustomUser.quota) или эта, если она не задана; 0 - без ограничения
+STORAGE_DEFAULT_QUOTA = int(os.environ.get('STORAGE_DEFAULT_QUOTA', 10737418240))  # 10GB
+
+# Ограничение полосы передачи файлов, байт/с; 0 - без ограничения (см. myapp/shaping.py)
+BANDWIDTH_DOWNLOAD_LIMIT = int(os.environ.get('BANDWIDTH_DOWNLOAD_LIMIT', 0))  # Все скачивания сервера
+BANDWIDTH_UPLOAD_LIMIT = int(os.environ.get('BANDWIDTH_UPLOAD_LIMIT', 0))  # Все загрузки сервера
+BANDWIDTH_USER_LIMIT = int(os.environ.get('BANDWIDTH_USER_LIMIT', 0))  # Один пользователь, в каждом направлении
+BANDWIDTH_SHARE_LINK_LIMIT = int(os.environ.get('BANDWIDTH_SHARE_LINK_LIMIT', 0))  # Одна публичная ссылка
+BANDWIDTH_WINDOW = 1  # Период пополнения ведер, секунд
+BANDWIDTH_QUANTUM = 262144  # Порция учета, 256KB
+BANDWIDTH_CACHE_ALIAS = None  # Алиас общего кеша из CACHES для счетчиков; None - счетчики процесса
+
+# Допуск запросов: лимиты одновременных запросов в процессе воркера по пулам (см. myapp/admission.py).
+# limit - начальный лимит, queue - сколько запросов может ждать, timeout - сколько ждать, секунд;
+# лимиты пулов с adaptive меняются от min_limit до max_limit по задержке диска
+# Работает только с многопоточными (gunicorn --worker-class=gthread) или асинхронными воркерами:
+# синхронный воркер выполняет один запрос за раз, и лимиты процесса не срабатывают
+ADMISSION_CONTROL_ENABLED = True
+ADMISSION_POOLS = {
+    'upload': {'limit': 4, 'min_limit': 1, 'max_limit': 16, 'queue': 16, 'timeout': 10, 'adaptive': True},
+    'download': {'limit': 16, 'min_limit': 2, 'max_limit': 64, 'queue': 32, 'timeout': 5, 'adaptive': True},
+    'metadata': {'limit': 32, 'min_limit': 32, 'max_limit': 32, 'queue': 64, 'timeout': 2},
+}
+ADMISSION_DEFAULT_POOL = 'metadata'
+ADMISSION_RETRY_AFTER = 5  # Значение Retry-After в ответе 503, секунд
+ADMISSION_PROBE_INTERVAL = 1  # Период замера задержки диска, секунд
+ADMISSION_TARGET_LATENCY = 0.05  # Целевая задержка записи с fsync и чтения 4KB, секунд
+ADMISSION_DECREASE_FACTOR = 0.75
+
+# Статистика скачиваний (last_download, download_count) копится в памяти воркера
+DOWNLOAD_STATS_FLUSH_INTERVAL = 5  # Максимальная задержка записи в БД, секунд; 0 - писать сразу
+DOWNLOAD_STATS_MAX_PENDING = 10000  # При таком числе файлов в буфере сброс происходит досрочно
+DOWNLOAD_STATS_BATCH_SIZE = 500  # Файлов в одном UPDATE при сбросе
+
+# Кеш публичных ссылок
+SHARE_LINK_CACHE_SIZE = 10000  # Записей в LRU-кеше процесса
+SHARE_LINK_LOCAL_TTL = 10  # Время жизни записи в кеше процесса, секунд
+SHARE_LINK_CACHE_ALIAS = None  # Алиас общего кеша из CACHES (например, 'default'); None - только кеш процесса
+SHARE_LINK_CACHE_TTL = 300  # Время жизни записи в общем кеше, секунд
+SHARE_LINK_NEGATIVE_TTL = 30  # Сколько помнить несуществующие ссылки, секунд
+
+# Публичные ссылки
+SHARE_LINK_TTL = 7 * 24 * 3600  # Срок действия ссылки по умолчанию, секунд
+SHARE_LINK_MAX_TTL = 365 * 24 * 3600  # Максимальный срок, который можно задать ссылке, секунд
+SHARE_LINK_SWEEP_BATCH_SIZE = 1000  # Ссылок за одну транзакцию при отзыве истекших
+
+# Список файлов
+FILE_LIST_PAGE_SIZE = 100  # Размер страницы по умолчанию
+FILE_LIST_MAX_PAGE_SIZE = 1000  # Максимальный размер страницы, который может запросить клиент
+FILE_LIST_STREAM_CHUNK_SIZE = 2000  # Строк за одно чтение серверного курсора при потоковой выдаче
+
+# Поиск по именам и комментариям файлов
+SEARCH_MAX_QUERY_LENGTH = 200  # Максимальная длина поискового запроса, символов
+SEARCH_MAX_TERMS = 8  # Максимум слов в полнотекстовом запросе
+SEARCH_MIN_SUBSTRING_LENGTH = 3  # Короче триграммный индекс не помогает, поиск по подстроке не выполняется
+
+# Пакетные операции над файлами
+BULK_MAX_ITEMS = 5000  # Максимум файлов в одном пакетном запросе
+BACKGROUND_WORKERS = 4  # Потоков для фоновых задач (удаление файлов с диска)
+
+# Удаление файлов: пометка в запросе, удаление с диска - фоновой очисткой (reap_deleted_files)
+DELETION_REAP_IMMEDIATELY = True  # Сразу запускать очистку в фоновом потоке после пометки
+DELETION_BATCH_SIZE = 1000  # Строк за один проход очистки
+DELETION_IO_WORKERS = 8  # Параллельных удалений с диска
+
+# Возобновляемая загрузка частями
+UPLOAD_SESSION_TTL = 86400  # Время жизни незавершенной сессии, в секундах
+UPLOAD_CHUNK_MAX_SIZE = 67108864  # Максимальный размер одной части, 64MB
+UPLOAD_CHUNK_READ_SIZE = 1048576  # Размер блока чтения тела запроса, 1MB
+
+# Отдача файлов
+FILE_DOWNLOAD_BLOCK_SIZE = 65536  # Размер блока чтения файла при отдаче диапазонов
+FILE_DOWNLOAD_MAX_RANGES = 16  # При большем числе диапазонов в Range файл отдается целиком
+ARCHIVE_MAX_FILES = 10000  # Максимум файлов в одном ZIP-архиве
+# Способ отдачи тела файла: 'direct' - стримит Django, 'x-accel-redirect' - nginx,
+# 'x-sendfile' - apache/lighttpd. Проверки доступа и учет скачиваний всегда делает Django.
+FILE_DELIVERY_BACKEND = os.environ.get('FILE_DELIVERY_BACKEND', 'direct')
+FILE_DELIVERY_ACCEL_PREFIX = '/media/'  # internal-location nginx, смотрящий на MEDIA_ROOT
+# Локальная замена прокси для runserver: middleware сам отдает файлы по X-Accel-Redirect/X-Sendfile
+FILE_DELIVERY_EMULATE_PROXY = DEBUG and FILE_DELIVERY_BACKEND != 'direct'
+
 # CORS Settings
 CORS_EXPOSE_HEADERS = [
     "Content-Type",
     "X-CSRFToken",
+    "Upload-Offset",
+    "Accept-Ranges",
+    "Content-Range",
+    "Content-Length",
+    "Content-Disposition",
+    "ETag",
 ]
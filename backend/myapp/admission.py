@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from django.conf import settings
+from .storage_backends import is_local
+
+
+# Ограничение числа одновременно выполняемых запросов процесса: отдельные пулы для загрузок,
+# скачиваний и остальных (метаданных) вызовов, чтобы поток передач не забирал все потоки
+# воркера и не раздувал очередь диска. Пул задает view атрибутом admission_pool.
+# Сверх лимита запрос ждет в очереди не дольше timeout, а при полной очереди или по
+# истечении ожидания получает 503 с Retry-After. Лимиты пулов передач подстраиваются
+# под задержку диска (AIMD): выше ADMISSION_TARGET_LATENCY - лимит уменьшается в
+# ADMISSION_DECREASE_FACTOR раз, заметно ниже - растет на единицу.
+# Лимиты действуют внутри одного процесса: запросы ждут друг друга только в потоках
+# одного воркера. Синхронный воркер gunicorn обрабатывает один запрос за раз, и лимит
+# никогда не срабатывает - нужен воркер с потоками (--worker-class=gthread) или асинхронный.
+# Лимит на весь сервер при этом - сумма лимитов воркеров.
+class Pool:
+    def __init__(self, name, limit, min_limit, max_limit, queue, timeout, adaptive=False):
+        self.name = name
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue = queue
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            self.queued += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self.condition.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def adapt(self, latency):
+        with self.condition:
+            if latency > settings.ADMISSION_TARGET_LATENCY:
+                self.limit = max(self.min_limit, int(self.limit * settings.ADMISSION_DECREASE_FACTOR))
+            elif latency < settings.ADMISSION_TARGET_LATENCY / 2 and self.limit < self.max_limit:
+                self.limit += 1
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted_total': self.admitted,
+                'queued_total': self.queued,
+                'rejected_total': self.rejected,
+            }
+
+
+class AdmissionController:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools = None
+        self.pid = None
+        self.thread = None
+        self.latency = None
+
+    # Пулы и поток замера создаются лениво и заново после fork воркера
+    def get_pools(self):
+        if self.pools is not None and self.pid == os.getpid():
+            return self.pools
+        with self.lock:
+            if self.pools is None or self.pid != os.getpid():
+                self.pools = {
+                    name: Pool(name, **options) for name, options in settings.ADMISSION_POOLS.items()
+                }
+                self.pid = os.getpid()
+                self.thread = None
+                # Задержка объектного хранилища от нагрузки на локальный диск не зависит
+                if is_local() and any(pool.adaptive for pool in self.pools.values()):
+                    self.thread = threading.Thread(target=self.run, name='admission-probe', daemon=True)
+                    self.thread.start()
+            return self.pools
+
+    def get_pool(self, name):
+        pools = self.get_pools()
+        return pools.get(name) or pools[settings.ADMISSION_DEFAULT_POOL]
+
+    # Запись с fsync и чтение небольшого файла в MEDIA_ROOT: время растет вместе с очередью диска
+    def probe(self):
+        path = os.path.join(settings.MEDIA_ROOT, f'.admission_probe_{os.getpid()}')
+        data = os.urandom(4096)
+        started = time.monotonic()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with open(path, 'rb') as f:
+            f.read()
+        elapsed = time.monotonic() - started
+        os.remove(path)
+        return elapsed
+
+    def run(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(settings.ADMISSION_PROBE_INTERVAL)
+            try:
+                latency = self.probe()
+            except OSError as e:
+                print(f"Ошибка замера задержки диска: {str(e)}")
+                continue
+            # Сглаживание, чтобы одиночный выброс не обрушил лимиты
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+            for pool in self.pools.values():
+                if pool.adaptive:
+                    pool.adapt(self.latency)
+
+    def stats(self):
+        pools = self.get_pools()
+        return {
+            'pid': self.pid,
+            'disk_latency': self.latency,
+            'pools': {name: pool.stats() for name, pool in pools.items()},
+        }
+
+
+controller = AdmissionController()
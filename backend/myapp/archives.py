@@ -0,0 +1,79 @@
+import os
+import zipfile
+from django.conf import settings
+from .downloads import open_file
+
+
+# Уже сжатые форматы кладем в архив без повторного сжатия
+STORED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.ogg', '.flac', '.aac', '.mp4', '.mkv', '.mov', '.avi', '.webm',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.apk', '.jar',
+}
+
+
+# Приемник без seek: zipfile пишет data descriptor после каждой записи
+# и не возвращается назад, поэтому архив можно отдавать по мере создания
+class StreamSink:
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def archive_names(files):
+    used = set()
+    for file_storage in files:
+        name = os.path.basename(file_storage.original_name.replace('\\', '/')) or file_storage.name
+        base, ext = os.path.splitext(name)
+        counter = 1
+        while name in used:
+            name = f'{base} ({counter}){ext}'
+            counter += 1
+        used.add(name)
+        yield file_storage, name
+
+
+# Генератор ZIP-архива (с ZIP64 для больших файлов) без временных файлов:
+# в памяти держится не больше одного блока чтения и заголовков записей.
+# on_member вызывается для каждого файла, целиком записанного в архив
+def zip_stream(files, on_member=None):
+    block_size = settings.FILE_DOWNLOAD_BLOCK_SIZE
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for file_storage, name in archive_names(files):
+            info = zipfile.ZipInfo(name, date_time=file_storage.upload_date.timetuple()[:6])
+            info.file_size = file_storage.size
+            info.external_attr = 0o644 << 16
+            if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            with archive.open(info, 'w', force_zip64=file_storage.size >= zipfile.ZIP64_LIMIT) as entry:
+                with open_file(file_storage) as source:
+                    for block in iter(lambda: source.read(block_size), b''):
+                        entry.write(block)
+                        data = sink.pop()
+                        if data:
+                            yield data
+            yield sink.pop()
+            if on_member is not None:
+                on_member(file_storage)
+    yield sink.pop()
@@ -0,0 +1,94 @@
+import copy
+import time
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import salted_hmac
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .caching import MISSING, TTLCache
+from .models import CustomUser
+
+
+# Токены доступа для API-клиентов: подписанные SECRET_KEY id пользователя и отпечаток,
+# живут AUTH_TOKEN_TTL секунд. Проверка - подпись и кеш пользователей процесса, без
+# запросов к БД, без сессии и без хеширования пароля на каждый запрос.
+# Ключ Token (rest_framework.authtoken) служит токеном обновления. Отпечаток построен
+# из ключа и хеша пароля, поэтому отзыв (удаление Token) и смена пароля делают
+# недействительными все выданные токены доступа: в этом процессе сразу,
+# в остальных - после истечения записи кеша (AUTH_TOKEN_USER_CACHE_TTL).
+TOKEN_SALT = 'myapp.authentication.access-token'
+
+# {id пользователя: (пользователь, отпечаток, время загрузки)}; у удаленных,
+# неактивных и не имеющих Token пользователь и отпечаток - None
+_users = TTLCache(settings.AUTH_TOKEN_USER_CACHE_SIZE)
+
+
+def fingerprint(user, token_key):
+    return salted_hmac(TOKEN_SALT, f'{token_key}:{user.password}').hexdigest()[:16]
+
+
+def issue_tokens(user, token):
+    payload = {'u': user.pk, 'f': fingerprint(user, token.key), 't': time.time()}
+    access = signing.dumps(payload, salt=TOKEN_SALT)
+    return {
+        'access': access,
+        'refresh': token.key,
+        'token_type': 'Bearer',
+        'expires_in': settings.AUTH_TOKEN_TTL,
+    }
+
+
+def load_user(user_id):
+    user = CustomUser.objects.select_related('auth_token').filter(pk=user_id, is_active=True).first()
+    token = getattr(user, 'auth_token', None) if user is not None else None
+    entry = (user, fingerprint(user, token.key), time.time()) if token is not None else (None, None, time.time())
+    _users.set(user_id, entry, settings.AUTH_TOKEN_USER_CACHE_TTL)
+    return entry
+
+
+# Пользователь для токена. Запись кеша старше токена могла не застать его выдачу
+# (новый вход после отзыва) - тогда при несовпадении она перечитывается один раз
+def cached_user(payload):
+    entry = _users.get(payload['u'])
+    if entry is MISSING:
+        entry = load_user(payload['u'])
+    elif entry[1] != payload['f'] and entry[2] <= payload['t']:
+        entry = load_user(payload['u'])
+    return entry[0] if entry[1] == payload['f'] else None
+
+
+def forget_user(user_id):
+    _users.delete(user_id)
+
+
+def revoke_tokens(user):
+    Token.objects.filter(user=user).delete()
+    forget_user(user.pk)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Некорректный заголовок Authorization')
+
+        try:
+            payload = signing.loads(auth[1].decode(), salt=TOKEN_SALT, max_age=settings.AUTH_TOKEN_TTL)
+        except signing.SignatureExpired:
+            raise AuthenticationFailed('Срок действия токена истек')
+        except (signing.BadSignature, UnicodeError):
+            raise AuthenticationFailed('Недействительный токен')
+
+        user = cached_user(payload)
+        if user is None:
+            raise AuthenticationFailed('Токен отозван')
+        # Запрос получает свою копию: объект из кеша общий для всех потоков процесса
+        return copy.copy(user), auth[1]
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,37 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+
+# Пул потоков для работы, которую не нужно делать внутри запроса (удаление файлов с диска и т.п.)
+_executor = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _pid
+    with _lock:
+        # После fork воркера потоки родителя недоступны, создаем пул заново
+        if _executor is None or _pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS,
+                thread_name_prefix='background'
+            )
+            _pid = os.getpid()
+        return _executor
+
+
+def run_task(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        print(f"Ошибка фоновой задачи {fn.__name__}: {str(e)}")
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args):
+    return get_executor().submit(run_task, fn, *args)
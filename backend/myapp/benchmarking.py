@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from .download_stats import recorder
+from .models import CustomUser, FileStorage
+
+
+# Пользователи замера: с commit=True они удаляются вместе с файлами по выходе из окружения
+_created_users = []
+
+
+# Окружение для команд benchmark_*: хранилище во временном каталоге, все записи в БД
+# откатываются по выходе. Фоновые задачи, ограничения полосы и допуск запросов
+# выключены, чтобы замер показывал только сам путь запроса. Статистика скачиваний
+# копится в буфере, как в рабочей конфигурации, и сбрасывается в той же транзакции
+# перед откатом: поток сброса со своим соединением строк замера не видит.
+# Замерам с несколькими потоками нужны зафиксированные строки (commit=True): у каждого
+# потока свое соединение, и незафиксированных данных он не увидит
+@contextmanager
+def bench_environment(commit=False, **overrides):
+    root = tempfile.mkdtemp(prefix='bench-')
+    options = {
+        'DEBUG': False,
+        'ALLOWED_HOSTS': ['testserver'],
+        'MEDIA_ROOT': os.path.join(root, 'media'),
+        'FILE_STORAGE_BASE_DIR': os.path.join(root, 'storage'),
+        'STORAGES': {
+            'default': {'BACKEND': 'myapp.storage_backends.LocalStorage'},
+            'cold': {'BACKEND': 'myapp.storage_backends.LocalStorage', 'OPTIONS': {'location': os.path.join(root, 'cold')}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        },
+        'UPLOAD_PIPELINE_ENABLED': False,
+        'DOWNLOAD_STATS_FLUSH_INTERVAL': 3600,
+        'DELETION_REAP_IMMEDIATELY': False,
+        'TIERING_REHYDRATE_ON_DOWNLOAD': False,
+        'STORAGE_COMPRESSION': False,
+        'ADMISSION_CONTROL_ENABLED': False,
+        'BANDWIDTH_DOWNLOAD_LIMIT': 0,
+        'BANDWIDTH_UPLOAD_LIMIT': 0,
+        'BANDWIDTH_USER_LIMIT': 0,
+        'BANDWIDTH_SHARE_LINK_LIMIT': 0,
+        **overrides,
+    }
+    try:
+        with override_settings(**options):
+            if commit:
+                try:
+                    yield root
+                    recorder.flush()
+                finally:
+                    remove_created_users()
+            else:
+                with transaction.atomic():
+                    yield root
+                    recorder.flush()
+                    transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def remove_created_users():
+    users = list(_created_users)
+    _created_users.clear()
+    FileStorage.all_objects.filter(owner_id__in=users).delete()
+    CustomUser.objects.filter(pk__in=users).delete()
+
+
+def create_user(password='bench-password', **kwargs):
+    username = f'bench-{uuid.uuid4().hex[:12]}'
+    user = CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password=password, **kwargs)
+    _created_users.append(user.pk)
+    return user
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+# Файлы старого формата (без блоба): содержимое пишется в хранилище, строки - одним bulk_create
+def create_files(owner, count, size=0, names=None, batch_size=1000):
+    files = []
+    for i in range(count):
+        pk = uuid.uuid4()
+        name = f'{pk}.bin'
+        stored = default_storage.save(f'files/{name}', ContentFile(os.urandom(size))) if size else f'files/{name}'
+        files.append(FileStorage(
+            id=pk, owner=owner, original_name=names[i] if names else f'file{i}.bin',
+            name=name, file=stored, size=size,
+        ))
+    FileStorage.objects.bulk_create(files, batch_size=batch_size)
+    CustomUser.objects.filter(pk=owner.pk).update(
+        file_count=F('file_count') + count, total_size=F('total_size') + count * size
+    )
+    return files
+
+
+# Счетчик запросов для connection.execute_wrapper: журнал connection.queries ограничен 9000 записями
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# Пик памяти Python-объектов (tracemalloc) за время вызова
+def peak_memory(fn, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        result = fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.1f} мс'
+
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ТБ'
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from . import compression, quotas, shaping
+from .models import Blob, sharded_name, thumbnail_name
+from .storage_backends import delete_stored
+
+
+HASH_BLOCK_SIZE = 1048576
+
+
+def blob_name(digest, compressed=False):
+    suffix = compression.COMPRESSED_SUFFIX if compressed else ''
+    return sharded_name('blobs', digest, digest + suffix)
+
+
+# Временные файлы лежат на том же разделе, что и MEDIA_ROOT, поэтому в локальном
+# хранилище фиксация - это жесткая ссылка, а не копия
+def blob_tmp_dir():
+    path = os.path.join(settings.MEDIA_ROOT, 'blobs', 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=blob_tmp_dir())
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = hashlib.sha256()
+        self.digest = None
+
+
+# Обработчик загрузки: считает SHA-256 по мере поступления данных, без повторного чтения файла.
+# До приема тела резервирует место в квоте по Content-Length, слишком большая загрузка
+# отклоняется, не записав ни байта; резерв снимает release_quota() по окончании запроса.
+# Скорость приема ограничивается паузами между частями (shaping).
+class BlobUploadHandler(FileUploadHandler):
+    reserved = None
+    transfer = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        if shaping.is_enabled():
+            self.transfer = shaping.transfer('upload', user)
+        if content_length:
+            if not quotas.reserve(user.pk, content_length):
+                raise quotas.QuotaExceeded()
+            self.reserved = (user.pk, content_length)
+        return None
+
+    def release_quota(self):
+        if self.reserved is not None:
+            quotas.release(*self.reserved)
+            self.reserved = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.sha256.update(raw_data)
+        self.file.write(raw_data)
+        # Пауза перед чтением следующей части ограничивает скорость приема
+        if self.transfer is not None:
+            self.transfer.throttle(len(raw_data))
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.digest = self.file.sha256.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+# Берет ссылку на блоб по хешу; None, если такого содержимого в хранилище нет
+def acquire(digest):
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=digest).first()
+        if blob is None:
+            return None
+        blob.ref_count += 1
+        blob.save(update_fields=['ref_count'])
+        return blob
+
+
+# Кладет содержимое в хранилище: сжимаемое - в seekable zstd, остальное как есть.
+# Возвращает (имя в хранилище, байт в хранилище)
+def put_content(source_path, digest, size):
+    if not compression.is_compressible(source_path, size):
+        name = blob_name(digest)
+        default_storage.put_file(name, source_path)
+        return name, size
+
+    name = blob_name(digest, compressed=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=compression.COMPRESSED_SUFFIX, dir=blob_tmp_dir())
+    os.close(fd)
+    try:
+        stored_size = compression.compress_file(source_path, tmp_path)
+        default_storage.put_file(name, tmp_path)
+    finally:
+        os.remove(tmp_path)
+    return name, stored_size
+
+
+# Кладет файл с диска в хранилище (или переиспользует существующий блоб) и берет на него ссылку
+def store(source_path, digest, size):
+    blob = acquire(digest)
+    if blob is not None:
+        return blob
+
+    name, stored_size = put_content(source_path, digest, size)
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(digest=digest, file=name, size=size, stored_size=stored_size, ref_count=1)
+    except IntegrityError:
+        # Параллельная загрузка того же содержимого успела создать запись
+        return acquire(digest)
+
+
+def store_upload(uploaded_file):
+    return store(uploaded_file.temporary_file_path(), uploaded_file.digest, uploaded_file.size)
+
+
+# Отпускает ссылки на блоб. Запись с нулем ссылок остается до reap(): пока она есть,
+# параллельная загрузка того же содержимого переиспользует файл, а не теряет его.
+# Возвращает True, если ссылок больше не осталось.
+def release(digest, count=1):
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=digest).first()
+        if blob is None:
+            return False
+        blob.ref_count = max(blob.ref_count - count, 0)
+        blob.save(update_fields=['ref_count'])
+        return blob.ref_count == 0
+
+
+# Удаляет файл блоба без ссылок; под блокировкой строки, чтобы не гоняться с acquire()
+def reap(digest):
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=digest, ref_count=0).first()
+        if blob is None:
+            return False
+        delete_stored(blob.file.name)
+        delete_stored(thumbnail_name(digest))
+        blob.delete()
+        return True
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+
+MISSING = object()
+
+
+# Потокобезопасный LRU-кеш процесса с временем жизни записей
+class TTLCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return MISSING
+            value, expires = item
+            if expires <= time.monotonic():
+                del self.data[key]
+                return MISSING
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+# Разрешение публичных ссылок без запроса к БД на каждое обращение.
+# Уровень 1 - LRU процесса с коротким TTL, уровень 2 - общий кеш Django
+# (SHARE_LINK_CACHE_ALIAS), который инвалидируется при изменении файла сразу для всех воркеров.
+# Неизвестные ссылки тоже кешируются, чтобы перебор ссылок не нагружал БД.
+class ShareLinkCache:
+    # Поля FileStorage, достаточные для отдачи файла по ссылке
+    fields = (
+        'id', 'original_name', 'name', 'file', 'size', 'owner_id', 'blob_id',
+        'upload_date', 'share_link', 'share_link_expiry', 'share_link_max_downloads',
+    )
+    not_found = 'not-found'
+
+    def __init__(self):
+        self.local = TTLCache(settings.SHARE_LINK_CACHE_SIZE)
+
+    @property
+    def shared(self):
+        alias = settings.SHARE_LINK_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def key(self, share_link):
+        return f'share-link:{share_link.hex}'
+
+    def resolve(self, share_link):
+        from .models import FileStorage
+        key = self.key(share_link)
+
+        entry = self.local.get(key)
+        if entry is MISSING and self.shared is not None:
+            entry = self.shared.get(key, MISSING)
+            if entry is not MISSING:
+                self.local.set(key, entry, self.ttl(entry, settings.SHARE_LINK_LOCAL_TTL))
+
+        if entry is MISSING:
+            row = FileStorage.objects.filter(share_link=share_link).values(*self.fields).first()
+            entry = row if row is not None else self.not_found
+            self.store(key, entry)
+
+        if entry == self.not_found:
+            return None
+        return FileStorage(**entry)
+
+    # Запись живет не дольше срока действия ссылки
+    def ttl(self, entry, ttl):
+        if entry == self.not_found:
+            return min(ttl, settings.SHARE_LINK_NEGATIVE_TTL)
+        expiry = entry['share_link_expiry']
+        if expiry:
+            ttl = min(ttl, max((expiry - timezone.now()).total_seconds(), 1))
+        return ttl
+
+    def store(self, key, entry):
+        self.local.set(key, entry, self.ttl(entry, settings.SHARE_LINK_LOCAL_TTL))
+        if self.shared is not None:
+            self.shared.set(key, entry, self.ttl(entry, settings.SHARE_LINK_CACHE_TTL))
+
+    def invalidate(self, share_link):
+        if not share_link:
+            return
+        key = self.key(share_link)
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+
+share_links = ShareLinkCache()
@@ -0,0 +1,157 @@
+import bisect
+import io
+import struct
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Сжатые блобы хранятся в seekable-формате zstd: независимые кадры по
+# STORAGE_COMPRESSION_FRAME_SIZE исходных байт и таблица кадров в skippable-кадре в конце.
+# Такой файл - обычный поток zstd, его можно отдать клиенту как есть (Content-Encoding: zstd),
+# а произвольный диапазон читается распаковкой только нужных кадров.
+COMPRESSED_SUFFIX = '.zst'
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+FOOTER = struct.Struct('<IBI')  # число кадров, дескриптор, сигнатура
+ENTRY = struct.Struct('<II')  # сжатый размер, исходный размер
+CHECKSUM_FLAG = 0x80
+
+
+def is_compressed(name):
+    return name.endswith(COMPRESSED_SUFFIX)
+
+
+def is_compressible(path, size):
+    return settings.STORAGE_COMPRESSION and probe(path, size)
+
+
+# Пробное сжатие быстрым уровнем по нескольким кускам файла: начало, середина, конец
+def probe(path, size):
+    if zstandard is None or size < settings.STORAGE_COMPRESSION_MIN_SIZE:
+        return False
+
+    probe_size = settings.STORAGE_COMPRESSION_PROBE_SIZE
+    compressor = zstandard.ZstdCompressor(level=1)
+    raw = packed = 0
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(size // 2 - probe_size // 2, 0), max(size - probe_size, 0)}):
+            f.seek(offset)
+            data = f.read(probe_size)
+            raw += len(data)
+            packed += len(compressor.compress(data))
+    return packed <= raw * settings.STORAGE_COMPRESSION_MAX_RATIO
+
+
+# Сжимает файл в seekable-формат, возвращает размер результата
+def compress_file(source_path, target_path):
+    compressor = zstandard.ZstdCompressor(level=settings.STORAGE_COMPRESSION_LEVEL)
+    frame_size = settings.STORAGE_COMPRESSION_FRAME_SIZE
+    table = []
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        for block in iter(lambda: src.read(frame_size), b''):
+            frame = compressor.compress(block)
+            dst.write(frame)
+            table.append(ENTRY.pack(len(frame), len(block)))
+        table.append(FOOTER.pack(len(table), 0, SEEKABLE_MAGIC))
+        seek_table = b''.join(table)
+        dst.write(struct.pack('<II', SKIPPABLE_MAGIC, len(seek_table)))
+        dst.write(seek_table)
+        return dst.tell()
+
+
+# Распакованное представление сжатого файла с произвольным доступом.
+# raw - любой файловый объект хранилища с seek/read (локальный файл, S3File).
+class SeekableZstdFile(io.RawIOBase):
+    def __init__(self, raw):
+        super().__init__()
+        self.raw = raw
+        self.offsets = [0]
+        self.compressed_offsets = [0]
+        self.read_seek_table()
+        self.size = self.offsets[-1]
+        self.position = 0
+        self.frame_index = None
+        self.frame = b''
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    # Файлы хранилища могут отдавать данные частями (S3File - окнами), дочитываем до конца
+    def read_exact(self, size):
+        chunks = []
+        while size > 0:
+            data = self.raw.read(size)
+            if not data:
+                raise ValueError('Сжатый файл обрезан')
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def read_seek_table(self):
+        self.raw.seek(-FOOTER.size, io.SEEK_END)
+        count, descriptor, magic = FOOTER.unpack(self.read_exact(FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            raise ValueError('Файл не в seekable-формате zstd')
+        entry_size = ENTRY.size + (4 if descriptor & CHECKSUM_FLAG else 0)
+        self.raw.seek(-(FOOTER.size + count * entry_size), io.SEEK_END)
+        table = self.read_exact(count * entry_size)
+        for index in range(count):
+            compressed, decompressed = ENTRY.unpack_from(table, index * entry_size)
+            self.compressed_offsets.append(self.compressed_offsets[-1] + compressed)
+            self.offsets.append(self.offsets[-1] + decompressed)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def load_frame(self, index):
+        start = self.compressed_offsets[index]
+        self.raw.seek(start)
+        data = self.read_exact(self.compressed_offsets[index + 1] - start)
+        self.frame = self.decompressor.decompress(data)
+        self.frame_index = index
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index = bisect.bisect_right(self.offsets, self.position) - 1
+        if index != self.frame_index:
+            self.load_frame(index)
+        start = self.position - self.offsets[index]
+        data = self.frame[start:start + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+# Принимает ли клиент ответ в zstd (Accept-Encoding с ненулевым q)
+def accepts_zstd(request):
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() != 'zstd':
+            continue
+        params = params.strip().replace(' ', '')
+        try:
+            return not params.startswith('q=') or float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
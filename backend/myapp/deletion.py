@@ -0,0 +1,89 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from . import background, blobstore
+from .caching import share_links
+from .models import Blob, CustomUser, FileStorage
+from .storage_backends import delete_stored
+
+
+# Удаление в два этапа: сначала строки помечаются удаленными (deleted_at) и сразу
+# пропадают из API, а файлы с диска и сами строки убирает reap_files в фоне.
+# Счетчики пользователей и кеш ссылок обновляются на первом этапе.
+def tombstone_files(file_ids):
+    with transaction.atomic():
+        rows = list(
+            FileStorage.objects.select_for_update()
+            .filter(pk__in=file_ids)
+            .values('id', 'owner_id', 'size', 'share_link')
+        )
+        if not rows:
+            return []
+
+        ids = [row['id'] for row in rows]
+        FileStorage.all_objects.filter(pk__in=ids).update(
+            deleted_at=timezone.now(),
+            share_link=None,
+            share_link_expiry=None,
+        )
+
+        owners = {}
+        for row in rows:
+            count, size = owners.get(row['owner_id'], (0, 0))
+            owners[row['owner_id']] = (count + 1, size + row['size'])
+        for owner_id, (count, size) in owners.items():
+            CustomUser.objects.filter(pk=owner_id).update(
+                file_count=F('file_count') - count,
+                total_size=F('total_size') - size,
+            )
+
+        if settings.DELETION_REAP_IMMEDIATELY:
+            transaction.on_commit(lambda: background.submit(reap_files, ids))
+
+    for row in rows:
+        share_links.invalidate(row['share_link'])
+    return ids
+
+
+# Окончательное удаление помеченных строк пачкой: ссылки на блобы отпускаются
+# в транзакции, файлы удаляются из хранилища пулом из DELETION_IO_WORKERS потоков.
+# Повторный запуск после сбоя безопасен: недоудаленное подберется следующим проходом.
+def reap_files(file_ids=None, batch_size=None, workers=None):
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    workers = workers or settings.DELETION_IO_WORKERS
+
+    with transaction.atomic():
+        tombstones = FileStorage.all_objects.filter(deleted_at__isnull=False)
+        if file_ids is not None:
+            tombstones = tombstones.filter(pk__in=file_ids)
+        rows = list(tombstones.order_by('deleted_at').values('id', 'blob_id', 'file', 'thumbnail')[:batch_size])
+
+        FileStorage.all_objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        released = Counter(row['blob_id'] for row in rows if row['blob_id'])
+        for digest, count in released.items():
+            blobstore.release(digest, count)
+
+    legacy = [row['file'] for row in rows if not row['blob_id'] and row['file']]
+    # Превью блоба общее для всех его файлов и удаляется вместе с блобом
+    legacy += [row['thumbnail'] for row in rows if not row['blob_id'] and row['thumbnail']]
+    orphaned = list(Blob.objects.filter(ref_count=0).values_list('pk', flat=True)[:batch_size])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(delete_stored, legacy))
+        reaped = sum(executor.map(blobstore.reap, orphaned))
+    return len(rows), reaped
+
+
+# Пометка на удаление всех файлов пользователя пачками по DELETION_BATCH_SIZE
+def tombstone_owner_files(user):
+    ids = list(FileStorage.objects.filter(owner=user).values_list('pk', flat=True))
+    for start in range(0, len(ids), settings.DELETION_BATCH_SIZE):
+        tombstone_files(ids[start:start + settings.DELETION_BATCH_SIZE])
+
+
+def remove_session_files(sessions):
+    for session in sessions:
+        session.remove_file()
@@ -0,0 +1,94 @@
+import atexit
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.utils import timezone
+
+
+# Буфер статистики скачиваний: last_download и download_count копятся в памяти процесса
+# и раз в DOWNLOAD_STATS_FLUSH_INTERVAL секунд пишутся в БД пакетными UPDATE.
+# Запрос на скачивание больше не ждет записи в БД, а горячая строка популярной
+# ссылки обновляется одним запросом на интервал, а не на каждое скачивание.
+class DownloadRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.thread = None
+        self.pid = None
+
+    def record(self, file_id, when=None):
+        when = when or timezone.now()
+        if settings.DOWNLOAD_STATS_FLUSH_INTERVAL <= 0:
+            # Буферизация выключена: пишем сразу, как раньше
+            self.write({file_id: (when, 1)})
+            return
+
+        with self.lock:
+            last, count = self.pending.get(file_id, (when, 0))
+            self.pending[file_id] = (max(last, when), count + 1)
+            overflow = len(self.pending) >= settings.DOWNLOAD_STATS_MAX_PENDING
+        self.ensure_flusher()
+        if overflow:
+            self.flush()
+
+    # Ожидающие записи для файла, еще не попавшие в БД
+    def pending_for(self, file_id):
+        with self.lock:
+            return self.pending.get(file_id, (None, 0))
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            self.write(pending)
+        except Exception as e:
+            print(f"Ошибка при сохранении статистики скачиваний: {str(e)}")
+            # Возвращаем несохраненное в буфер, чтобы не потерять счетчики
+            with self.lock:
+                for file_id, (when, count) in pending.items():
+                    last, current = self.pending.get(file_id, (when, 0))
+                    self.pending[file_id] = (max(last, when), current + count)
+
+    def write(self, pending):
+        from .models import FileStorage
+        items = list(pending.items())
+        batch_size = settings.DOWNLOAD_STATS_BATCH_SIZE
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i + batch_size]
+            FileStorage.objects.filter(pk__in=[file_id for file_id, _ in batch]).update(
+                last_download=Case(
+                    *[When(pk=file_id, then=Value(when)) for file_id, (when, _) in batch],
+                    output_field=DateTimeField(),
+                ),
+                download_count=F('download_count') + Case(
+                    *[When(pk=file_id, then=Value(count)) for file_id, (_, count) in batch],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ),
+            )
+
+    # Фоновый поток запускается лениво и заново после fork воркера
+    def ensure_flusher(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='download-stats', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.DOWNLOAD_STATS_FLUSH_INTERVAL)
+            self.flush()
+            close_old_connections()
+
+
+recorder = DownloadRecorder()
+atexit.register(recorder.flush)
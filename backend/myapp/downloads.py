@@ -0,0 +1,237 @@
+import mimetypes
+import re
+import uuid
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import salted_hmac
+from django.utils.http import http_date, parse_http_date_safe
+from . import compression
+from .storage_backends import is_cold, is_local, locate
+
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+ETAG_SALT = 'myapp.downloads.etag'
+
+
+# Строгий валидатор: содержимое записи FileStorage после загрузки не меняется.
+# Сжатое представление (Content-Encoding: zstd) - другой набор байт, у него свой ETag.
+# Для блобов это HMAC от SHA-256, а не сам хеш: ETag виден по публичной ссылке,
+# а хеш содержимого наружу не отдается.
+def file_etag(file_storage, encoding=None):
+    if file_storage.blob_id:
+        etag = salted_hmac(ETAG_SALT, file_storage.blob_id).hexdigest()
+    else:
+        etag = f'{file_storage.id.hex}-{file_storage.size}'
+    if encoding:
+        etag = f'{etag}-{encoding}'
+    return f'"{etag}"'
+
+
+def file_last_modified(file_storage):
+    return int(file_storage.upload_date.timestamp())
+
+
+def file_content_type(file_storage):
+    content_type, _ = mimetypes.guess_type(file_storage.original_name)
+    return content_type or 'application/octet-stream'
+
+
+# Байты в том виде, в каком они лежат в хранилище
+def open_stored_file(file_storage):
+    storage, key = locate(file_storage.file.name)
+    return storage.open(key, 'rb')
+
+
+# Исходное содержимое по имени в хранилище; сжатое распаковывается на лету
+def open_content(name):
+    storage, key = locate(name)
+    f = storage.open(key, 'rb')
+    if compression.is_compressed(name):
+        return compression.SeekableZstdFile(f)
+    return f
+
+
+def open_file(file_storage):
+    return open_content(file_storage.file.name)
+
+
+# Разбор заголовка Range. None - заголовок нужно игнорировать и отдать файл целиком,
+# [] - ни один диапазон не попадает в файл (416)
+def parse_range_header(header, size):
+    if not header or not header.startswith('bytes=') or size == 0:
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        match = RANGE_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            # Суффиксный диапазон: последние N байт
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last != '' else size - 1
+            if last != '' and end < start:
+                return None
+            if start >= size:
+                continue
+            end = min(end, size - 1)
+        ranges.append([start, end])
+
+    if len(ranges) > settings.FILE_DOWNLOAD_MAX_RANGES:
+        return None
+
+    # Сливаем пересекающиеся и соседние диапазоны
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+# If-Range: диапазон отдается, только если валидатор совпадает с текущим
+def if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def read_range(opener, start, length):
+    block_size = settings.FILE_DOWNLOAD_BLOCK_SIZE
+    with opener() as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def multipart_ranges(opener, parts, boundary):
+    for header, start, end in parts:
+        yield header
+        yield from read_range(opener, start, end - start + 1)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+# Ответ 200/206/416 по заголовку Range; opener открывает файл только при отдаче тела
+def range_response(request, opener, size, content_type, use_range=True):
+    ranges = parse_range_header(request.META.get('HTTP_RANGE'), size) if use_range else None
+
+    if ranges is None:
+        response = FileResponse(opener(), content_type=content_type)
+        response['Content-Length'] = size
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            read_range(opener, start, end - start + 1),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(),
+                start,
+                end
+            )
+            for start, end in ranges
+        ]
+        content_length = sum(len(header) + end - start + 1 + 2 for header, start, end in parts)
+        content_length += len(f'--{boundary}--\r\n')
+        response = StreamingHttpResponse(
+            multipart_ranges(opener, parts, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = content_length
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+# Передача файла фронтовому прокси через внутренний редирект (nginx X-Accel-Redirect
+# или X-Sendfile для apache/lighttpd). Range прокси обрабатывает сам. Работает только
+# с локальным хранилищем; из S3 файл отдается напрямую ranged GET-запросами.
+def offload_response(file_storage, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.FILE_DELIVERY_BACKEND == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.FILE_DELIVERY_ACCEL_PREFIX + quote(file_storage.file.name)
+    else:
+        response['X-Sendfile'] = file_storage.file.path
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+# Сжатый файл отдается как есть; Content-Length - размер в хранилище
+def encoded_response(file_storage, content_type):
+    storage, key = locate(file_storage.file.name)
+    response = FileResponse(open_stored_file(file_storage), content_type=content_type)
+    response['Content-Length'] = storage.size(key)
+    response['Content-Encoding'] = 'zstd'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def file_response(request, file_storage, as_attachment=True):
+    compressed = compression.is_compressed(file_storage.file.name)
+    # Диапазоны считаются по исходному содержимому, поэтому с Range файл распаковывается
+    encoded = compressed and not request.META.get('HTTP_RANGE') and compression.accepts_zstd(request)
+    etag = file_etag(file_storage, 'zstd' if encoded else None)
+    last_modified = file_last_modified(file_storage)
+    content_type = file_content_type(file_storage)
+
+    # 304/412 отдаются до открытия файла на диске
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        if encoded:
+            response = encoded_response(file_storage, content_type)
+        elif (settings.FILE_DELIVERY_BACKEND != 'direct' and is_local() and
+              not compressed and not is_cold(file_storage.file.name)):
+            # Прокси видит только горячий MEDIA_ROOT и не умеет распаковывать seekable zstd
+            response = offload_response(file_storage, content_type)
+        else:
+            response = range_response(
+                request,
+                lambda: open_file(file_storage),
+                file_storage.size,
+                content_type,
+                use_range=if_range_passes(request, etag, last_modified)
+            )
+    else:
+        response['Accept-Ranges'] = 'bytes'
+
+    if compressed:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    disposition = 'attachment' if as_attachment else 'inline'
+    response['Content-Disposition'] = f'{disposition}; filename="{file_storage.original_name}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
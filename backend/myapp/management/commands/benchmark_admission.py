@@ -0,0 +1,96 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from myapp.benchmarking import bench_environment, client_for, create_files, create_user, format_ms, percentile
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер допуска запросов: задержка вызовов метаданных (список файлов) '
+            'без нагрузки, во время шторма скачиваний без допуска и с допуском. Данные '
+            'создаются во временном хранилище и удаляются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transfers', type=int, default=64,
+                            help='Потоков, непрерывно скачивающих файлы')
+        parser.add_argument('--metadata', type=int, default=4,
+                            help='Потоков, запрашивающих список файлов')
+        parser.add_argument('--size', type=int, default=8,
+                            help='Размер скачиваемого файла, МБ')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность каждой фазы, секунд')
+        parser.add_argument('--retry-delay', type=float, default=0.5,
+                            help='Пауза скачивающего потока после ответа 503, секунд')
+
+    def transfer(self, user, urls, stop, result):
+        client = client_for(user)
+        try:
+            while not stop.is_set():
+                response = client.get(urls[result['completed'] % len(urls)])
+                if response.status_code == 503:
+                    result['rejected'] += 1
+                    stop.wait(self.retry_delay)
+                    continue
+                for _ in response.streaming_content:
+                    pass
+                result['completed'] += 1
+        finally:
+            connection.close()
+
+    def metadata(self, user, stop, result):
+        client = client_for(user)
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = client.get('/api/files/?page_size=20')
+                result['times'].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    result['failed'] += 1
+                stop.wait(0.01)
+        finally:
+            connection.close()
+
+    def phase(self, label, user, urls, transfers):
+        stop = threading.Event()
+        transfer_results = [{'completed': 0, 'rejected': 0} for _ in range(transfers)]
+        metadata_results = [{'times': [], 'failed': 0} for _ in range(self.metadata_threads)]
+        threads = [
+            threading.Thread(target=self.transfer, args=(user, urls, stop, result)) for result in transfer_results
+        ] + [
+            threading.Thread(target=self.metadata, args=(user, stop, result)) for result in metadata_results
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(self.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        times = [t for result in metadata_results for t in result['times']]
+        completed = sum(result['completed'] for result in transfer_results)
+        rejected = sum(result['rejected'] for result in transfer_results)
+        failed = sum(result['failed'] for result in metadata_results)
+        self.stdout.write(
+            f'{label}: метаданные p50 {format_ms(percentile(times, 0.5))}, p99 {format_ms(percentile(times, 0.99))} '
+            f'({len(times)} вызовов, ошибок {failed}); скачиваний {completed}, отклонено 503: {rejected}'
+        )
+
+    def handle(self, *args, **options):
+        self.metadata_threads = options['metadata']
+        self.duration = options['duration']
+        self.retry_delay = options['retry_delay']
+        size = options['size'] * 1024 * 1024
+
+        with bench_environment(commit=True):
+            user = create_user()
+            files = create_files(user, 8, size)
+            create_files(user, 200)
+            urls = [f'/api/files/{f.pk}/download/' for f in files]
+
+            self.phase('без нагрузки', user, urls, 0)
+            self.phase('шторм без допуска', user, urls, options['transfers'])
+            # Клиент загружает middleware при первом запросе: в этой фазе - уже с допуском
+            with override_settings(ADMISSION_CONTROL_ENABLED=True):
+                self.phase('шторм с допуском', user, urls, options['transfers'])
+        self.stdout.write(self.style.SUCCESS('Готово'))
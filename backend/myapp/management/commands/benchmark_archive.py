@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from myapp.benchmarking import (
+    bench_environment, client_for, create_files, create_user, format_ms, format_size, peak_memory, timed,
+)
+
+
+class Command(BaseCommand):
+    help = ('Замер скачивания ZIP-архива из многих файлов: скорость отдачи и пик памяти для записей '
+            'без сжатия (stored) и со сжатием (deflate). Данные создаются во временном хранилище '
+            'и откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=200,
+                            help='Файлов в архиве')
+        parser.add_argument('--size', type=int, default=1024,
+                            help='Размер каждого файла, КБ')
+
+    def download(self, client, ids):
+        response = client.post('/api/files/archive/', {'ids': ids}, format='json')
+        return sum(len(chunk) for chunk in response.streaming_content)
+
+    def handle(self, *args, **options):
+        size = options['size'] * 1024
+        # Расширение определяет способ записи: .jpg кладется как есть, .txt сжимается
+        for label, ext in (('stored', 'jpg'), ('deflate', 'txt')):
+            with bench_environment():
+                user = create_user()
+                names = [f'file{i}.{ext}' for i in range(options['files'])]
+                ids = [str(f.pk) for f in create_files(user, options['files'], size, names=names)]
+                client = client_for(user)
+
+                sent, elapsed = timed(self.download, client, ids)
+                _, peak = peak_memory(self.download, client, ids)
+            total = options['files'] * size
+            self.stdout.write(
+                f'{label}: {options["files"]} файлов, {format_size(total)} за {format_ms(elapsed)} '
+                f'({format_size(total / elapsed)}/с), архив {format_size(sent)}, пик памяти Python {format_size(peak)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Готово'))
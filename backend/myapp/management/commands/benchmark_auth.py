@@ -0,0 +1,66 @@
+import base64
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+from myapp.benchmarking import QueryCounter, bench_environment, create_user, format_ms, percentile
+
+
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = ('Замер пропускной способности API при разных способах аутентификации: сессия в БД, '
+            'HTTP Basic и подписанный токен. Данные создаются в транзакции и откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждый способ')
+        parser.add_argument('--basic-requests', type=int, default=20,
+                            help='Запросов с HTTP Basic: каждый проверяет пароль хешером')
+
+    # Клиент и заголовки запроса для каждого способа
+    def session(self, user):
+        client = APIClient()
+        client.login(username=user.username, password=PASSWORD)
+        return client, {}
+
+    def basic(self, user):
+        credentials = base64.b64encode(f'{user.username}:{PASSWORD}'.encode()).decode()
+        return APIClient(), {'HTTP_AUTHORIZATION': f'Basic {credentials}'}
+
+    def token(self, user):
+        client = APIClient()
+        tokens = client.post('/api/token/', {'username': user.username, 'password': PASSWORD}, format='json').json()
+        return client, {'HTTP_AUTHORIZATION': f'Bearer {tokens["access"]}'}
+
+    def run(self, client, headers, count):
+        # Первый запрос прогревает кеши (пользователь токена, импорт модулей)
+        client.get('/api/profile/', **headers)
+        times = []
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get('/api/profile/', **headers)
+                times.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f'Ответ {response.status_code}: {response.content[:200]}')
+        return times, queries.count
+
+    def handle(self, *args, **options):
+        with bench_environment():
+            user = create_user(password=PASSWORD)
+            schemes = (
+                ('сессия', self.session, options['requests']),
+                ('HTTP Basic', self.basic, options['basic_requests']),
+                ('подписанный токен', self.token, options['requests']),
+            )
+            for label, make_client, count in schemes:
+                client, headers = make_client(user)
+                times, queries = self.run(client, headers, count)
+                self.stdout.write(
+                    f'{label}: {len(times) / sum(times):.0f} запросов/с, среднее {format_ms(sum(times) / len(times))}, '
+                    f'p95 {format_ms(percentile(times, 0.95))}, запросов к БД на вызов {queries / count:.1f}'
+                )
+        self.stdout.write(self.style.SUCCESS('Готово'))
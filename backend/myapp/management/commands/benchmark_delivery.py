@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand
+from myapp.benchmarking import (
+    bench_environment, client_for, create_files, create_user, format_ms, format_size, percentile,
+)
+
+
+MODES = ('direct', 'x-accel-redirect')
+
+
+class Command(BaseCommand):
+    help = ('Замер занятости воркера при скачивании файла: Django стримит тело сам (direct) '
+            'или передает его прокси (x-accel-redirect). Данные создаются во временном хранилище '
+            'и откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=16,
+                            help='Размер файла, МБ')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Скачиваний в каждом режиме')
+        parser.add_argument('--client-rate', type=int, default=0,
+                            help='Скорость клиента, байт/с: воркер в режиме direct ждет его (0 - без ограничения)')
+
+    # Время, на которое запрос занимает поток воркера: в режиме direct - до отдачи последнего
+    # байта клиенту, при передаче прокси - до возврата ответа с заголовком
+    def occupancy(self, client, url, client_rate):
+        started = time.perf_counter()
+        response = client.get(url)
+        sent = 0
+        if response.streaming:
+            for chunk in response.streaming_content:
+                sent += len(chunk)
+                if client_rate:
+                    delay = sent / client_rate - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        return time.perf_counter() - started, sent
+
+    def handle(self, *args, **options):
+        size = options['size'] * 1024 * 1024
+        for mode in MODES:
+            with bench_environment(FILE_DELIVERY_BACKEND=mode, FILE_DELIVERY_EMULATE_PROXY=False):
+                user = create_user()
+                file_storage = create_files(user, 1, size)[0]
+                client = client_for(user)
+                url = f'/api/files/{file_storage.pk}/download/'
+                self.occupancy(client, url, 0)
+
+                times = []
+                sent = 0
+                for _ in range(options['requests']):
+                    elapsed, body = self.occupancy(client, url, options['client_rate'])
+                    times.append(elapsed)
+                    sent += body
+            self.stdout.write(
+                f'{mode}: среднее {format_ms(sum(times) / len(times))}, p95 {format_ms(percentile(times, 0.95))}, '
+                f'Django отдал {format_size(sent)}; скачиваний на поток в секунду: {len(times) / sum(times):.1f}'
+            )
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from myapp.benchmarking import bench_environment, create_files, create_user, format_ms, format_size, peak_memory
+from myapp.models import FileStorage
+from myapp.renderers import json_response, streaming_json_response
+from myapp.serializers import FILE_LIST_VALUES, file_list_row
+
+
+class Command(BaseCommand):
+    help = ('Замер выгрузки всего списка файлов: одним телом ответа и потоком (?stream=1). '
+            'Показывает время до первых строк, общее время и пик памяти. Данные создаются '
+            'во временном хранилище и откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Строк в списке')
+
+    # Тело ответа собирается целиком до отправки первого байта
+    def buffered(self, files, user_id):
+        started = time.perf_counter()
+        response = json_response([file_list_row(row, user_id) for row in files])
+        first_byte = time.perf_counter() - started
+        return first_byte, len(response.content)
+
+    def streamed(self, files, user_id):
+        started = time.perf_counter()
+        response = streaming_json_response(files, lambda row: file_list_row(row, user_id))
+        first_byte = None
+        size = 0
+        for chunk in response.streaming_content:
+            # Открывающая скобка массива уходит сразу, замеряем первую пачку строк
+            if first_byte is None and len(chunk) > 1:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+        return first_byte, size
+
+    def handle(self, *args, **options):
+        with bench_environment():
+            user = create_user(is_admin=True)
+            create_files(user, options['rows'])
+            files = FileStorage.objects.values(*FILE_LIST_VALUES).order_by('-upload_date', '-id')
+
+            for label, render in (('одним телом', self.buffered), ('потоком', self.streamed)):
+                started = time.perf_counter()
+                first_byte, size = render(files, user.pk)
+                total = time.perf_counter() - started
+                # Память замеряется отдельным проходом: tracemalloc замедляет выполнение
+                _, peak = peak_memory(render, files, user.pk)
+                self.stdout.write(
+                    f'{label}: первые строки через {format_ms(first_byte)}, всего {format_ms(total)}, '
+                    f'ответ {format_size(size)}, пик памяти Python {format_size(peak)}'
+                )
+        self.stdout.write(self.style.SUCCESS('Готово'))
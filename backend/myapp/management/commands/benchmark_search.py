@@ -0,0 +1,62 @@
+import random
+import time
+from urllib.parse import urlencode
+from django.core.management.base import BaseCommand
+from django.db import connection
+from myapp.benchmarking import bench_environment, client_for, create_files, create_user, format_ms, percentile
+from myapp.search import MODES
+
+
+WORDS = (
+    'отчет', 'договор', 'счет', 'фото', 'проект', 'презентация', 'бюджет', 'план', 'report', 'invoice',
+    'contract', 'photo', 'draft', 'final', 'backup', 'scan', 'notes', 'summary', 'budget', 'archive',
+)
+
+
+class Command(BaseCommand):
+    help = ('Замер поиска по именам и комментариям: задержка p50/p95 для каждого режима '
+            '(полнотекстовый, по префиксу, по подстроке) на наборе файлов одного владельца. '
+            'Данные создаются в транзакции и откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Файлов у владельца')
+        parser.add_argument('--queries', type=int, default=100,
+                            help='Запросов на каждый режим')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора имен и запросов')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = [
+            f'{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.randint(2000, 2025)}-{i}.pdf'
+            for i in range(options['rows'])
+        ]
+        queries = {
+            'fulltext': lambda: f'{rng.choice(WORDS)} {rng.choice(WORDS)}',
+            'prefix': lambda: rng.choice(WORDS)[:4],
+            'substring': lambda: rng.choice(WORDS)[1:5],
+        }
+
+        with bench_environment():
+            user = create_user()
+            create_files(user, options['rows'], names=names)
+            # Другой владелец с тем же числом файлов: поиск должен отсекать чужие строки индексом
+            create_files(create_user(), options['rows'], names=names)
+            client = client_for(user)
+            self.stdout.write(f'БД: {connection.vendor}, файлов у владельца: {options["rows"]}')
+
+            for mode in MODES:
+                times = []
+                for _ in range(options['queries']):
+                    url = '/api/files/search/?' + urlencode({'q': queries[mode](), 'mode': mode, 'page_size': 50})
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    times.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(f'Ответ {response.status_code}: {response.content[:200]}')
+                self.stdout.write(
+                    f'{mode}: p50 {format_ms(percentile(times, 0.5))}, p95 {format_ms(percentile(times, 0.95))}, '
+                    f'макс {format_ms(max(times))}'
+                )
+        self.stdout.write(self.style.SUCCESS('Готово'))
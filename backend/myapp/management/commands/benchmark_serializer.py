@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from myapp.benchmarking import (
+    QueryCounter, bench_environment, create_files, create_user, format_ms, format_size, timed,
+)
+from myapp.models import FileStorage
+from myapp.renderers import dump_json
+from myapp.serializers import FILE_LIST_VALUES, FileStorageSerializer, file_list_row
+
+
+class Command(BaseCommand):
+    help = ('Сравнение FileStorageSerializer и быстрого пути списков (values() + file_list_row) '
+            'на одном и том же наборе файлов. Данные создаются во временном хранилище и '
+            'откатываются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                            help='Размеры списка, строк')
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with bench_environment():
+                user = create_user()
+                create_files(user, rows)
+                files = FileStorage.objects.filter(owner=user).order_by('-upload_date', '-id')
+                request = SimpleNamespace(user=user)
+
+                paths = (
+                    ('FileStorageSerializer', lambda: JSONRenderer().render(
+                        FileStorageSerializer(files, many=True, context={'request': request}).data
+                    )),
+                    ('FileStorageSerializer + select_related', lambda: JSONRenderer().render(
+                        FileStorageSerializer(files.select_related('owner'), many=True, context={'request': request}).data
+                    )),
+                    ('быстрый путь', lambda: dump_json(
+                        [file_list_row(row, user.pk) for row in files.values(*FILE_LIST_VALUES)]
+                    )),
+                )
+                self.stdout.write(f'{rows} строк:')
+                for label, render in paths:
+                    queries = QueryCounter()
+                    with connection.execute_wrapper(queries):
+                        body, elapsed = timed(render)
+                    self.stdout.write(
+                        f'  {label}: {format_ms(elapsed)}, запросов {queries.count}, ответ {format_size(len(body))}'
+                    )
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from myapp import compression
+from myapp.deletion import tombstone_files
+from myapp.downloads import open_content
+from myapp.models import Blob, CustomUser, FileStorage
+from myapp.scanning import STORAGE_PREFIXES, known_names, scan_all
+from myapp.storage_backends import delete_stored, locate
+
+
+PHASES = ('files', 'blobs', 'stray', 'users')
+
+
+# Сверяет содержимое в хранилище с ожидаемым размером (и SHA-256, если задан digest).
+# Для сжатых файлов сравнивается исходный размер из таблицы кадров.
+# Возвращает (вид расхождения, подробности, фактический размер) или None.
+def inspect(name, size, digest=None):
+    storage, key = locate(name)
+    try:
+        if compression.is_compressed(name):
+            with open_content(name) as f:
+                actual = f.size
+        else:
+            actual = storage.size(key)
+    except FileNotFoundError:
+        return 'missing', name, None
+    except Exception as e:
+        return 'corrupt', f'{name}: {str(e)}', None
+    if actual != size:
+        return 'size', f'{name}: {actual} байт вместо {size}', actual
+
+    if digest:
+        sha256 = hashlib.sha256()
+        try:
+            with open_content(name) as f:
+                for block in iter(lambda: f.read(settings.FILE_DOWNLOAD_BLOCK_SIZE), b''):
+                    sha256.update(block)
+        except Exception as e:
+            return 'corrupt', f'{name}: {str(e)}', None
+        if sha256.hexdigest() != digest:
+            return 'checksum', f'{name}: {sha256.hexdigest()} вместо {digest}', actual
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Проверяет согласованность БД и хранилища: размеры и контрольные суммы файлов, '
+            'счетчики ссылок блобов, файлы без записей и каталоги удаленных пользователей. '
+            'Прерванная проверка продолжается с места остановки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Потоков для проверки файлов и обхода каталогов')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Записей за один запрос к БД')
+        parser.add_argument('--checksum', action='store_true',
+                            help='Сверять SHA-256 содержимого (читает все файлы целиком)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Исправить найденные расхождения')
+        parser.add_argument('--min-age', type=int, default=24,
+                            help='Не считать лишними файлы моложе указанного числа часов (идущие загрузки)')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.MEDIA_ROOT, '.check_checkpoint'),
+                            help='Файл с состоянием прерванной проверки')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать проверку заново, не продолжая прерванную')
+
+    def read_checkpoint(self, path):
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return None
+
+    def write_checkpoint(self, phase, last):
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump({'phase': phase, 'last': last, 'counts': self.counts}, f)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def report(self, kind, key, detail):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.stdout.write(f'[{kind}] {key}: {detail}')
+
+    def repaired(self):
+        self.counts['repaired'] = self.counts.get('repaired', 0) + 1
+
+    # Обход queryset пачками по возрастанию key, начиная после last
+    def batches(self, queryset, key, last, fields):
+        queryset = queryset.order_by(key)
+        while True:
+            batch = queryset.filter(**{f'{key}__gt': last}) if last is not None else queryset
+            rows = list(batch.values(*fields)[:self.batch_size])
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][key]
+
+    def fix_size(self, pk, actual):
+        with transaction.atomic():
+            row = FileStorage.objects.select_for_update().filter(pk=pk).values('owner_id', 'size').first()
+            if row is None:
+                return
+            FileStorage.all_objects.filter(pk=pk).update(size=actual)
+            CustomUser.objects.filter(pk=row['owner_id']).update(total_size=F('total_size') + actual - row['size'])
+        self.repaired()
+
+    # Файл могли перенести между уровнями во время проверки - удаляем запись,
+    # только если она все еще указывает на отсутствующее имя
+    def fix_missing(self, pk, name):
+        storage, key = locate(name)
+        if FileStorage.objects.filter(pk=pk, file=name).exists() and not storage.exists(key):
+            tombstone_files([pk])
+            self.repaired()
+
+    def check_files(self, executor, last):
+        fields = ('id', 'owner_id', 'file', 'size', 'checksum', 'blob_id', 'blob__file', 'blob__size')
+        for rows in self.batches(FileStorage.objects.all(), 'id', last, fields):
+            legacy = []
+            for row in rows:
+                if row['blob_id'] is None:
+                    legacy.append(row)
+                    continue
+                # Содержимое блобов проверяется в фазе blobs, здесь - только указатели
+                if row['file'] != row['blob__file']:
+                    self.report('pointer', row['id'], f'{row["file"]} вместо {row["blob__file"]}')
+                    if self.repair:
+                        FileStorage.all_objects.filter(pk=row['id'], blob_id=row['blob_id']).update(file=row['blob__file'])
+                        self.repaired()
+                if row['size'] != row['blob__size']:
+                    self.report('size', row['id'], f'{row["size"]} байт вместо {row["blob__size"]}')
+                    if self.repair:
+                        self.fix_size(row['id'], row['blob__size'])
+
+            results = executor.map(
+                lambda row: inspect(row['file'], row['size'], row['checksum'] if self.checksum else None),
+                legacy,
+            )
+            for row, result in zip(legacy, results):
+                if result is None:
+                    continue
+                kind, detail, actual = result
+                self.report(kind, row['id'], detail)
+                if not self.repair:
+                    continue
+                if kind == 'missing':
+                    self.fix_missing(row['id'], row['file'])
+                elif kind == 'size':
+                    self.fix_size(row['id'], actual)
+
+            self.counts['files'] = self.counts.get('files', 0) + len(rows)
+            self.write_checkpoint('files', str(rows[-1]['id']))
+
+    def check_blobs(self, executor, last):
+        blobs = Blob.objects.annotate(refs=Count('files'))
+        for rows in self.batches(blobs, 'digest', last, ('digest', 'file', 'size', 'ref_count', 'refs')):
+            for row in rows:
+                # ref_count учитывает и помеченные удаленными файлы, их ссылки отпускает reap_files
+                if row['ref_count'] != row['refs']:
+                    self.report('refs', row['digest'], f'ref_count {row["ref_count"]}, ссылок {row["refs"]}')
+                    if self.repair:
+                        with transaction.atomic():
+                            blob = Blob.objects.select_for_update().filter(pk=row['digest']).first()
+                            if blob is not None:
+                                blob.ref_count = FileStorage.all_objects.filter(blob_id=blob.pk).count()
+                                blob.save(update_fields=['ref_count'])
+                        self.repaired()
+
+            results = executor.map(
+                lambda row: inspect(row['file'], row['size'], row['digest'] if self.checksum else None),
+                rows,
+            )
+            for row, result in zip(rows, results):
+                if result is None:
+                    continue
+                kind, detail, _ = result
+                self.report(kind, row['digest'], detail)
+                # Содержимое не восстановить: файлы, ссылающиеся на потерянный блоб, помечаются удаленными
+                if self.repair and kind == 'missing':
+                    files = list(FileStorage.objects.filter(blob_id=row['digest']).values_list('id', flat=True))
+                    if files:
+                        tombstone_files(files)
+                        self.repaired()
+
+            self.counts['blobs'] = self.counts.get('blobs', 0) + len(rows)
+            self.write_checkpoint('blobs', rows[-1]['digest'])
+
+    def check_stray(self, last):
+        prefixes = STORAGE_PREFIXES[STORAGE_PREFIXES.index(last) + 1:] if last else STORAGE_PREFIXES
+        # Файлы, записанные после чтения БД, моложе min-age и в лишние не попадут
+        known = known_names()
+        deadline = time.time() - self.min_age * 3600
+        for prefix in prefixes:
+            on_disk = scan_all(self.workers, (prefix,))
+            for name, (size, mtime) in sorted(on_disk.items()):
+                if name in known or mtime >= deadline:
+                    continue
+                self.report('stray', name, f'{size} байт')
+                if self.repair:
+                    delete_stored(name)
+                    self.repaired()
+            self.write_checkpoint('stray', prefix)
+
+    def check_users(self, last):
+        base = settings.FILE_STORAGE_BASE_DIR
+        directories = sorted(
+            entry.name for entry in os.scandir(base) if entry.is_dir(follow_symlinks=False)
+        ) if os.path.isdir(base) else []
+        directories = [name for name in directories if last is None or name > last]
+
+        for start in range(0, len(directories), self.batch_size):
+            chunk = directories[start:start + self.batch_size]
+            existing = set(CustomUser.objects.filter(username__in=chunk).values_list('username', flat=True))
+            for name in chunk:
+                if name in existing:
+                    continue
+                path = os.path.join(base, name)
+                self.report('user', name, f'каталог удаленного пользователя {path}')
+                if self.repair:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self.repaired()
+            self.write_checkpoint('users', chunk[-1])
+
+        # Каталоги пользователей, которые не создал setup_storage
+        for rows in self.batches(CustomUser.objects.all(), 'id', None, ('id', 'username')):
+            for row in rows:
+                path = os.path.join(base, row['username'])
+                if not os.path.isdir(path):
+                    self.report('nodir', row['username'], f'нет каталога {path}')
+                    if self.repair:
+                        os.makedirs(path, exist_ok=True)
+                        self.repaired()
+
+    def handle(self, *args, **options):
+        self.workers = options['workers']
+        self.batch_size = options['batch_size']
+        self.checksum = options['checksum']
+        self.repair = options['repair']
+        self.min_age = options['min_age']
+        self.checkpoint = options['checkpoint']
+
+        state = None if options['restart'] else self.read_checkpoint(self.checkpoint)
+        if state:
+            self.stdout.write(f'Продолжаем проверку: фаза {state["phase"]}, после {state["last"]}')
+            start_phase, last, self.counts = state['phase'], state['last'], state['counts']
+        else:
+            start_phase, last, self.counts = PHASES[0], None, {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for phase in PHASES[PHASES.index(start_phase):]:
+                self.stdout.write(f'Фаза {phase}')
+                if phase == 'files':
+                    self.check_files(executor, last)
+                elif phase == 'blobs':
+                    self.check_blobs(executor, last)
+                elif phase == 'stray':
+                    self.check_stray(last)
+                else:
+                    self.check_users(last)
+                last = None
+                # Фаза завершена: при возобновлении начнем со следующей
+                next_phases = PHASES[PHASES.index(phase) + 1:]
+                if next_phases:
+                    self.write_checkpoint(next_phases[0], None)
+
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        problems = {kind: count for kind, count in self.counts.items() if kind not in ('files', 'blobs', 'repaired')}
+        summary = ', '.join(f'{kind}: {count}' for kind, count in sorted(problems.items())) or 'расхождений нет'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {self.counts.get("files", 0)}, блобов: {self.counts.get("blobs", 0)}; '
+            f'{summary}; исправлено: {self.counts.get("repaired", 0)}'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from myapp import quotas
+from myapp.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные сессии загрузки вместе с недокачанными файлами'
+
+    def handle(self, *args, **options):
+        removed = 0
+        for session in UploadSession.objects.filter(expires__lte=timezone.now()).iterator():
+            session.remove_file()
+            # Резерв квоты снимается вместе с сессией
+            with transaction.atomic():
+                if UploadSession.objects.filter(pk=session.pk).delete()[0]:
+                    quotas.release(session.owner_id, session.size)
+            removed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Удалено просроченных сессий: {removed}')
+        )
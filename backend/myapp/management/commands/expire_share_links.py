@@ -0,0 +1,33 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.sharing import revoke_expired_links
+
+
+class Command(BaseCommand):
+    help = 'Отзывает истекшие публичные ссылки на файлы пачками, не удерживая долгих блокировок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SHARE_LINK_SWEEP_BATCH_SIZE,
+                            help='Ссылок за одну транзакцию')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Пауза между пачками, секунд')
+        parser.add_argument('--loop', type=int, default=0,
+                            help='Работать постоянно, проверяя истекшие ссылки раз в указанное число секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                revoked = revoke_expired_links(batch_size=options['batch_size'])
+                total += revoked
+                if revoked < options['batch_size']:
+                    break
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+            if total or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Отозвано истекших ссылок: {total}'))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
@@ -0,0 +1,117 @@
+import os
+import time
+from collections import deque
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from myapp.caching import share_links
+from myapp.models import FileStorage, sharded_name
+from myapp.storage_backends import COLD_PREFIX, is_local
+
+
+class Command(BaseCommand):
+    help = ('Переносит файлы из плоского каталога files/ в раскладку files/ab/cd/<имя> '
+            'без остановки сервиса; повторный запуск продолжает с места остановки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Файлов за одну пачку')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Пауза между пачками, секунд (ограничение нагрузки на диск)')
+        parser.add_argument('--grace', type=float, default=60.0,
+                            help='Через сколько секунд после переноса удалять старый путь')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.MEDIA_ROOT, '.layout_checkpoint'),
+                            help='Файл с id последней обработанной записи')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет перенесено')
+
+    def read_checkpoint(self, path):
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read().strip() or None
+        return None
+
+    def write_checkpoint(self, path, last_id):
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(last_id))
+        os.replace(path + '.tmp', path)
+
+    # Старые пути удаляются с задержкой: запросы, успевшие прочитать старую запись, дочитают файл
+    def unlink_expired(self, pending, force=False):
+        while pending and (force or pending[0][0] <= time.monotonic()):
+            _, path = pending.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def handle(self, *args, **options):
+        # Плоская раскладка была только у локального хранилища
+        if not is_local():
+            raise CommandError('Перенос раскладки выполняется только для локального хранилища')
+        dry_run = options['dry_run']
+        checkpoint = options['checkpoint']
+        last_id = None if dry_run else self.read_checkpoint(checkpoint)
+        if last_id:
+            self.stdout.write(f'Продолжаем после записи {last_id}')
+
+        moved = skipped = missing = 0
+        pending = deque()
+        started = time.monotonic()
+        # Блобы и холодный уровень уже в разветвленной раскладке, переносим только записи с прямым путем
+        files = FileStorage.all_objects.filter(blob__isnull=True).exclude(file__startswith=COLD_PREFIX).order_by('pk')
+
+        try:
+            while True:
+                batch = files.filter(pk__gt=last_id) if last_id else files
+                rows = list(batch.values('id', 'name', 'file', 'share_link')[:options['batch_size']])
+                if not rows:
+                    break
+
+                for row in rows:
+                    target_name = sharded_name('files', str(row['id']), row['name'] or os.path.basename(row['file']))
+                    if row['file'] == target_name:
+                        skipped += 1
+                        continue
+                    source = os.path.join(settings.MEDIA_ROOT, row['file'])
+                    if not os.path.isfile(source):
+                        missing += 1
+                        continue
+                    if dry_run:
+                        self.stdout.write(f'{row["file"]} -> {target_name}')
+                        moved += 1
+                        continue
+
+                    # Жесткая ссылка на том же разделе, копия - если ссылка невозможна
+                    default_storage.put_file(target_name, source)
+                    # Условное обновление: запись могли переименовать или удалить параллельно
+                    updated = FileStorage.all_objects.filter(pk=row['id'], file=row['file']).update(file=target_name)
+                    if updated:
+                        share_links.invalidate(row['share_link'])
+                        pending.append((time.monotonic() + options['grace'], source))
+                        moved += 1
+                    else:
+                        default_storage.delete(target_name)
+                        skipped += 1
+
+                last_id = rows[-1]['id']
+                if not dry_run:
+                    self.write_checkpoint(checkpoint, last_id)
+                self.unlink_expired(pending)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Перенесено: {moved}, пропущено: {skipped}, без файла: {missing} '
+                    f'({moved / elapsed if elapsed else 0:.1f} файлов/с)'
+                )
+                time.sleep(options['sleep'])
+        finally:
+            if pending:
+                time.sleep(max(pending[-1][0] - time.monotonic(), 0))
+                self.unlink_expired(pending, force=True)
+
+        if not dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(
+            self.style.SUCCESS(f'Готово. Перенесено: {moved}, пропущено: {skipped}, без файла: {missing}')
+        )
@@ -0,0 +1,53 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from myapp.models import FileStorage
+from myapp.pipeline import process_file
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает файлы, которые не прошли обработку после загрузки '
+            '(записи до появления обработки, упавшие процессы, ошибки)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.UPLOAD_PIPELINE_WORKERS,
+                            help='Процессов обработки')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Записей за один запрос к БД')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Повторить обработку файлов с ошибкой')
+
+    def handle(self, *args, **options):
+        states = Q(processing_state='pending')
+        if options['retry_failed']:
+            states |= Q(processing_state='failed')
+        files = (
+            FileStorage.objects.filter(states, processing_attempts__lt=settings.UPLOAD_PIPELINE_MAX_ATTEMPTS)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+
+        results = {'done': 0, 'failed': 0}
+        last_pk = None
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as executor:
+            while True:
+                batch = files.filter(pk__gt=last_pk) if last_pk is not None else files
+                pks = list(batch[:options['batch_size']])
+                if not pks:
+                    break
+                for result in executor.map(process_file, pks):
+                    if result in results:
+                        results[result] += 1
+                last_pk = pks[-1]
+                self.stdout.write(f'Обработано: {results["done"]}, с ошибкой: {results["failed"]}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Обработано: {results["done"]}, с ошибкой: {results["failed"]}'
+        ))
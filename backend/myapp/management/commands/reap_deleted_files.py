@@ -0,0 +1,34 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.deletion import reap_files
+
+
+class Command(BaseCommand):
+    help = 'Окончательно удаляет помеченные на удаление файлы: строки, ссылки на блобы и файлы на диске'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DELETION_BATCH_SIZE,
+                            help='Строк за один проход')
+        parser.add_argument('--workers', type=int, default=settings.DELETION_IO_WORKERS,
+                            help='Параллельных удалений с диска')
+        parser.add_argument('--loop', type=int, default=0,
+                            help='Работать постоянно, проверяя очередь раз в указанное число секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            total_files = total_blobs = 0
+            while True:
+                files, blobs = reap_files(batch_size=options['batch_size'], workers=options['workers'])
+                total_files += files
+                total_blobs += blobs
+                if files < options['batch_size'] and blobs < options['batch_size']:
+                    break
+
+            if total_files or total_blobs or not options['loop']:
+                self.stdout.write(
+                    self.style.SUCCESS(f'Удалено файлов: {total_files}, блобов: {total_blobs}')
+                )
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
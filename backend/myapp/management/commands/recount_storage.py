@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from myapp.models import CustomUser, FileStorage, UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает и исправляет счетчики file_count/total_size/reserved_size пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько пользователей обновлять одним запросом')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать пользователей с неверными счетчиками')
+        parser.add_argument('--reset-reserved', action='store_true',
+                            help='Пересчитать reserved_size точно; запускать только при остановленных загрузках')
+
+    def handle(self, *args, **options):
+        files = FileStorage.objects.filter(owner=OuterRef('pk')).order_by().values('owner')
+        file_count = Coalesce(Subquery(files.annotate(count=Count('id')).values('count')), Value(0))
+        total_size = Coalesce(Subquery(files.annotate(total=Sum('size')).values('total')), Value(0))
+        # Из БД восстанавливаются только резервы незавершенных сессий. Резервы идущих обычных
+        # загрузок и принятия блобов живут в запросах, и по БД их не отличить от утечки, поэтому
+        # по умолчанию reserved_size только поднимается до суммы сессий. Сбросить утекшие резервы
+        # (--reset-reserved) можно, лишь когда загрузки остановлены, иначе квота перестанет их учитывать
+        sessions = UploadSession.objects.filter(owner=OuterRef('pk')).order_by().values('owner')
+        reserved_size = Coalesce(Subquery(sessions.annotate(total=Sum('size')).values('total')), Value(0))
+        if not options['reset_reserved']:
+            reserved_size = Greatest(F('reserved_size'), reserved_size)
+
+        users = CustomUser.objects.annotate(
+            actual_count=file_count, actual_size=total_size, actual_reserved=reserved_size
+        )
+        broken = users.exclude(
+            Q(file_count=file_count) & Q(total_size=total_size) & Q(reserved_size=reserved_size)
+        )
+        self.stdout.write(f'Пользователей с неверными счетчиками: {broken.count()}')
+        if options['dry_run']:
+            for user in broken.iterator():
+                self.stdout.write(
+                    f'{user.username}: {user.file_count}/{user.total_size}/{user.reserved_size} -> '
+                    f'{user.actual_count}/{user.actual_size}/{user.actual_reserved}'
+                )
+            return
+
+        # Пересчет пачками по диапазонам id, каждая пачка - один UPDATE
+        fixed = 0
+        last_pk = 0
+        batch_size = options['batch_size']
+        while True:
+            pks = list(
+                CustomUser.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            fixed += CustomUser.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(
+                file_count=file_count,
+                total_size=total_size,
+                reserved_size=reserved_size,
+            )
+            last_pk = pks[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Счетчики пересчитаны для {fixed} пользователей')
+        )
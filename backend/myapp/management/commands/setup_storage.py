@@ -1,3 +1,4 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import os
@@ -5,6 +6,14 @@ import os
 class Command(BaseCommand):
     help = 'Создает необходимые директории для хранения файлов'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='После создания директорий проверить согласованность хранилища (check_storage)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Вместе с --check: исправить найденные расхождения')
+        parser.add_argument('--checksum', action='store_true',
+                            help='Вместе с --check: сверять контрольные суммы')
+
     def handle(self, *args, **options):
         # директории для хранения файлов
         storage_dirs = [
@@ -31,4 +40,8 @@ class Command(BaseCommand):
                 os.makedirs(user_storage_path)
                 self.stdout.write(
                     self.style.SUCCESS(f'Создана директория пользователя: {user_storage_path}')
-                ) 
\ No newline at end of file
+                ) 
+
+        if options['check']:
+            call_command('check_storage', repair=options['repair'], checksum=options['checksum'],
+                         stdout=self.stdout, stderr=self.stderr)
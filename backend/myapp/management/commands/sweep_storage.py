@@ -0,0 +1,64 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from myapp.deletion import tombstone_files
+from myapp.models import Blob, FileStorage
+from myapp.scanning import known_names, scan_all
+from myapp.storage_backends import delete_stored
+
+
+class Command(BaseCommand):
+    help = 'Ищет файлы на диске без записей в БД и записи без файлов на диске'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Потоков для параллельного обхода каталогов')
+        parser.add_argument('--min-age', type=int, default=24,
+                            help='Не трогать файлы моложе указанного числа часов (идущие загрузки)')
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Удалить файлы без записей в БД')
+        parser.add_argument('--fix-rows', action='store_true',
+                            help='Пометить удаленными записи, у которых нет файла на диске')
+        parser.add_argument('--list', action='store_true',
+                            help='Вывести найденные пути и id')
+
+    def handle(self, *args, **options):
+        # Снимок диска делаем до чтения БД: файл, записанный между ними, окажется известным
+        started = timezone.now()
+        on_disk = scan_all(options['workers'])
+        self.stdout.write(f'Файлов на диске: {len(on_disk)}')
+
+        known = known_names()
+
+        deadline = time.time() - options['min_age'] * 3600
+        orphans = [
+            name for name, (_, mtime) in on_disk.items()
+            if name not in known and mtime < deadline
+        ]
+        self.stdout.write(f'Файлов без записей: {len(orphans)}')
+        if options['list']:
+            for name in orphans:
+                self.stdout.write(f'  {name}')
+        if options['delete_orphans']:
+            for name in orphans:
+                delete_stored(name)
+            self.stdout.write(self.style.SUCCESS(f'Удалено файлов без записей: {len(orphans)}'))
+
+        # Записи, созданные после начала обхода, могут ссылаться на еще не увиденные файлы
+        missing = [
+            pk for pk, name in FileStorage.objects.filter(upload_date__lt=started).values_list('id', 'file').iterator()
+            if name not in on_disk
+        ]
+        missing_blobs = [
+            digest for digest, name in Blob.objects.values_list('digest', 'file').iterator()
+            if name not in on_disk
+        ]
+        self.stdout.write(f'Записей без файлов: {len(missing)}, блобов без файлов: {len(missing_blobs)}')
+        if options['list']:
+            for pk in missing:
+                self.stdout.write(f'  {pk}')
+            for digest in missing_blobs:
+                self.stdout.write(f'  blob {digest}')
+        if options['fix_rows'] and missing:
+            tombstone_files(missing)
+            self.stdout.write(self.style.SUCCESS(f'Помечено удаленными: {len(missing)}'))
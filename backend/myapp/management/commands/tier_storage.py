@@ -0,0 +1,119 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from myapp.models import Blob, FileStorage
+from myapp.storage_backends import COLD_PREFIX
+from myapp.tiering import freeze_blob, freeze_file, wait_retired
+
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ТБ'
+
+
+class Command(BaseCommand):
+    help = 'Переносит на холодный уровень файлы, которые давно не скачивали'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TIERING_COLD_AFTER_DAYS,
+                            help='Сколько дней без скачиваний считать файл холодным')
+        parser.add_argument('--batch-size', type=int, default=settings.TIERING_BATCH_SIZE,
+                            help='Записей за один запрос к БД')
+        parser.add_argument('--max-rate', type=int, default=settings.TIERING_MAX_RATE,
+                            help='Ограничение скорости переноса, байт/с (0 - без ограничения)')
+        parser.add_argument('--limit', type=int, default=0,
+                            help='Остановиться после переноса указанного числа байт')
+        parser.add_argument('--no-compress', action='store_true',
+                            help='Не сжимать файлы при переносе')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, что будет перенесено')
+
+    # Обход кандидатов пачками по первичному ключу
+    def batches(self, queryset, batch_size):
+        last_pk = None
+        while True:
+            batch = queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset
+            rows = list(batch[:batch_size])
+            if not rows:
+                return
+            yield rows
+            last_pk = rows[-1].pk
+
+    # Держим среднюю скорость не выше max_rate
+    def throttle(self):
+        if self.max_rate:
+            delay = self.moved / self.max_rate - (time.monotonic() - self.started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def limit_reached(self):
+        return self.limit and self.moved >= self.limit
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        compress = settings.TIERING_COMPRESS and not options['no_compress']
+        self.max_rate = options['max_rate']
+        self.limit = options['limit']
+        self.started = time.monotonic()
+        self.moved = 0
+        stored = files = 0
+
+        # Файл давно не скачивали, а если не скачивали никогда - давно загрузили
+        recent = Q(last_download__gte=cutoff) | Q(last_download__isnull=True, upload_date__gte=cutoff)
+        # Блоб холодный, только если холодны все ссылающиеся на него файлы
+        blobs = (
+            Blob.objects.filter(ref_count__gt=0)
+            .exclude(file__startswith=COLD_PREFIX)
+            .exclude(Exists(FileStorage.all_objects.filter(recent, blob=OuterRef('pk'))))
+            .order_by('pk')
+        )
+        legacy = (
+            FileStorage.objects.filter(blob__isnull=True)
+            .exclude(file__startswith=COLD_PREFIX)
+            .exclude(recent)
+            .order_by('pk')
+        )
+
+        for queryset, freeze in ((blobs, freeze_blob), (legacy, freeze_file)):
+            for rows in self.batches(queryset, options['batch_size']):
+                for row in rows:
+                    if self.limit_reached():
+                        break
+                    if options['dry_run']:
+                        stored_size = row.size
+                    else:
+                        try:
+                            stored_size = freeze(row, compress)
+                        except Exception as e:
+                            self.stderr.write(f'Ошибка переноса {row.pk}: {str(e)}')
+                            continue
+                        if stored_size is None:
+                            continue
+                    files += 1
+                    self.moved += row.size
+                    stored += stored_size
+                    if not options['dry_run']:
+                        self.throttle()
+
+                elapsed = time.monotonic() - self.started
+                self.stdout.write(
+                    f'Перенесено: {files} ({format_size(self.moved)}, '
+                    f'{format_size(self.moved / elapsed if elapsed else 0)}/с)'
+                )
+                if self.limit_reached():
+                    break
+
+        # Горячие копии удаляются с задержкой: процесс не должен завершиться раньше
+        wait_retired()
+
+        prefix = 'Будет перенесено' if options['dry_run'] else 'Перенесено на холодный уровень'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}: {files} файлов, {format_size(self.moved)}; '
+            f'на холодном уровне занято {format_size(stored)}'
+        ))
@@ -0,0 +1,88 @@
+import mimetypes
+import os
+from urllib.parse import unquote
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponseNotFound, JsonResponse
+from .admission import controller
+from .downloads import range_response
+
+
+# Имитация фронтового прокси для разработки: перехватывает ответы с X-Accel-Redirect
+# или X-Sendfile и отдает файл так же, как это сделал бы nginx (включая Range)
+class ProxyDeliveryMiddleware:
+    passthrough_headers = ('Content-Disposition', 'ETag', 'Last-Modified', 'Cache-Control')
+
+    def __init__(self, get_response):
+        if not settings.FILE_DELIVERY_EMULATE_PROXY:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        path = self.resolve_path(response)
+        if path is None:
+            return response
+        if not os.path.isfile(path):
+            return HttpResponseNotFound()
+
+        content_type = response.get('Content-Type') or mimetypes.guess_type(path)[0]
+        delivered = range_response(
+            request,
+            lambda: open(path, 'rb'),
+            os.path.getsize(path),
+            content_type or 'application/octet-stream'
+        )
+        for header in self.passthrough_headers:
+            if header in response:
+                delivered[header] = response[header]
+        return delivered
+
+    def resolve_path(self, response):
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        if 'X-Accel-Redirect' in response:
+            location = unquote(response['X-Accel-Redirect'])
+            prefix = settings.FILE_DELIVERY_ACCEL_PREFIX
+            if not location.startswith(prefix):
+                return None
+            path = os.path.realpath(os.path.join(media_root, location[len(prefix):]))
+        elif 'X-Sendfile' in response:
+            path = os.path.realpath(response['X-Sendfile'])
+        else:
+            return None
+
+        # Как и internal-location nginx, отдаем только содержимое MEDIA_ROOT
+        if os.path.commonpath([media_root, path]) != media_root:
+            return None
+        return path
+
+
+# Допуск запросов по пулам (см. admission). Слот занят, пока ответ не отдан целиком:
+# для потоковых ответов он освобождается, когда сервер закрывает ответ
+class AdmissionControlMiddleware:
+    def __init__(self, get_response):
+        if not settings.ADMISSION_CONTROL_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        pool = getattr(request, 'admission_pool', None)
+        if pool is not None:
+            response._resource_closers.append(pool.release)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        pool = controller.get_pool(getattr(view_class, 'admission_pool', settings.ADMISSION_DEFAULT_POOL))
+        if not pool.acquire():
+            response = JsonResponse(
+                {'error': 'Сервер перегружен, повторите запрос позже'},
+                status=503,
+                json_dumps_params={'ensure_ascii': False}
+            )
+            response['Retry-After'] = settings.ADMISSION_RETRY_AFTER
+            return response
+        request.admission_pool = pool
+        return None
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filestorage',
+            index=models.Index(fields=['owner', 'upload_date', 'id'], name='file_owner_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filestorage',
+            index=models.Index(fields=['owner', 'size', 'id'], name='file_owner_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filestorage',
+            index=models.Index(fields=['owner', 'original_name', 'id'], name='file_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filestorage',
+            index=models.Index(fields=['upload_date', 'id'], name='file_upload_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_storage_counters(apps, schema_editor):
+    CustomUser = apps.get_model('myapp', 'CustomUser')
+    FileStorage = apps.get_model('myapp', 'FileStorage')
+    files = FileStorage.objects.filter(owner=OuterRef('pk')).order_by().values('owner')
+    CustomUser.objects.update(
+        file_count=Coalesce(Subquery(files.annotate(count=Count('id')).values('count')), Value(0)),
+        total_size=Coalesce(Subquery(files.annotate(total=Sum('size')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_filestorage_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='file_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='total_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_storage_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_customuser_storage_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestorage',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
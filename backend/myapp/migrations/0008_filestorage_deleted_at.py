@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_filestorage_download_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestorage',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:51
+
+import myapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_filestorage_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filestorage',
+            name='file',
+            field=models.FileField(upload_to=myapp.models.file_upload_to),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.3 on 2026-10-18 17:58
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Все блобы, созданные до появления сжатия, хранятся как есть
+def fill_stored_size(apps, schema_editor):
+    Blob = apps.get_model('myapp', 'Blob')
+    Blob.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_filestorage_sharded_upload_to'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
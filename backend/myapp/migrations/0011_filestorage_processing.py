@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_blob_stored_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestorage',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='filestorage',
+            name='mime_type',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='filestorage',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='filestorage',
+            name='processing_state',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('done', 'Обработан'), ('failed', 'Ошибка обработки')], db_index=True, default='pending', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='filestorage',
+            name='thumbnail',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_filestorage_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='quota',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='reserved_size',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
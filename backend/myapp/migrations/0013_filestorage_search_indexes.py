@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+# Индексы поиска (myapp.search) существуют только в Postgres, поэтому создаются SQL,
+# а не через Meta.indexes. Выражения должны совпадать с NAME_KEY, DOCUMENT и с тем,
+# что Django генерирует для icontains. btree_gin позволяет включить owner_id в GIN-индекс.
+# CONCURRENTLY - чтобы не блокировать запись в таблицу на время построения.
+INDEXES = {
+    'file_search_prefix_idx': (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_search_prefix_idx ON myapp_filestorage '
+        '(owner_id, (UPPER(original_name) COLLATE "C"), id) WHERE deleted_at IS NULL'
+    ),
+    'file_search_name_trgm_idx': (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_search_name_trgm_idx ON myapp_filestorage '
+        'USING gin (owner_id, UPPER(original_name::text) gin_trgm_ops) WHERE deleted_at IS NULL'
+    ),
+    'file_search_comment_trgm_idx': (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_search_comment_trgm_idx ON myapp_filestorage '
+        'USING gin (owner_id, UPPER(comment::text) gin_trgm_ops) WHERE deleted_at IS NULL'
+    ),
+    'file_search_document_idx': (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_search_document_idx ON myapp_filestorage '
+        "USING gin (owner_id, to_tsvector('simple'::regconfig, "
+        "translate(coalesce(original_name, ''), '._-', '   ') || ' ' || coalesce(comment, ''))) "
+        'WHERE deleted_at IS NULL'
+    ),
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    for sql in INDEXES.values():
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0012_customuser_quota'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
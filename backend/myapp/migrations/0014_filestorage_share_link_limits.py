@@ -0,0 +1,27 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_filestorage_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filestorage',
+            name='share_link_downloads',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='filestorage',
+            name='share_link_max_downloads',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='filestorage',
+            index=models.Index(condition=models.Q(('share_link__isnull', False)), fields=['share_link_expiry'], name='file_share_expiry_idx'),
+        ),
+    ]
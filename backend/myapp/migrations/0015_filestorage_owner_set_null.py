@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_filestorage_share_link_limits'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filestorage',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='files', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
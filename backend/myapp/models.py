@@ -3,9 +3,26 @@ from django.db import models
 from .validators import validate_username, validate_email
 import uuid
 from django.utils import timezone
+from django.conf import settings
 import os
 
 
+# Разветвленная раскладка на диске: prefix/ab/cd/<name>, где ab/cd - первые символы ключа
+# (UUID или SHA-256), чтобы в одном каталоге не копились миллионы файлов
+def sharded_name(prefix, key, name):
+    key = key.replace('-', '')
+    return f'{prefix}/{key[:2]}/{key[2:4]}/{name}'
+
+
+def file_upload_to(instance, filename):
+    return sharded_name('files', str(instance.id), instance.name or filename)
+
+
+# Превью одно на содержимое: ключ - хеш блоба или id записи без блоба
+def thumbnail_name(key):
+    return sharded_name('thumbs', key, f'{key}.webp')
+
+
 # Расширение встроенной модели User
 class CustomUser(AbstractUser):
     username = models.CharField(
@@ -21,15 +38,24 @@ class CustomUser(AbstractUser):
     )
     is_admin = models.BooleanField(default=False, verbose_name='Администратор')
     storage_path = models.CharField(max_length=255, blank=True)
+    # Денормализованные счетчики хранилища, обновляются сигналами FileStorage
+    file_count = models.PositiveIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    # Квота в байтах: None - STORAGE_DEFAULT_QUOTA, 0 - без ограничения (см. quotas)
+    quota = models.BigIntegerField(null=True, blank=True)
+    # Место, зарезервированное идущими загрузками
+    reserved_size = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.username
     # Получаем информацию о хранилище пользователя
     def get_storage_info(self):
-        files = self.files.all()
+        from .quotas import effective_quota
         return {
-            'file_count': files.count(),
-            'total_size': sum(file.size for file in files),
+            'file_count': self.file_count,
+            'total_size': self.total_size,
+            'reserved_size': self.reserved_size,
+            'quota': effective_quota(self),
         }
 
     def save(self, *args, **kwargs):
@@ -42,18 +68,68 @@ class CustomUser(AbstractUser):
         verbose_name_plural = 'Пользователи'
 
 
+# Содержимое файла, хранящееся один раз на каждый SHA-256 и разделяемое записями FileStorage
+class Blob(models.Model):
+    digest = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    # Байт в хранилище: меньше size, если содержимое хранится сжатым
+    stored_size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest} ({self.ref_count})"
+
+    class Meta:
+        verbose_name = 'Блоб'
+        verbose_name_plural = 'Блобы'
+
+
+# Менеджер по умолчанию скрывает файлы, помеченные на удаление
+class FileStorageManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+PROCESSING_STATES = (
+    ('pending', 'Ожидает обработки'),
+    ('done', 'Обработан'),
+    ('failed', 'Ошибка обработки'),
+)
+
+
 class FileStorage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     original_name = models.CharField(max_length=255, default='')
     name = models.CharField(max_length=255)
-    file = models.FileField(upload_to='files/')
+    file = models.FileField(upload_to=file_upload_to)
     comment = models.TextField(blank=True, null=True)
     size = models.BigIntegerField()
-    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='files')
+    # Файлы удаляемого пользователя помечаются на удаление (signals.tombstone_user_files) и
+    # остаются без владельца, пока reap_files не отпустит блобы и не удалит их с диска
+    owner = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='files')
+    # Записи, загруженные до появления хранилища блобов, ссылаются на файл напрямую
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files', null=True, blank=True)
     upload_date = models.DateTimeField(auto_now_add=True)
     last_download = models.DateTimeField(null=True, blank=True)
+    download_count = models.PositiveIntegerField(default=0)
     share_link = models.UUIDField(unique=True, null=True, blank=True)
     share_link_expiry = models.DateTimeField(null=True, blank=True)
+    # Необязательный лимит скачиваний по ссылке и число засчитанных скачиваний (myapp.sharing)
+    share_link_max_downloads = models.PositiveIntegerField(null=True, blank=True)
+    share_link_downloads = models.PositiveIntegerField(default=0)
+    # Время пометки на удаление; файл с диска и строку убирает reap_files
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Результаты обработки после загрузки (myapp.pipeline)
+    mime_type = models.CharField(max_length=255, blank=True, default='')
+    checksum = models.CharField(max_length=64, blank=True, default='')  # SHA-256 содержимого
+    thumbnail = models.CharField(max_length=255, blank=True, default='')  # Имя превью в хранилище
+    processing_state = models.CharField(max_length=16, choices=PROCESSING_STATES, default='pending', db_index=True)
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
+
+    objects = FileStorageManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"{self.original_name} ({self.owner.username})"
@@ -62,26 +138,134 @@ class FileStorage(models.Model):
         if not self.share_link:
             self.share_link = uuid.uuid4()
         if not self.share_link_expiry:
-            self.share_link_expiry = timezone.now() + timezone.timedelta(days=7)
+            self.share_link_expiry = timezone.now() + timezone.timedelta(seconds=settings.SHARE_LINK_TTL)
         
         # Генерируем уникальное имя файла только если оно еще не установлено
         if not self.name and self.file:
-            file_ext = os.path.splitext(self.file.name)[1]
+            file_ext = os.path.splitext(self.original_name or self.file.name)[1]
             self.name = f"{self.id}{file_ext}"
             # Сохраняем оригинальное имя файла
-            self.original_name = self.file.name
+            if not self.original_name:
+                self.original_name = self.file.name
         
         super().save(*args, **kwargs)
 
-    def update_last_download(self):
+    def update_last_download(self, response=None):
+        from .download_stats import recorder
+        from .tiering import schedule_rehydration
+        # Запись в БД откладывается и объединяется с другими скачиваниями
         self.last_download = timezone.now()
-        self.save()
+        recorder.record(self.pk, self.last_download)
+        # Скачанный файл с холодного уровня возвращается на горячий после отдачи ответа
+        schedule_rehydration(self, response)
 
     def get_file_path(self):
         return os.path.join(self.owner.storage_path, self.name)
 
     def delete(self, *args, **kwargs):
-        if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
-        super().delete(*args, **kwargs) 
\ No newline at end of file
+        from .deletion import tombstone_files
+        # Файл помечается удаленным и сразу пропадает из API, с диска его уберет фоновая очистка
+        deleted = len(tombstone_files([self.pk]))
+        self.deleted_at = timezone.now()
+        self.share_link = None
+        return deleted, {self._meta.label: deleted}
+
+    class Meta:
+        # Индексы под курсорную пагинацию списка файлов: (поле сортировки, id)
+        indexes = [
+            models.Index(fields=['owner', 'upload_date', 'id'], name='file_owner_upload_idx'),
+            models.Index(fields=['owner', 'size', 'id'], name='file_owner_size_idx'),
+            models.Index(fields=['owner', 'original_name', 'id'], name='file_owner_name_idx'),
+            models.Index(fields=['upload_date', 'id'], name='file_upload_idx'),
+            # Частичный индекс для очистки истекших ссылок: файлы без ссылки в него не попадают
+            models.Index(
+                fields=['share_link_expiry'], name='file_share_expiry_idx',
+                condition=models.Q(share_link__isnull=False),
+            ),
+        ]
+
+
+# Сессия возобновляемой загрузки: файл принимается частями по диапазонам байт
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # id будущей записи FileStorage, от него строится имя файла на диске
+    file_id = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='upload_sessions')
+    original_name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    comment = models.TextField(blank=True, null=True)
+    size = models.BigIntegerField()
+    # Уже принятые диапазоны [start, end) в отсортированном и слитом виде
+    received = models.JSONField(default=list, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.original_name} ({self.owner.username})"
+
+    def save(self, *args, **kwargs):
+        if not self.name:
+            file_ext = os.path.splitext(self.original_name)[1]
+            self.name = f"{self.file_id}{file_ext}"
+        if not self.expires:
+            self.expires = timezone.now() + timezone.timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+        super().save(*args, **kwargs)
+
+    @property
+    def file_name(self):
+        # Путь относительно MEDIA_ROOT в той же раскладке, что и у FileStorage.file
+        return sharded_name('files', str(self.file_id), self.name)
+
+    @property
+    def file_path(self):
+        return os.path.join(settings.MEDIA_ROOT, self.file_name)
+
+    @property
+    def offset(self):
+        # Длина непрерывно принятого префикса файла
+        if self.received and self.received[0][0] == 0:
+            return self.received[0][1]
+        return 0
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    def prepare_file(self):
+        # Создаем разреженный файл нужного размера, чтобы части можно было писать параллельно
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        with open(self.file_path, 'ab') as f:
+            f.truncate(self.size)
+
+    def write_chunk(self, start, stream, length):
+        # Пишем часть прямо в итоговый файл по смещению, не держа её целиком в памяти
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        written = 0
+        try:
+            while written < length:
+                data = stream.read(min(settings.UPLOAD_CHUNK_READ_SIZE, length - written))
+                if not data:
+                    break
+                os.pwrite(fd, data, start + written)
+                written += len(data)
+        finally:
+            os.close(fd)
+        return written
+
+    @staticmethod
+    def merge_ranges(ranges, start, end):
+        merged = []
+        for range_start, range_end in sorted([*ranges, [start, end]]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        return merged
+
+    def remove_file(self):
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
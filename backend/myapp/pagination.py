@@ -0,0 +1,124 @@
+import base64
+import json
+import uuid
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Курсорная (keyset) пагинация: страница выбирается условием по (поле сортировки, id),
+# а не OFFSET, поэтому глубокие страницы стоят столько же, сколько первая
+class FileCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    default_ordering = '-upload_date'
+    # Публичное имя сортировки -> поле модели
+    ordering_fields = {
+        'upload_date': 'upload_date',
+        'size': 'size',
+        'name': 'original_name',
+    }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, settings.FILE_LIST_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError({'page_size': 'Неверный размер страницы'})
+        return max(1, min(page_size, settings.FILE_LIST_MAX_PAGE_SIZE))
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({'ordering': 'Недопустимое поле сортировки'})
+        return self.ordering_fields[ordering.lstrip('-')], ordering.startswith('-')
+
+    def encode_cursor(self, value, pk):
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        data = json.dumps([value, str(pk)]).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, field):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            value, pk = json.loads(data)
+            if field == 'upload_date':
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            elif field == 'size':
+                value = int(value)
+            # Подписи у курсора нет: id проверяется здесь, иначе запрос упадет в БД с 500
+            pk = uuid.UUID(str(pk))
+            return value, pk
+        except (ValueError, TypeError):
+            raise ValidationError({'cursor': 'Неверный курсор'})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, descending = self.get_ordering(request)
+
+        if descending:
+            queryset = queryset.order_by(f'-{self.field}', '-id')
+        else:
+            queryset = queryset.order_by(self.field, 'id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor, self.field)
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) |
+                Q(**{self.field: value, f'id__{lookup}': pk})
+            )
+
+        # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = None
+        if self.has_next:
+            last = page[-1]
+            # Страница может состоять из объектов модели или из словарей values()
+            if isinstance(last, dict):
+                self.next_cursor = self.encode_cursor(last[self.field], last['id'])
+            else:
+                self.next_cursor = self.encode_cursor(getattr(last, self.field), last.pk)
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'cursor': self.next_cursor,
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+# Пагинация результатов поиска: тот же keyset, но по аннотации rank и id
+class SearchCursorPagination(FileCursorPagination):
+    def __init__(self, descending=True):
+        self.descending = descending
+
+    def get_ordering(self, request):
+        return 'rank', self.descending
+
+    def decode_cursor(self, cursor, field):
+        value, pk = super().decode_cursor(cursor, field)
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValidationError({'cursor': 'Неверный курсор'})
+        return value, pk
@@ -0,0 +1,207 @@
+import hashlib
+import io
+import mimetypes
+import multiprocessing
+import os
+import threading
+import time
+import django
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils.module_loading import import_string
+from .downloads import open_file
+from .models import FileStorage, thumbnail_name
+
+try:
+    import magic
+except ImportError:
+    magic = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz
+    except ImportError:
+        fitz = None
+
+
+# Обработка после загрузки: стадии из UPLOAD_PIPELINE_STAGES выполняются по очереди
+# в пуле процессов, вне запроса. Стадия получает запись FileStorage и возвращает словарь
+# новых значений полей; уже посчитанное она пропускает, поэтому повтор безопасен.
+SNIFF_SIZE = 8192
+
+_executor = None
+_pid = None
+_lock = threading.Lock()
+
+
+def sniff_mime(file_storage):
+    if file_storage.mime_type:
+        return {}
+    mime_type = None
+    if magic is not None:
+        with open_file(file_storage) as f:
+            mime_type = magic.from_buffer(f.read(SNIFF_SIZE), mime=True)
+    # libmagic не узнал формат - верим расширению
+    if not mime_type or mime_type == 'application/octet-stream':
+        mime_type = mimetypes.guess_type(file_storage.original_name)[0] or 'application/octet-stream'
+    return {'mime_type': mime_type}
+
+
+def compute_checksum(file_storage):
+    if file_storage.checksum:
+        return {}
+    # Содержимое блоба уже адресовано по SHA-256
+    if file_storage.blob_id:
+        return {'checksum': file_storage.blob_id}
+    sha256 = hashlib.sha256()
+    with open_file(file_storage) as f:
+        for block in iter(lambda: f.read(settings.FILE_DOWNLOAD_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return {'checksum': sha256.hexdigest()}
+
+
+def render_image(f):
+    image = Image.open(f)
+    # JPEG сразу декодируется в уменьшенном масштабе
+    image.draft('RGB', (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+    return ImageOps.exif_transpose(image)
+
+
+def render_pdf(f):
+    document = fitz.open(stream=f.read(), filetype='pdf')
+    try:
+        page = document[0]
+        zoom = settings.THUMBNAIL_SIZE / max(page.rect.width, page.rect.height, 1)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    finally:
+        document.close()
+
+
+def make_thumbnail(file_storage):
+    if file_storage.thumbnail or Image is None or file_storage.size > settings.THUMBNAIL_MAX_SOURCE_SIZE:
+        return {}
+    if file_storage.mime_type.startswith('image/'):
+        render = render_image
+    elif file_storage.mime_type == 'application/pdf' and fitz is not None:
+        render = render_pdf
+    else:
+        return {}
+
+    name = thumbnail_name(file_storage.blob_id or file_storage.id.hex)
+    # Превью того же содержимого уже сделано для другого файла
+    if default_storage.exists(name):
+        return {'thumbnail': name}
+
+    with open_file(file_storage) as f:
+        try:
+            image = render(f)
+        except Exception:
+            # Поврежденный или неподдерживаемый файл - просто без превью
+            return {}
+        image.thumbnail((settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', quality=settings.THUMBNAIL_QUALITY)
+    return {'thumbnail': default_storage.save(name, ContentFile(buffer.getvalue()))}
+
+
+def get_stages():
+    return [import_string(path) for path in settings.UPLOAD_PIPELINE_STAGES]
+
+
+def run_stage(stage, file_storage):
+    retries = settings.UPLOAD_PIPELINE_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            return stage(file_storage)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(settings.UPLOAD_PIPELINE_RETRY_DELAY * 2 ** attempt)
+            # Файл могли перенести между уровнями хранения
+            file_storage.refresh_from_db(fields=['file'])
+
+
+# Выполняется в процессе пула. Результат каждой стадии сохраняется сразу,
+# так что после сбоя повтор начинается с недоделанной стадии.
+def process_file(pk):
+    try:
+        file_storage = FileStorage.objects.filter(pk=pk).first()
+        if file_storage is None or file_storage.processing_state == 'done':
+            return None
+        files = FileStorage.all_objects.filter(pk=pk)
+        files.update(processing_attempts=F('processing_attempts') + 1)
+
+        for stage in get_stages():
+            try:
+                updates = run_stage(stage, file_storage)
+            except Exception as e:
+                print(f"Ошибка обработки файла {pk} на стадии {stage.__name__}: {str(e)}")
+                files.update(processing_state='failed')
+                return 'failed'
+            if updates:
+                for field, value in updates.items():
+                    setattr(file_storage, field, value)
+                files.update(**updates)
+
+        files.update(processing_state='done')
+        return 'done'
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor, _pid
+    with _lock:
+        # spawn, а не fork: рабочие процессы не наследуют соединения с БД и потоки воркера.
+        # Django настраивается до того, как процесс получит первую задачу из этого модуля.
+        if _executor is None or _pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.UPLOAD_PIPELINE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+            _pid = os.getpid()
+        return _executor
+
+
+def reset_executor():
+    global _executor
+    with _lock:
+        _executor = None
+
+
+def report(future):
+    try:
+        future.result()
+    except BrokenProcessPool:
+        # Процесс пула упал; файл останется в pending и его подберет process_uploads
+        reset_executor()
+    except Exception as e:
+        print(f"Ошибка обработки файла: {str(e)}")
+
+
+def enqueue(pk):
+    if not settings.UPLOAD_PIPELINE_ENABLED:
+        return None
+    try:
+        future = get_executor().submit(process_file, pk)
+    except BrokenProcessPool:
+        reset_executor()
+        future = get_executor().submit(process_file, pk)
+    future.add_done_callback(report)
+    return future
@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import CustomUser
+
+
+# Квоты хранилища. Занятое место - total_size (сохраненные файлы) плюс reserved_size
+# (идущие загрузки и незавершенные сессии). Место резервируется одним условным UPDATE
+# до приема данных и освобождается по окончании загрузки: к этому моменту успешно
+# загруженный файл уже учтен в total_size сигналом count_uploaded_file.
+# Квота - CustomUser.quota, а если она не задана - STORAGE_DEFAULT_QUOTA; 0 - без ограничения.
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Превышена квота хранилища'
+    default_code = 'quota_exceeded'
+
+
+def effective_quota(user):
+    return settings.STORAGE_DEFAULT_QUOTA if user.quota is None else user.quota
+
+
+# Условие "еще size байт помещаются в квоту" для UPDATE по строке пользователя
+def fits(size):
+    condition = Q(quota=0) | Q(quota__gte=F('total_size') + F('reserved_size') + size)
+    default = settings.STORAGE_DEFAULT_QUOTA
+    if not default:
+        return condition | Q(quota__isnull=True)
+    return condition | Q(quota__isnull=True, total_size__lte=default - size - F('reserved_size'))
+
+
+# Резервирует size байт; False, если они не помещаются в квоту
+def reserve(user_id, size):
+    return bool(CustomUser.objects.filter(fits(size), pk=user_id).update(reserved_size=F('reserved_size') + size))
+
+
+def release(user_id, size):
+    if size:
+        CustomUser.objects.filter(pk=user_id).update(reserved_size=Greatest(F('reserved_size') - size, 0))
+
+
+# Резерв на время блока внутри транзакции, создающей файл: резерв и total_size
+# фиксируются вместе. При исключении резерв снимает откат транзакции.
+@contextmanager
+def reservation(user_id, size):
+    if not reserve(user_id, size):
+        raise QuotaExceeded()
+    yield
+    release(user_id, size)
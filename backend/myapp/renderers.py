@@ -0,0 +1,51 @@
+import json
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Вывод совпадает байт в байт с JSONRenderer DRF (компактные разделители, UTF-8,
+# экранирование U+2028/U+2029); при наличии orjson кодирование в разы быстрее
+def dump_json(data):
+    if orjson is not None:
+        try:
+            ret = orjson.dumps(data)
+        except TypeError:
+            ret = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+    else:
+        ret = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+    return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def json_response(data, status=200):
+    return HttpResponse(dump_json(data), status=status, content_type='application/json')
+
+
+# Потоковая выдача JSON-массива: строки читаются серверным курсором пачками
+# и отправляются по мере сериализации, поэтому память не растет с числом строк
+def stream_json_array(queryset, serialize):
+    chunk_size = settings.FILE_LIST_STREAM_CHUNK_SIZE
+    yield b'['
+    first = True
+    batch = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        batch.append(dump_json(serialize(obj)))
+        if len(batch) >= chunk_size:
+            yield (b'' if first else b',') + b','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + b','.join(batch)
+    yield b']'
+
+
+def streaming_json_response(queryset, serialize):
+    return StreamingHttpResponse(
+        stream_json_array(queryset, serialize),
+        content_type='application/json'
+    )
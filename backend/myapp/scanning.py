@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.core.files.storage import default_storage, storages
+from .models import Blob, FileStorage, UploadSession
+from .storage_backends import COLD_PREFIX, is_local
+
+
+# Каталоги (префиксы ключей), в которых лежат файлы хранилища
+STORAGE_PREFIXES = ('files', 'blobs', 'thumbs')
+
+
+def walk_tree(path, root):
+    found = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            name = os.path.relpath(full_path, root).replace(os.sep, '/')
+            found[name] = (stat.st_size, stat.st_mtime)
+    return found
+
+
+# Параллельный обход хранилища: каждый подкаталог верхнего уровня обходит свой поток.
+# Возвращает {имя в хранилище: (размер, mtime)}
+def scan_storage(workers, prefixes=STORAGE_PREFIXES, storage=None):
+    storage = storage or default_storage
+    found = {}
+    if not is_local(storage):
+        # Для объектного хранилища - постраничный листинг по префиксу
+        for prefix in prefixes:
+            for name, size, mtime in storage.scan(prefix):
+                found[name] = (size, mtime)
+        return found
+
+    subtrees = []
+    for prefix in prefixes:
+        root = os.path.join(storage.location, prefix)
+        if not os.path.isdir(root):
+            continue
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subtrees.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    found[f'{prefix}/{entry.name}'] = (stat.st_size, stat.st_mtime)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for subtree in executor.map(partial(walk_tree, root=storage.location), subtrees):
+            found.update(subtree)
+    return found
+
+
+# Оба уровня хранения; имена холодного приводятся к виду, в котором они хранятся в БД
+def scan_all(workers, prefixes=STORAGE_PREFIXES):
+    found = scan_storage(workers, prefixes)
+    for name, stat in scan_storage(workers, prefixes, storage=storages['cold']).items():
+        found[COLD_PREFIX + name] = stat
+    return found
+
+
+# Все имена в хранилище, на которые ссылается БД
+def known_names():
+    known = set(FileStorage.all_objects.values_list('file', flat=True).iterator())
+    known.update(Blob.objects.values_list('file', flat=True).iterator())
+    known.update(FileStorage.all_objects.exclude(thumbnail='').values_list('thumbnail', flat=True).iterator())
+    known.update(session.file_name for session in UploadSession.objects.only('file_id', 'name').iterator())
+    return known
@@ -0,0 +1,103 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Upper
+from rest_framework.exceptions import ValidationError
+
+
+# Поиск файлов владельца по original_name и comment. Режимы:
+#   prefix    - имя начинается с запроса, по алфавиту;
+#   substring - запрос встречается в имени или комментарии, сначала совпадения в начале имени;
+#   fulltext  - все слова запроса (последнее - как префикс) есть в имени или комментарии,
+#               по убыванию ts_rank.
+# На Postgres запросы обслуживают индексы миграции 0013_filestorage_search_indexes:
+# btree по ключу имени (prefix), триграммные GIN (substring) и GIN по tsvector (fulltext).
+# На других СУБД (SQLite в разработке) те же режимы выполняются через LIKE без индексов.
+MODES = ('fulltext', 'prefix', 'substring')
+
+# Выражения должны совпадать с индексами миграции, иначе планировщик их не использует
+NAME_KEY = 'UPPER("myapp_filestorage"."original_name") COLLATE "C"'
+DOCUMENT = (
+    "to_tsvector('simple'::regconfig, "
+    "translate(coalesce(\"myapp_filestorage\".\"original_name\", ''), '._-', '   ') || ' ' || "
+    "coalesce(\"myapp_filestorage\".\"comment\", ''))"
+)
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# Слова запроса; разделители в именах файлов (точки, подчеркивания, дефисы) словами не считаются
+def split_terms(query):
+    terms = re.findall(r'[^\W_]+', query)
+    if not terms:
+        raise ValidationError({'q': 'Запрос не содержит слов'})
+    return terms[:settings.SEARCH_MAX_TERMS]
+
+
+def prefix_search(files, query):
+    if connection.vendor == 'postgresql':
+        return files.annotate(rank=RawSQL(NAME_KEY, ())).filter(
+            RawSQL(f'{NAME_KEY} LIKE UPPER(%s)', (escape_like(query) + '%',), output_field=BooleanField())
+        )
+    return files.annotate(rank=Upper('original_name')).filter(original_name__istartswith=query)
+
+
+def substring_search(files, query):
+    if len(query) < settings.SEARCH_MIN_SUBSTRING_LENGTH:
+        raise ValidationError({'q': f'Для поиска по подстроке нужно не менее {settings.SEARCH_MIN_SUBSTRING_LENGTH} символов'})
+    # icontains дает UPPER(поле::text) LIKE - это выражение и покрывают триграммные индексы
+    files = files.filter(Q(original_name__icontains=query) | Q(comment__icontains=query))
+    return files.annotate(rank=Case(
+        When(original_name__istartswith=query, then=Value(3)),
+        When(original_name__icontains=query, then=Value(2)),
+        default=Value(1),
+        output_field=IntegerField(),
+    ))
+
+
+def fulltext_search(files, query):
+    terms = split_terms(query)
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+        matches = RawSQL(f"{DOCUMENT} @@ to_tsquery('simple'::regconfig, %s)", (tsquery,), output_field=BooleanField())
+        # float8: значение ранга в курсоре должно без потерь пройти через JSON
+        rank = RawSQL(
+            f"ts_rank({DOCUMENT}, to_tsquery('simple'::regconfig, %s))::float8", (tsquery,), output_field=FloatField()
+        )
+        return files.filter(matches).annotate(rank=rank)
+
+    for term in terms:
+        files = files.filter(Q(original_name__icontains=term) | Q(comment__icontains=term))
+    hits = [
+        Case(When(original_name__icontains=term, then=Value(1)), default=Value(0), output_field=IntegerField())
+        for term in terms
+    ]
+    rank = hits[0]
+    for hit in hits[1:]:
+        rank = rank + hit
+    return files.annotate(rank=rank)
+
+
+# Отфильтрованный queryset с аннотацией rank, по которой идет пагинация
+def search_files(files, query, mode):
+    query = (query or '').strip()
+    if not query:
+        raise ValidationError({'q': 'Пустой поисковый запрос'})
+    if len(query) > settings.SEARCH_MAX_QUERY_LENGTH:
+        raise ValidationError({'q': f'Запрос длиннее {settings.SEARCH_MAX_QUERY_LENGTH} символов'})
+    if mode == 'prefix':
+        return prefix_search(files, query)
+    if mode == 'substring':
+        return substring_search(files, query)
+    if mode == 'fulltext':
+        return fulltext_search(files, query)
+    raise ValidationError({'mode': 'Недопустимый режим поиска'})
+
+
+# Префиксный поиск упорядочен по имени, остальные режимы - по убыванию релевантности
+def is_descending(mode):
+    return mode != 'prefix'
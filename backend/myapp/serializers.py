@@ -5,11 +5,16 @@ from .validators import validate_password
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    storage = serializers.SerializerMethodField()
+
     class Meta:
         model = CustomUser
-        fields = ['id', 'username', 'email', 'is_admin']
+        fields = ['id', 'username', 'email', 'is_admin', 'storage']
         read_only_fields = ('username',)
 
+    def get_storage(self, obj):
+        return obj.get_storage_info()
+
     def validate_email(self, value):
         user = self.context['request'].user
         if CustomUser.objects.exclude(pk=user.pk).filter(email=value).exists():
@@ -89,34 +94,67 @@ class FileStorageSerializer(serializers.ModelSerializer):
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     is_owner = serializers.SerializerMethodField()
     original_name = serializers.CharField(read_only=True)
+    has_thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = FileStorage
         fields = ('id', 'original_name', 'name', 'comment', 'size', 'owner', 'owner_username', 
-                 'upload_date', 'last_download', 'share_link', 'is_owner')
-        read_only_fields = ('id', 'size', 'owner', 'upload_date', 'last_download', 'share_link')
+                 'upload_date', 'last_download', 'download_count', 'share_link', 'is_owner',
+                 'mime_type', 'has_thumbnail')
+        read_only_fields = ('id', 'size', 'owner', 'upload_date', 'last_download', 'download_count',
+                            'share_link', 'mime_type')
 
     def get_is_owner(self, obj):
         request = self.context.get('request')
         return request and request.user == obj.owner
 
+    def get_has_thumbnail(self, obj):
+        return bool(obj.thumbnail)
+
+
+# Быстрый путь чтения для списков: строки берутся через values() одним запросом с join
+# на владельца и собираются в тот же вывод, что и у FileStorageSerializer, без полей DRF
+FILE_LIST_VALUES = (
+    'id', 'original_name', 'name', 'comment', 'size', 'owner_id', 'owner__username',
+    'upload_date', 'last_download', 'download_count', 'share_link', 'mime_type', 'thumbnail',
+)
+datetime_field = serializers.DateTimeField()
+
+
+def file_list_row(row, user_id):
+    last_download = row['last_download']
+    share_link = row['share_link']
+    return {
+        'id': str(row['id']),
+        'original_name': row['original_name'],
+        'name': row['name'],
+        'comment': row['comment'],
+        'size': row['size'],
+        'owner': row['owner_id'],
+        'owner_username': row['owner__username'],
+        'upload_date': datetime_field.to_representation(row['upload_date']),
+        'last_download': datetime_field.to_representation(last_download) if last_download else None,
+        'download_count': row['download_count'],
+        'share_link': str(share_link) if share_link else None,
+        'is_owner': row['owner_id'] == user_id,
+        'mime_type': row['mime_type'],
+        'has_thumbnail': bool(row['thumbnail']),
+    }
+
 
 class AdminUserSerializer(serializers.ModelSerializer):
-    total_files = serializers.SerializerMethodField()
-    total_storage = serializers.SerializerMethodField()
+    total_files = serializers.IntegerField(source='file_count', read_only=True)
+    total_storage = serializers.IntegerField(source='total_size', read_only=True)
+    reserved_storage = serializers.IntegerField(source='reserved_size', read_only=True)
+    # Квота в байтах: null - квота по умолчанию, 0 - без ограничения
+    quota = serializers.IntegerField(required=False, allow_null=True, min_value=0)
 
     class Meta:
         model = CustomUser
         fields = ('id', 'username', 'email', 'is_admin', 'date_joined', 
-                 'total_files', 'total_storage')
+                 'total_files', 'total_storage', 'reserved_storage', 'quota')
         read_only_fields = ('date_joined',)
 
-    def get_total_files(self, obj):
-        return FileStorage.objects.filter(owner=obj).count()
-
-    def get_total_storage(self, obj):
-        return sum(file.size for file in FileStorage.objects.filter(owner=obj))
-
 
 class FileStorageUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
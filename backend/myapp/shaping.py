@@ -0,0 +1,174 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# Ограничение полосы для передачи файлов. Передача расходует байты из двух ведер:
+# общего для направления (BANDWIDTH_DOWNLOAD_LIMIT / BANDWIDTH_UPLOAD_LIMIT) и ведра
+# своего "арендатора" - пользователя или публичной ссылки (BANDWIDTH_USER_LIMIT /
+# BANDWIDTH_SHARE_LINK_LIMIT). Ведро пополняется на rate * BANDWIDTH_WINDOW байт каждое
+# окно; порция, не поместившаяся в текущее окно, резервируется в ближайшем свободном,
+# и передача ждет его начала. Порции резервируются по одной, поэтому параллельные
+# передачи чередуются. Справедливость между арендаторами: пока общий лимит задан,
+# ведро арендатора не больше общего лимита, деленного на число активных арендаторов.
+# Счетчики живут в кеше BANDWIDTH_CACHE_ALIAS, общем для воркеров сервера (memcached,
+# redis - нужен атомарный incr), а если алиас не задан - в памяти процесса.
+WINDOWS_AHEAD = 600
+
+_local = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _local
+    alias = settings.BANDWIDTH_CACHE_ALIAS
+    if alias:
+        return caches[alias]
+    with _lock:
+        if _local is None:
+            _local = LocMemCache('myapp-bandwidth', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+        return _local
+
+
+def is_enabled():
+    return any((
+        settings.BANDWIDTH_DOWNLOAD_LIMIT, settings.BANDWIDTH_UPLOAD_LIMIT,
+        settings.BANDWIDTH_USER_LIMIT, settings.BANDWIDTH_SHARE_LINK_LIMIT,
+    ))
+
+
+def incr(store, key, delta, timeout):
+    store.add(key, 0, timeout=timeout)
+    try:
+        return store.incr(key, delta)
+    except ValueError:
+        # Ключ истек между add и incr
+        store.add(key, 0, timeout=timeout)
+        return store.incr(key, delta)
+
+
+# Резервирует size байт в ведре key. Возвращает, сколько секунд ждать до отправки
+def reserve(store, key, rate, size, now):
+    window = settings.BANDWIDTH_WINDOW
+    budget = max(int(rate * window), 1)
+    index = int(now // window)
+    for ahead in range(WINDOWS_AHEAD):
+        counter = f'bw:{key}:{index + ahead}'
+        timeout = window * (ahead + 2)
+        used = incr(store, counter, size, timeout)
+        # Порция больше окна целиком занимает пустое окно
+        if used <= budget or used == size:
+            return (index + ahead) * window - now if ahead else 0
+        try:
+            store.decr(counter, size)
+        except ValueError:
+            pass
+    return WINDOWS_AHEAD * window
+
+
+class Transfer:
+    def __init__(self, direction, tenant, tenant_limit):
+        self.direction = direction
+        self.tenant = tenant
+        self.tenant_limit = tenant_limit
+        self.global_limit = (
+            settings.BANDWIDTH_DOWNLOAD_LIMIT if direction == 'download' else settings.BANDWIDTH_UPLOAD_LIMIT
+        )
+        self.store = get_store()
+        self.pending = 0
+
+    # Число арендаторов, передававших данные в этом или прошлом окне
+    def active_tenants(self, index):
+        window = settings.BANDWIDTH_WINDOW
+        if self.store.add(f'bwt:{self.direction}:{self.tenant}:{index}', 1, timeout=window * 2):
+            incr(self.store, f'bwn:{self.direction}:{index}', 1, window * 3)
+        counts = self.store.get_many([f'bwn:{self.direction}:{index}', f'bwn:{self.direction}:{index - 1}'])
+        return max([*counts.values(), 1])
+
+    # Байты учитываются порциями не меньше BANDWIDTH_QUANTUM: меньше обращений к общему кешу
+    def throttle(self, size):
+        self.pending += size
+        if self.pending < settings.BANDWIDTH_QUANTUM:
+            return
+        size, self.pending = self.pending, 0
+        now = time.time()
+        delay = 0
+        tenant_limit = self.tenant_limit
+        if self.global_limit:
+            delay = reserve(self.store, f'{self.direction}:all', self.global_limit, size, now)
+            fair_share = self.global_limit / self.active_tenants(int(now // settings.BANDWIDTH_WINDOW))
+            tenant_limit = min(tenant_limit, fair_share) if tenant_limit else fair_share
+        if tenant_limit:
+            delay = max(delay, reserve(self.store, f'{self.direction}:{self.tenant}', tenant_limit, size, now))
+
+        incr(self.store, f'bwm:{self.direction}:bytes', size, None)
+        if delay > 0:
+            incr(self.store, f'bwm:{self.direction}:delay_ms', int(delay * 1000), None)
+            time.sleep(delay)
+
+
+def transfer(direction, user=None, share_link=None):
+    if share_link is not None:
+        return Transfer(direction, f'link:{share_link}', settings.BANDWIDTH_SHARE_LINK_LIMIT)
+    return Transfer(direction, f'user:{user.pk}', settings.BANDWIDTH_USER_LIMIT)
+
+
+# Тело ответа с ограничением скорости
+def shaped(iterable, current):
+    for block in iterable:
+        current.throttle(len(block))
+        yield block
+
+
+def limit_response(response, user=None, share_link=None):
+    if not is_enabled() or response.status_code not in (200, 206):
+        return response
+    if response.streaming:
+        # Тело FileResponse больше не уходит через wsgi.file_wrapper: его отдает ограничитель
+        response.streaming_content = shaped(response.streaming_content, transfer('download', user, share_link))
+    elif 'X-Accel-Redirect' in response:
+        # Тело отдает nginx: ему передается лимит арендатора, общий лимит задается в nginx
+        limit = settings.BANDWIDTH_SHARE_LINK_LIMIT if share_link is not None else settings.BANDWIDTH_USER_LIMIT
+        if limit:
+            response['X-Accel-Limit-Rate'] = limit
+    return response
+
+
+# Файлоподобный поток тела запроса, читаемый с ограничением скорости
+class ShapedReader:
+    def __init__(self, stream, current):
+        self.stream = stream
+        self.current = current
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.current.throttle(len(data))
+        return data
+
+
+def metrics():
+    store = get_store()
+    index = int(time.time() // settings.BANDWIDTH_WINDOW)
+    result = {}
+    for direction, limit in (('download', settings.BANDWIDTH_DOWNLOAD_LIMIT),
+                             ('upload', settings.BANDWIDTH_UPLOAD_LIMIT)):
+        values = store.get_many([
+            f'bwm:{direction}:bytes', f'bwm:{direction}:delay_ms',
+            f'bwn:{direction}:{index}', f'bwn:{direction}:{index - 1}',
+            f'bw:{direction}:all:{index - 1}',
+        ])
+        result[direction] = {
+            'limit': limit,
+            'bytes_total': values.get(f'bwm:{direction}:bytes', 0),
+            'throttled_seconds_total': values.get(f'bwm:{direction}:delay_ms', 0) / 1000,
+            'active_tenants': max(values.get(f'bwn:{direction}:{index}', 0), values.get(f'bwn:{direction}:{index - 1}', 0)),
+            # Байт за последнее завершенное окно; считается, только когда задан общий лимит
+            'last_window_bytes': values.get(f'bw:{direction}:all:{index - 1}', 0),
+        }
+    result['user_limit'] = settings.BANDWIDTH_USER_LIMIT
+    result['share_link_limit'] = settings.BANDWIDTH_SHARE_LINK_LIMIT
+    result['window'] = settings.BANDWIDTH_WINDOW
+    result['shared'] = bool(settings.BANDWIDTH_CACHE_ALIAS)
+    return result
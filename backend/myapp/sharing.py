@@ -0,0 +1,68 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .caching import share_links
+from .models import FileStorage
+
+
+# Публичные ссылки: срок действия (share_link_expiry) и необязательный лимит скачиваний
+# (share_link_max_downloads). Истекшие ссылки отзывает revoke_expired_links пачками по
+# частичному индексу file_share_expiry_idx, каждая пачка - в своей короткой транзакции.
+def default_expiry():
+    return timezone.now() + timedelta(seconds=settings.SHARE_LINK_TTL)
+
+
+# Ссылка действует: срок не истек и лимит скачиваний, если он задан, не исчерпан
+def available():
+    return (
+        (Q(share_link_expiry__isnull=True) | Q(share_link_expiry__gt=timezone.now())) &
+        (Q(share_link_max_downloads__isnull=True) | Q(share_link_downloads__lt=F('share_link_max_downloads')))
+    )
+
+
+# Засчитывает скачивание по ссылке с лимитом одним условным UPDATE по уникальному индексу
+# share_link; сам лимит и счетчик читаются в UPDATE, а не из кеша ссылок. Считается каждая
+# передача тела, включая докачку любым Range, иначе лимит обходится запросами диапазонов.
+# count=False - только проверка (HEAD). False - ссылка недоступна.
+# Ссылки без лимита сюда не попадают (см. is_limited): их скачивания считает download_stats
+def consume_download(share_link, count=True):
+    files = FileStorage.objects.filter(available(), share_link=share_link)
+    if not count:
+        return files.exists()
+    return bool(files.update(share_link_downloads=F('share_link_downloads') + 1))
+
+
+# Лимит берется из записи кеша ссылок: его установка (FileShareView.post) сбрасывает кеш,
+# в остальных процессах новый лимит действует не позже чем через SHARE_LINK_LOCAL_TTL
+def is_limited(file_storage):
+    return file_storage.share_link_max_downloads is not None
+
+
+# Отзывает до batch_size истекших ссылок. Строки, заблокированные другими транзакциями,
+# пропускаются и подберутся следующим проходом. Возвращает число отозванных ссылок
+def revoke_expired_links(batch_size=None, now=None):
+    batch_size = batch_size or settings.SHARE_LINK_SWEEP_BATCH_SIZE
+    now = now or timezone.now()
+
+    with transaction.atomic():
+        rows = list(
+            FileStorage.objects.select_for_update(skip_locked=True)
+            .filter(share_link__isnull=False, share_link_expiry__lte=now)
+            .order_by('share_link_expiry')
+            .values('id', 'share_link')[:batch_size]
+        )
+        if not rows:
+            return 0
+        # Условие на срок повторяется: ссылку, продленную после выборки, не отзываем
+        revoked = FileStorage.all_objects.filter(pk__in=[row['id'] for row in rows], share_link_expiry__lte=now).update(
+            share_link=None,
+            share_link_expiry=None,
+            share_link_max_downloads=None,
+            share_link_downloads=0,
+        )
+
+    for row in rows:
+        share_links.invalidate(row['share_link'])
+    return revoked
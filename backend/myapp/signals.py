@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from . import pipeline
+from .authentication import forget_user
+from .caching import share_links
+from .deletion import remove_session_files, tombstone_owner_files
+from .models import CustomUser, FileStorage, UploadSession
+
+
+# Счетчики хранилища пользователя обновляются атомарно в той же транзакции, что и запись файла.
+# Уменьшает их пометка файла на удаление (deletion.tombstone_files), поэтому обработчиков
+# post_delete нет и каскадное удаление файлов пользователя выполняется одним запросом.
+@receiver(post_save, sender=FileStorage)
+def count_uploaded_file(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CustomUser.objects.filter(pk=instance.owner_id).update(
+            file_count=F('file_count') + 1,
+            total_size=F('total_size') + instance.size,
+        )
+
+
+# MIME, контрольная сумма и превью считаются в пуле процессов после фиксации транзакции
+@receiver(post_save, sender=FileStorage)
+def process_uploaded_file(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: pipeline.enqueue(instance.pk))
+
+
+# Переименование и повторная выдача ссылки сбрасывают закешированную ссылку,
+# удаление сбрасывает ее в deletion.tombstone_files
+@receiver(post_save, sender=FileStorage)
+def invalidate_share_link(sender, instance, **kwargs):
+    share_links.invalidate(instance.share_link)
+
+
+# Кеш пользователей для токенов доступа: смена пароля, блокировка и удаление
+# видны в этом процессе сразу, в остальных - через AUTH_TOKEN_USER_CACHE_TTL
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+# Удаление пользователя любым путем (объект, queryset, массовое удаление в админке) помечает
+# его файлы на удаление; ссылки на блобы и файлы на диске отпускает reap_files.
+# Сессии загрузки удаляются каскадом, их недокачанные файлы - после фиксации транзакции
+@receiver(pre_delete, sender=CustomUser)
+def tombstone_user_files(sender, instance, **kwargs):
+    tombstone_owner_files(instance)
+    sessions = list(UploadSession.objects.filter(owner=instance).only('file_id', 'name'))
+    if sessions:
+        transaction.on_commit(lambda: remove_session_files(sessions))
@@ -0,0 +1,280 @@
+import io
+import math
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage, default_storage, storages
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+# S3 не принимает части multipart меньше 5 МБ (кроме последней) и больше 10000 частей
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+
+
+# Файлы холодного уровня лежат в хранилище STORAGES['cold'], в БД их имена
+# отличаются префиксом COLD_PREFIX
+COLD_PREFIX = 'cold/'
+
+
+# Локальное хранилище позволяет отдавать файлы через X-Sendfile и класть их жесткой ссылкой
+def is_local(storage=None):
+    return getattr(storage or default_storage, 'is_local', False)
+
+
+def is_cold(name):
+    return name.startswith(COLD_PREFIX)
+
+
+# Хранилище и имя в нем для имени файла из БД
+def locate(name):
+    if is_cold(name):
+        return storages['cold'], name[len(COLD_PREFIX):]
+    return default_storage, name
+
+
+def delete_stored(name):
+    storage, key = locate(name)
+    storage.delete(key)
+
+
+# Хранение в MEDIA_ROOT (прежнее поведение)
+@deconstructible
+class LocalStorage(FileSystemStorage):
+    is_local = True
+
+    # Кладет готовый файл с диска под точным именем: жесткой ссылкой на том же разделе, иначе копией
+    def put_file(self, name, source_path):
+        target = self.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source_path, target)
+        except FileExistsError:
+            # Файл с тем же содержимым уже на месте
+            pass
+        except OSError:
+            shutil.copyfile(source_path, target)
+        return name
+
+
+# Файл в S3, читаемый ranged GET-запросами. Последовательное чтение идет окнами
+# по read_window байт, seek() только сдвигает позицию и не делает запросов.
+class S3File(io.RawIOBase):
+    def __init__(self, storage, name, size):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.position = 0
+        self.body = None
+        self.body_end = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self.position:
+            self.close_body()
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        if self.body is None or self.position >= self.body_end:
+            self.close_body()
+            self.body_end = min(self.position + self.storage.read_window, self.size)
+            self.body = self.storage.get_range(self.name, self.position, self.body_end - 1)
+        data = self.body.read(min(len(buffer), self.body_end - self.position))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def close(self):
+        self.close_body()
+        super().close()
+
+
+# S3-совместимое хранилище (AWS, MinIO, Ceph RGW). Клиент boto3 держит пул
+# HTTP-соединений на max_pool_connections и используется всеми потоками процесса.
+@deconstructible
+class S3Storage(Storage):
+    is_local = False
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, location=None, multipart_threshold=None,
+                 part_size=None, upload_workers=None, max_pool_connections=None,
+                 read_window=None, url_expiry=None):
+        self.bucket = bucket or settings.S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.S3_ENDPOINT_URL
+        self.region = region or settings.S3_REGION
+        self.access_key_id = access_key_id or settings.S3_ACCESS_KEY_ID
+        self.secret_access_key = secret_access_key or settings.S3_SECRET_ACCESS_KEY
+        self.location = (location if location is not None else settings.S3_LOCATION).strip('/')
+        self.multipart_threshold = multipart_threshold or settings.S3_MULTIPART_THRESHOLD
+        self.part_size = max(part_size or settings.S3_MULTIPART_PART_SIZE, S3_MIN_PART_SIZE)
+        self.upload_workers = upload_workers or settings.S3_UPLOAD_WORKERS
+        self.max_pool_connections = max_pool_connections or settings.S3_MAX_POOL_CONNECTIONS
+        self.read_window = read_window or settings.S3_READ_WINDOW
+        self.url_expiry = url_expiry or settings.S3_URL_EXPIRY
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            # После fork воркера соединения родителя использовать нельзя
+            if self._client is None or self._pid != os.getpid():
+                if boto3 is None:
+                    raise RuntimeError('Для хранилища S3 нужен пакет boto3')
+                self._client = boto3.session.Session().client(
+                    's3',
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region,
+                    aws_access_key_id=self.access_key_id,
+                    aws_secret_access_key=self.secret_access_key,
+                    config=Config(
+                        max_pool_connections=self.max_pool_connections,
+                        retries={'max_attempts': 5, 'mode': 'standard'},
+                    ),
+                )
+                self._pid = os.getpid()
+            return self._client
+
+    def key(self, name):
+        name = name.replace('\\', '/').lstrip('/')
+        return f'{self.location}/{name}' if self.location else name
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def get_range(self, name, start, end):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(name), Range=f'bytes={start}-{end}')
+        return response['Body']
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('Файлы S3 открываются только на чтение')
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return File(S3File(self, name, head['ContentLength']), name)
+
+    def _save(self, name, content):
+        content.seek(0, io.SEEK_END)
+        size = content.tell()
+        self.upload(name, content, size)
+        return name
+
+    def put_file(self, name, source_path):
+        with open(source_path, 'rb') as f:
+            self.upload(name, f, os.path.getsize(source_path))
+        return name
+
+    # Небольшие файлы - одним PUT, крупные - multipart, части отправляются параллельно.
+    # Часть читается из файла непосредственно перед отправкой, так что в памяти
+    # одновременно не больше upload_workers частей.
+    def upload(self, name, f, size):
+        key = self.key(name)
+        if size <= self.multipart_threshold:
+            f.seek(0)
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=f.read())
+            return
+
+        part_size = max(self.part_size, math.ceil(size / S3_MAX_PARTS))
+        read_lock = threading.Lock()
+
+        def upload_part(number):
+            with read_lock:
+                f.seek((number - 1) * part_size)
+                data = f.read(part_size)
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+            )
+            return {'PartNumber': number, 'ETag': response['ETag']}
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+        try:
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+                parts = list(executor.map(upload_part, range(1, math.ceil(size / part_size) + 1)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            # Иначе недокачанные части так и останутся в бакете
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def size(self, name):
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def url(self, name):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name)},
+            ExpiresIn=self.url_expiry,
+        )
+
+    def listdir(self, path):
+        prefix = self.key(path).rstrip('/')
+        prefix = f'{prefix}/' if prefix else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            directories.extend(item['Prefix'][len(prefix):].rstrip('/') for item in page.get('CommonPrefixes', []))
+            files.extend(item['Key'][len(prefix):] for item in page.get('Contents', []))
+        return directories, files
+
+    # Все объекты под префиксом: (имя, размер, mtime) - аналог обхода каталога для sweep_storage
+    def scan(self, prefix):
+        base = f'{self.location}/' if self.location else ''
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.key(prefix).rstrip('/') + '/'):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(base):], item['Size'], item['LastModified'].timestamp()
@@ -1,3 +1,1785 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipIf
+from urllib.parse import quote
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = mock_aws = None
 
-# Create your tests here.
+from . import admission, blobstore, compression, pipeline, shaping, sharing, tiering
+from .authentication import forget_user
+from .blobstore import BlobUploadHandler
+from .caching import share_links
+from .deletion import reap_files
+from .download_stats import DownloadRecorder, recorder
+from .models import Blob, CustomUser, FileStorage, UploadSession, thumbnail_name
+from .renderers import dump_json
+from .serializers import FILE_LIST_VALUES, FileStorageSerializer, file_list_row
+from .storage_backends import S3Storage, locate
+
+
+# Стадия обработки для тестов конвейера: падает, пока не исчерпает failures
+stage_failures = {'left': 0}
+
+
+def flaky_stage(file_storage):
+    if stage_failures['left']:
+        stage_failures['left'] -= 1
+        raise OSError('хранилище недоступно')
+    return {'checksum': 'flaky'}
+
+
+# Хранилища во временных каталогах; фоновые потоки (конвейер, отложенная запись
+# статистики, фоновая очистка) отключены, чтобы все изменения шли в транзакции теста
+class StorageMixin:
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        override = override_settings(
+            MEDIA_ROOT=f'{self.root}/media',
+            FILE_STORAGE_BASE_DIR=f'{self.root}/storage',
+            STORAGES={
+                'default': {'BACKEND': 'myapp.storage_backends.LocalStorage'},
+                'cold': {'BACKEND': 'myapp.storage_backends.LocalStorage', 'OPTIONS': {'location': f'{self.root}/cold'}},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            UPLOAD_PIPELINE_ENABLED=False,
+            DOWNLOAD_STATS_FLUSH_INTERVAL=0,
+            DELETION_REAP_IMMEDIATELY=False,
+            TIERING_REHYDRATE_ON_DOWNLOAD=False,
+            FILE_DELIVERY_BACKEND='direct',
+            FILE_DELIVERY_EMULATE_PROXY=False,
+            STORAGE_COMPRESSION=False,
+            ADMISSION_CONTROL_ENABLED=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = self.create_user('alice')
+        self.client = self.client_for(self.user)
+
+    def create_user(self, username, **kwargs):
+        return CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password='x', **kwargs)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def upload(self, name, data, client=None, comment=''):
+        response = (client or self.client).post(
+            '/api/files/upload/', {'file': SimpleUploadedFile(name, data), 'comment': comment}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return FileStorage.objects.get(pk=response.json()['id'])
+
+
+class StorageTestCase(StorageMixin, TestCase):
+    pass
+
+
+class BlobClaimTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.secret = self.upload('secret.txt', b'secret content')
+        self.digest = self.secret.blob_id
+        self.other = self.client_for(self.create_user('mallory'))
+
+    def test_etag_does_not_expose_digest(self):
+        response = self.client.head(f'/api/shared/{self.secret.share_link}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.digest, response['ETag'])
+
+    def test_other_user_cannot_probe_or_claim_blob(self):
+        self.assertEqual(self.other.get(f'/api/files/blobs/{self.digest}/').status_code, 404)
+        response = self.other.post(f'/api/files/blobs/{self.digest}/', {'name': 'stolen.txt'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(FileStorage.objects.filter(original_name='stolen.txt').exists())
+
+    def test_owner_can_claim_own_blob(self):
+        self.assertEqual(self.client.get(f'/api/files/blobs/{self.digest}/').json(), {'exists': True, 'size': 14})
+        response = self.client.post(f'/api/files/blobs/{self.digest}/', {'name': 'copy.txt'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(FileStorage.objects.get(original_name='copy.txt').blob_id, self.digest)
+
+
+class ShareLinkLimitTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload('shared.bin', bytes(range(256)) * 64)
+        response = self.client.post(f'/api/files/{self.file.pk}/share/', {'max_downloads': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.url = f'/api/shared/{self.file.share_link}/'
+        self.anonymous = APIClient()
+
+    def downloads(self):
+        return FileStorage.objects.values_list('share_link_downloads', flat=True).get(pk=self.file.pk)
+
+    def test_ranges_cannot_bypass_limit(self):
+        self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+        for header in ('bytes=-100000', 'bytes=1-', 'bytes=0-10'):
+            self.assertEqual(self.anonymous.get(self.url, HTTP_RANGE=header).status_code, 410, header)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_range_request_counts_as_download(self):
+        self.assertEqual(self.anonymous.get(self.url, HTTP_RANGE='bytes=100-').status_code, 206)
+        self.assertEqual(self.downloads(), 1)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 410)
+
+    def test_not_modified_and_unsatisfiable_do_not_count(self):
+        etag = self.anonymous.head(self.url)['ETag']
+        self.assertEqual(self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.anonymous.get(self.url, HTTP_RANGE='bytes=999999-').status_code, 416)
+        self.assertEqual(self.downloads(), 0)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+
+    def test_counter_is_read_from_row_despite_cached_link(self):
+        self.assertEqual(self.anonymous.head(self.url).status_code, 200)
+        # Скачивание засчитал другой воркер: кеш ссылки этого процесса о нем не знает
+        FileStorage.objects.filter(pk=self.file.pk).update(share_link_downloads=1)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 410)
+
+    def test_new_limit_applies_to_cached_link(self):
+        self.client.post(f'/api/files/{self.file.pk}/share/', {}, format='json')
+        self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+        self.client.post(f'/api/files/{self.file.pk}/share/', {'max_downloads': 1}, format='json')
+        self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 410)
+
+    @override_settings(DOWNLOAD_STATS_FLUSH_INTERVAL=60)
+    def test_unlimited_link_does_not_write_on_cache_hit(self):
+        self.client.post(f'/api/files/{self.file.pk}/share/', {}, format='json')
+        self.addCleanup(recorder.pending.clear)
+        with mock.patch.object(recorder, 'ensure_flusher'):
+            self.assertEqual(self.anonymous.get(self.url).status_code, 200)
+            # Ссылка в кеше: ни чтения, ни UPDATE; скачивание копит DownloadRecorder
+            with self.assertNumQueries(0):
+                response = self.anonymous.get(self.url)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(recorder.pending_for(self.file.pk)[1], 2)
+        self.assertEqual(self.downloads(), 0)
+
+
+class ColdTierTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload('cold.bin', os.urandom(300000))
+        with override_settings(TIERING_SOURCE_GRACE=0):
+            tiering.freeze_blob(self.file.blob)
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.file.name.startswith('cold/'))
+
+    @override_settings(TIERING_REHYDRATE_ON_DOWNLOAD=True)
+    def test_rehydration_starts_after_response_is_closed(self):
+        with mock.patch('myapp.tiering.background.submit') as submit:
+            response = self.client.post('/api/files/archive/', {'ids': [str(self.file.pk)]}, format='json')
+            submit.assert_not_called()
+            self.assertTrue(b''.join(response.streaming_content))
+            submit.assert_called_once()
+
+    @override_settings(TIERING_SOURCE_GRACE=60)
+    def test_source_is_kept_for_grace_period(self):
+        cold_name = self.file.file.name
+        tiering.rehydrate(self.file.blob_id, self.file.pk)
+        self.addCleanup(lambda: [timer.cancel() for timer in tiering._retiring])
+        self.file.refresh_from_db()
+        self.assertFalse(self.file.file.name.startswith('cold/'))
+        storage, key = locate(cold_name)
+        self.assertTrue(storage.exists(key))
+
+
+class TierStorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(5000)
+        self.idle = self.upload('idle.bin', self.data)
+        self.recent = self.upload('recent.bin', os.urandom(5000))
+        legacy_name = default_storage.save('files/legacy.bin', ContentFile(b'legacy'))
+        self.legacy = FileStorage.objects.create(
+            owner=self.user, original_name='legacy.bin', name='legacy.bin', file=legacy_name, size=6
+        )
+        old = timezone.now() - timedelta(days=100)
+        FileStorage.objects.filter(pk__in=[self.idle.pk, self.legacy.pk]).update(upload_date=old)
+        FileStorage.objects.filter(pk=self.recent.pk).update(last_download=timezone.now())
+        self.hot_name = self.idle.file.name
+
+    def tier(self, *args):
+        out = io.StringIO()
+        call_command('tier_storage', '--days', '90', '--max-rate', '0', '--no-compress', *args, stdout=out)
+        return out.getvalue()
+
+    def name_of(self, file_storage):
+        return FileStorage.objects.get(pk=file_storage.pk).file.name
+
+    @override_settings(TIERING_SOURCE_GRACE=0)
+    def test_idle_files_move_to_cold_tier(self):
+        self.assertIn('Перенесено на холодный уровень: 2 файлов', self.tier())
+        self.assertEqual(self.name_of(self.idle), f'cold/{self.hot_name}')
+        self.assertEqual(Blob.objects.get(pk=self.idle.blob_id).file.name, f'cold/{self.hot_name}')
+        self.assertEqual(self.name_of(self.legacy), 'cold/files/legacy.bin')
+        self.assertFalse(self.name_of(self.recent).startswith('cold/'))
+        self.assertFalse(default_storage.exists(self.hot_name))
+        response = self.client.get(f'/api/files/{self.idle.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        # Повторный запуск ничего не переносит
+        self.assertIn('Перенесено на холодный уровень: 0 файлов', self.tier())
+
+    def test_dry_run_moves_nothing(self):
+        self.assertIn('Будет перенесено: 2 файлов', self.tier('--dry-run'))
+        self.assertEqual(self.name_of(self.idle), self.hot_name)
+
+    @override_settings(TIERING_SOURCE_GRACE=60)
+    def test_hot_copy_is_kept_for_grace_period(self):
+        self.addCleanup(lambda: [timer.cancel() for timer in tiering._retiring])
+        with mock.patch('myapp.management.commands.tier_storage.wait_retired') as wait_retired:
+            self.tier()
+        wait_retired.assert_called_once()
+        # Ответы, начатые до переноса, еще читают горячую копию
+        self.assertTrue(self.name_of(self.idle).startswith('cold/'))
+        self.assertTrue(default_storage.exists(self.hot_name))
+        self.assertTrue(default_storage.exists('files/legacy.bin'))
+
+    @override_settings(TIERING_SOURCE_GRACE=0, TIERING_REHYDRATE_ON_DOWNLOAD=True)
+    def test_download_rehydrates_after_response_is_closed(self):
+        self.tier()
+        with mock.patch('myapp.tiering.background.submit', side_effect=lambda fn, *args: fn(*args)) as submit:
+            response = self.client.get(f'/api/files/{self.idle.pk}/download/', HTTP_RANGE='bytes=0-99')
+            submit.assert_not_called()
+            self.assertTrue(self.name_of(self.idle).startswith('cold/'))
+            self.assertEqual(b''.join(response.streaming_content), self.data[:100])
+            submit.assert_called_once()
+        self.assertEqual(self.name_of(self.idle), self.hot_name)
+        self.assertTrue(default_storage.exists(self.hot_name))
+        response = self.client.get(f'/api/files/{self.idle.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+
+class RangeDownloadTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        # Больше нескольких блоков чтения, чтобы диапазоны пересекали границы блоков
+        self.data = os.urandom(settings.FILE_DOWNLOAD_BLOCK_SIZE * 4 + 12345)
+        self.file = self.upload('large.bin', self.data)
+        self.url = f'/api/files/{self.file.pk}/download/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, self.data)
+
+    def test_closed_range_across_blocks(self):
+        start, end = settings.FILE_DOWNLOAD_BLOCK_SIZE - 10, settings.FILE_DOWNLOAD_BLOCK_SIZE * 2 + 10
+        response, body = self.get(HTTP_RANGE=f'bytes={start}-{end}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.data)}')
+        self.assertEqual(body, self.data[start:end + 1])
+
+    def test_suffix_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=-70000')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[-70000:])
+
+    def test_suffix_range_longer_than_file(self):
+        response, body = self.get(HTTP_RANGE=f'bytes=-{len(self.data) * 2}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-{len(self.data) - 1}/{len(self.data)}')
+        self.assertEqual(body, self.data)
+
+    def test_open_ended_range(self):
+        start = len(self.data) - 100000
+        response, body = self.get(HTTP_RANGE=f'bytes={start}-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(int(response['Content-Length']), 100000)
+        self.assertEqual(body, self.data[start:])
+
+    def test_range_end_clamped_to_eof(self):
+        response, body = self.get(HTTP_RANGE=f'bytes=10-{len(self.data) * 2}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:])
+
+    def test_range_past_eof(self):
+        response, _ = self.get(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_multiple_ranges(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-99,200000-200099,-50')
+        self.assertEqual(response.status_code, 206)
+        boundary = response['Content-Type'].split('boundary=')[1]
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f'--{boundary}'.encode())[1:-1]
+        expected = [(0, 99), (200000, 200099), (len(self.data) - 50, len(self.data) - 1)]
+        self.assertEqual(len(parts), len(expected))
+        for part, (start, end) in zip(parts, expected):
+            headers, content = part.split(b'\r\n\r\n', 1)
+            self.assertIn(f'Content-Range: bytes {start}-{end}/{len(self.data)}'.encode(), headers)
+            self.assertEqual(content[:-2], self.data[start:end + 1])
+
+    def test_overlapping_ranges_are_merged(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-99,50-149')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[:150])
+
+    def test_if_range_with_matching_strong_etag(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[100:200])
+
+    def test_if_range_with_stale_etag_returns_full_file(self):
+        response, body = self.get(HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_if_range_with_weak_etag_returns_full_file(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=f'W/{etag}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_not_modified(self):
+        first, _ = self.get()
+        response, body = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+        response, _ = self.get(HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+@skipIf(mock_aws is None or boto3 is None, 'нужны пакеты boto3 и moto')
+class S3StorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='test-bucket')
+        self.storage = S3Storage(
+            bucket='test-bucket', region='us-east-1', access_key_id='test', secret_access_key='test',
+            location='media', multipart_threshold=6 * 1024 * 1024, read_window=1024 * 1024,
+        )
+        # 11 МБ при части 5 МБ - три части multipart
+        self.data = os.urandom(11 * 1024 * 1024)
+        self.path = os.path.join(self.root, 'source.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def test_multipart_put_and_ranged_read(self):
+        self.storage.put_file('blobs/ab/cd/large', self.path)
+        self.assertTrue(self.storage.exists('blobs/ab/cd/large'))
+        self.assertEqual(self.storage.size('blobs/ab/cd/large'), len(self.data))
+        with self.storage.open('blobs/ab/cd/large') as f:
+            f.seek(5 * 1024 * 1024 - 10)
+            self.assertEqual(f.read(20), self.data[5 * 1024 * 1024 - 10:5 * 1024 * 1024 + 10])
+            f.seek(-100, os.SEEK_END)
+            self.assertEqual(f.read(), self.data[-100:])
+            f.seek(0)
+            self.assertEqual(f.read(), self.data)
+
+    def test_small_put_delete_and_exists(self):
+        self.storage.save('files/small.txt', ContentFile(b'small'))
+        self.assertEqual(self.storage.open('files/small.txt').read(), b'small')
+        self.assertEqual([name for name, _, _ in self.storage.scan('files')], ['files/small.txt'])
+        self.storage.delete('files/small.txt')
+        self.assertFalse(self.storage.exists('files/small.txt'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('files/small.txt')
+
+    def test_upload_and_range_download_through_api(self):
+        # Параметры хранилища по умолчанию задаются настройками S3_*: в Django 5.0
+        # OPTIONS хранилища default теряются при override_settings(STORAGES=...)
+        storages = dict(settings.STORAGES, default={'BACKEND': 'myapp.storage_backends.S3Storage'})
+        with override_settings(STORAGES=storages, S3_BUCKET='test-bucket', S3_REGION='us-east-1',
+                               S3_ACCESS_KEY_ID='test', S3_SECRET_ACCESS_KEY='test', S3_LOCATION='media'):
+            file_storage = self.upload('large.bin', self.data)
+            response = self.client.get(f'/api/files/{file_storage.pk}/download/', HTTP_RANGE='bytes=-1000')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), self.data[-1000:])
+
+
+class OffloadDeliveryTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(100000)
+        self.file = self.upload('report.pdf', self.data)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_accel_redirect_hands_off_transfer(self):
+        response = self.client.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], settings.FILE_DELIVERY_ACCEL_PREFIX + quote(self.file.file.name))
+        self.assertEqual(response.content, b'')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertIn('ETag', response)
+        # Учет скачивания остается за Django
+        self.file.refresh_from_db()
+        self.assertIsNotNone(self.file.last_download)
+        self.assertEqual(self.file.download_count, 1)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-sendfile')
+    def test_sendfile_points_to_stored_file(self):
+        response = self.client.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(response['X-Sendfile'], self.file.file.path)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_checks_happen_before_handoff(self):
+        other = self.client_for(self.create_user('bob'))
+        response = other.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+        FileStorage.objects.filter(pk=self.file.pk).update(share_link_expiry=timezone.now() - timedelta(seconds=1))
+        response = APIClient().get(f'/api/shared/{self.file.share_link}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_not_modified_is_answered_by_django(self):
+        etag = self.client.get(f'/api/files/{self.file.pk}/download/')['ETag']
+        response = self.client.get(f'/api/files/{self.file.pk}/download/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    # Имитация nginx для разработки отдает тело вместо прокси, включая Range
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect', FILE_DELIVERY_EMULATE_PROXY=True)
+    def test_emulated_proxy_serves_body(self):
+        client = self.client_for(self.user)
+        response = client.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        response = client.get(f'/api/files/{self.file.pk}/download/', HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+
+
+class FileListStreamingTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        FileStorage.objects.bulk_create([
+            FileStorage(owner=self.user, original_name=f'file{i}.txt', name=f'file{i}.txt', file=f'files/{i}', size=i)
+            for i in range(450)
+        ])
+
+    def paginated(self):
+        rows, url = [], '/api/files/?page_size=100'
+        while url:
+            page = self.client.get(url).json()
+            rows += page['results']
+            url = page['next']
+        return rows
+
+    @override_settings(FILE_LIST_STREAM_CHUNK_SIZE=100)
+    def test_stream_matches_paginated_list(self):
+        response = self.client.get('/api/files/?stream=1')
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        # Строки уходят пачками по мере чтения курсора, а не одним телом
+        self.assertGreater(len(chunks), 450 // 100)
+        self.assertEqual(json.loads(b''.join(chunks)), self.paginated())
+
+    def test_empty_stream_is_valid_json(self):
+        FileStorage.objects.all().delete()
+        response = self.client.get('/api/files/?stream=1')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+class FileListSerializerParityTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.create_user('admin', is_admin=True)
+        now = timezone.now()
+        FileStorage.objects.bulk_create([
+            FileStorage(owner=self.user, original_name='plain.txt', name='a.txt', file='files/a', size=1),
+            FileStorage(
+                owner=self.user, original_name='отчет "итог"\u2028.pdf', name='b.pdf', file='files/b', size=2 ** 40,
+                comment='строка\u2028с\u2029разделителями', last_download=now.replace(microsecond=0),
+                download_count=7, share_link=uuid.uuid4(), mime_type='application/pdf', thumbnail='thumbs/b.webp',
+            ),
+            FileStorage(owner=self.admin, original_name='admin.bin', name='c.bin', file='files/c', size=0,
+                        comment=None, last_download=now, share_link=None),
+        ])
+
+    def assert_parity(self, viewer):
+        request = SimpleNamespace(user=viewer)
+        for file_storage in FileStorage.objects.select_related('owner').order_by('original_name'):
+            expected = JSONRenderer().render(FileStorageSerializer(file_storage, context={'request': request}).data)
+            row = FileStorage.objects.filter(pk=file_storage.pk).values(*FILE_LIST_VALUES).get()
+            self.assertEqual(dump_json(file_list_row(row, viewer.pk)), expected, file_storage.original_name)
+
+    def test_fast_path_matches_serializer_bytes(self):
+        self.assert_parity(self.user)
+        self.assert_parity(self.admin)
+
+    def test_fast_path_matches_serializer_without_orjson(self):
+        with mock.patch('myapp.renderers.orjson', None):
+            self.assert_parity(self.user)
+
+
+class ArchiveDownloadTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text = b'line of text\n' * 20000
+        self.photo = os.urandom(settings.FILE_DOWNLOAD_BLOCK_SIZE * 3 + 7)
+        self.files = [
+            self.upload('notes.txt', self.text),
+            self.upload('photo.jpg', self.photo),
+            self.upload('notes.txt', b'second notes'),
+        ]
+
+    def archive(self, ids, client=None):
+        return (client or self.client).post('/api/files/archive/', {'ids': [str(pk) for pk in ids]}, format='json')
+
+    def test_archive_contents(self):
+        response = self.archive([f.pk for f in self.files])
+        self.assertEqual(response.status_code, 200)
+        chunks = list(response.streaming_content)
+        # В памяти не копится больше блока чтения (плюс заголовки записи)
+        self.assertLess(max(len(chunk) for chunk in chunks), settings.FILE_DOWNLOAD_BLOCK_SIZE * 2)
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['notes.txt', 'photo.jpg', 'notes (1).txt'])
+            self.assertEqual(archive.read('notes.txt'), self.text)
+            self.assertEqual(archive.read('photo.jpg'), self.photo)
+            self.assertEqual(archive.read('notes (1).txt'), b'second notes')
+            self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo('photo.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def downloads(self):
+        return [FileStorage.objects.get(pk=f.pk).download_count for f in self.files]
+
+    def test_downloads_are_counted_as_members_are_sent(self):
+        response = self.archive([f.pk for f in self.files])
+        self.assertEqual(self.downloads(), [0, 0, 0])
+        chunks = iter(response.streaming_content)
+        # Первый файл засчитан только после того, как отдан целиком
+        while self.downloads()[0] == 0:
+            next(chunks)
+        # Прерываем отдачу на первом блоке второго файла
+        next(chunks)
+        response.close()
+        self.assertEqual(self.downloads(), [1, 0, 0])
+
+        response = self.archive([f.pk for f in self.files])
+        b''.join(response.streaming_content)
+        self.assertEqual(self.downloads(), [2, 1, 1])
+
+    def test_permission_checks_do_not_query_per_file(self):
+        with self.assertNumQueries(1):
+            self.archive([f.pk for f in self.files])
+
+    def test_every_file_is_permission_checked(self):
+        other = self.client_for(self.create_user('bob'))
+        foreign = self.upload('foreign.txt', b'foreign', client=other)
+        self.assertEqual(self.archive([self.files[0].pk, foreign.pk]).status_code, 403)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.archive([uuid.uuid4()]).status_code, 404)
+        self.assertEqual(self.client.post('/api/files/archive/', {'ids': ['bad']}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/files/archive/', {'ids': []}, format='json').status_code, 400)
+        with override_settings(ARCHIVE_MAX_FILES=2):
+            self.assertEqual(self.archive([f.pk for f in self.files]).status_code, 400)
+
+
+class SignedTokenTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        forget_user(self.user.pk)
+        self.anonymous = APIClient()
+
+    def obtain(self, password='x'):
+        return self.anonymous.post('/api/token/', {'username': 'alice', 'password': password}, format='json')
+
+    def profile(self, access):
+        return self.anonymous.get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_obtain_and_use_access_token(self):
+        self.assertEqual(self.obtain('wrong').status_code, 401)
+        tokens = self.obtain().json()
+        self.assertEqual(tokens['token_type'], 'Bearer')
+        self.assertEqual(self.profile(tokens['access']).status_code, 200)
+        self.assertEqual(self.profile(tokens['access'][:-2] + 'xx').status_code, 401)
+
+    def test_refresh_issues_working_token(self):
+        tokens = self.obtain().json()
+        response = self.anonymous.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['refresh'], tokens['refresh'])
+        self.assertEqual(self.profile(response.json()['access']).status_code, 200)
+        self.assertEqual(self.anonymous.post('/api/token/refresh/', {'refresh': 'bad'}, format='json').status_code, 401)
+        self.assertEqual(self.anonymous.post('/api/token/refresh/', {}, format='json').status_code, 400)
+
+    def test_revoke_invalidates_access_and_refresh(self):
+        tokens = self.obtain().json()
+        response = self.anonymous.post('/api/token/revoke/', HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.profile(tokens['access']).status_code, 401)
+        self.assertEqual(self.anonymous.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').status_code, 401)
+        # Новый вход после отзыва выдает рабочий токен
+        self.assertEqual(self.profile(self.obtain().json()['access']).status_code, 200)
+
+    def test_password_change_invalidates_access_token(self):
+        access = self.obtain().json()['access']
+        self.assertEqual(self.profile(access).status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.profile(access).status_code, 401)
+
+    def test_expired_token_is_rejected(self):
+        issued = timezone.now().timestamp() - settings.AUTH_TOKEN_TTL - 10
+        with mock.patch('time.time', return_value=issued):
+            access = self.obtain().json()['access']
+        response = self.profile(access)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+
+class AdmissionControlTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload('data.bin', b'x' * 1000)
+        override = override_settings(
+            ADMISSION_CONTROL_ENABLED=True,
+            ADMISSION_POOLS={
+                'upload': {'limit': 1, 'min_limit': 1, 'max_limit': 1, 'queue': 0, 'timeout': 0},
+                'download': {'limit': 1, 'min_limit': 1, 'max_limit': 1, 'queue': 0, 'timeout': 0},
+                'metadata': {'limit': 1, 'min_limit': 1, 'max_limit': 1, 'queue': 0, 'timeout': 0},
+            },
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        admission.controller.pools = None
+        self.addCleanup(setattr, admission.controller, 'pools', None)
+        # Middleware подключается при создании обработчика клиента, то есть уже с включенным допуском
+        self.client = self.client_for(self.user)
+        self.pool = admission.controller.get_pool('download')
+
+    def download(self):
+        return self.client.get(f'/api/files/{self.file.pk}/download/')
+
+    def test_request_over_limit_is_shed(self):
+        self.assertTrue(self.pool.acquire())
+        response = self.download()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.ADMISSION_RETRY_AFTER))
+        self.assertEqual(self.pool.stats()['rejected_total'], 1)
+        # Другие пулы скачивание не занимает
+        self.assertEqual(self.client.get('/api/files/').status_code, 200)
+
+        self.pool.release()
+        self.assertEqual(self.download().status_code, 200)
+
+    def test_slot_is_held_until_response_is_closed(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.pool.stats()['active'], 1)
+        # Тестовый клиент закрывает ответ, прочитав тело: слот освобождается
+        self.assertEqual(b''.join(response.streaming_content), b'x' * 1000)
+        self.assertEqual(self.pool.stats()['active'], 0)
+        self.assertEqual(self.download().status_code, 200)
+
+
+class FileSearchTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload('Report.txt', b'1')
+        self.upload('old_report.txt', b'2')
+        self.upload('notes.txt', b'3', comment='quarterly report draft')
+        self.upload('photo.jpg', b'4')
+        self.other = self.create_user('bob')
+        self.upload('report_bob.txt', b'5', client=self.client_for(self.other))
+
+    def search(self, client=None, **params):
+        return (client or self.client).get('/api/files/search/', params)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['original_name'] for row in response.json()['results']]
+
+    def test_prefix_search(self):
+        self.assertEqual(self.names(self.search(q='re', mode='prefix')), ['Report.txt'])
+        self.assertEqual(self.names(self.search(q='o', mode='prefix')), ['old_report.txt'])
+        # % и _ в запросе - обычные символы, а не шаблоны LIKE
+        self.assertEqual(self.names(self.search(q='old_', mode='prefix')), ['old_report.txt'])
+        self.assertEqual(self.names(self.search(q='%', mode='prefix')), [])
+
+    def test_substring_ranking(self):
+        # Сначала совпадение в начале имени, затем в середине имени, затем в комментарии
+        self.assertEqual(
+            self.names(self.search(q='report', mode='substring')),
+            ['Report.txt', 'old_report.txt', 'notes.txt'],
+        )
+
+    def test_fulltext_requires_every_term(self):
+        self.assertEqual(self.names(self.search(q='quarterly draft')), ['notes.txt'])
+        self.assertEqual(self.names(self.search(q='report old')), ['old_report.txt'])
+        self.assertEqual(set(self.names(self.search(q='report'))), {'Report.txt', 'old_report.txt', 'notes.txt'})
+
+    def test_results_are_scoped_to_owner(self):
+        self.assertEqual(self.names(self.search(q='bob', mode='substring')), [])
+        self.assertEqual(self.names(self.search(self.client_for(self.other), q='report', mode='substring')), ['report_bob.txt'])
+        # user_id учитывается только у администратора
+        self.assertEqual(self.names(self.search(q='bob', mode='substring', user_id=self.other.pk)), [])
+
+    def test_admin_searches_other_user(self):
+        admin = self.client_for(self.create_user('root', is_admin=True))
+        self.assertEqual(self.names(self.search(admin, q='report', mode='substring', user_id=self.other.pk)), ['report_bob.txt'])
+        self.assertEqual(self.search(admin, q='report', user_id=10 ** 9).status_code, 404)
+        self.assertEqual(self.search(admin, q='report', user_id='bob').status_code, 404)
+
+    def test_keyset_pagination(self):
+        for i in range(5):
+            self.upload(f'report{i}.txt', b'x')
+        for mode in ('prefix', 'substring', 'fulltext'):
+            expected = self.names(self.search(q='report', mode=mode, page_size=100))
+            names, cursor = [], None
+            while True:
+                params = {'q': 'report', 'mode': mode, 'page_size': 2}
+                if cursor:
+                    params['cursor'] = cursor
+                response = self.search(**params)
+                names += self.names(response)
+                cursor = response.json()['cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(names, expected, mode)
+            self.assertEqual(len(set(names)), len(names))
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.search(q='').status_code, 400)
+        self.assertEqual(self.search(q='...').status_code, 400)
+        self.assertEqual(self.search(q='x' * (settings.SEARCH_MAX_QUERY_LENGTH + 1)).status_code, 400)
+        self.assertEqual(self.search(q='re', mode='substring').status_code, 400)
+        self.assertIn('mode', self.search(q='report', mode='regex').json())
+        self.assertEqual(self.search(q='report', cursor='!!').status_code, 400)
+
+
+class FileCursorTests(StorageTestCase):
+    def cursor(self, value, pk):
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip('=')
+
+    def test_malformed_cursor_is_rejected(self):
+        self.upload('report.txt', b'x')
+        valid = self.cursor('2024-01-01T00:00:00+00:00', str(uuid.uuid4()))
+        self.assertEqual(self.client.get('/api/files/', {'cursor': valid}).status_code, 200)
+        for cursor in ('!!', self.cursor('2024-01-01T00:00:00+00:00', 'x'), self.cursor('2024-01-01T00:00:00+00:00', 5)):
+            response = self.client.get('/api/files/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertIn('cursor', response.json())
+        response = self.client.get('/api/files/search/', {'q': 'report', 'cursor': self.cursor(1, 'x')})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecountStorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload('a.txt', b'12345')
+        UploadSession.objects.create(owner=self.user, original_name='big.bin', size=1000)
+        # Счетчики разошлись, плюс 300 байт резерва идущей обычной загрузки
+        CustomUser.objects.filter(pk=self.user.pk).update(file_count=7, total_size=0, reserved_size=1300)
+
+    def recount(self, *args):
+        call_command('recount_storage', *args, stdout=io.StringIO())
+        self.user.refresh_from_db()
+
+    def test_recount_keeps_in_flight_reservations(self):
+        self.recount()
+        self.assertEqual((self.user.file_count, self.user.total_size, self.user.reserved_size), (1, 5, 1300))
+
+    def test_reserved_size_is_raised_to_sessions(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(reserved_size=0)
+        self.recount()
+        self.assertEqual(self.user.reserved_size, 1000)
+
+    def test_reset_reserved(self):
+        self.recount('--reset-reserved')
+        self.assertEqual((self.user.file_count, self.user.total_size, self.user.reserved_size), (1, 5, 1000))
+
+
+# reap_files удаляет блобы в пуле потоков со своими соединениями с БД: данным нужна фиксация
+class UserDeletionTests(StorageMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.kept = self.upload('shared.txt', b'shared content')
+        self.other = self.create_user('bob')
+        client = self.client_for(self.other)
+        self.shared = self.upload('copy.txt', b'shared content', client=client)
+        self.own = self.upload('own.txt', b'only bob', client=client)
+
+    def assert_released(self):
+        tombstones = FileStorage.all_objects.filter(pk__in=[self.shared.pk, self.own.pk])
+        self.assertEqual(tombstones.filter(owner__isnull=True, deleted_at__isnull=False).count(), 2)
+        reap_files()
+        self.assertFalse(FileStorage.all_objects.filter(pk__in=[self.shared.pk, self.own.pk]).exists())
+        self.assertEqual(Blob.objects.get(pk=self.kept.blob_id).ref_count, 1)
+        self.assertFalse(Blob.objects.filter(pk=self.own.blob_id).exists())
+        response = self.client.get(f'/api/files/{self.kept.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), b'shared content')
+
+    def test_queryset_delete_releases_blobs(self):
+        CustomUser.objects.filter(pk=self.other.pk).delete()
+        self.assert_released()
+
+    def test_instance_delete_releases_blobs(self):
+        self.other.delete()
+        self.assert_released()
+
+    def test_upload_session_files_are_removed(self):
+        response = self.client_for(self.other).post('/api/files/uploads/', {'name': 'big.bin', 'size': 100}, format='json')
+        session = UploadSession.objects.get(pk=response.json()['id'])
+        self.assertTrue(os.path.isfile(session.file_path))
+        CustomUser.objects.filter(pk=self.other.pk).delete()
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.file_path))
+
+
+# Очистка помеченных файлов; reap_files удаляет блобы в пуле потоков, поэтому тоже с фиксацией
+class ReapTests(StorageMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = self.upload('a.txt', b'shared content')
+        self.second = self.upload('b.txt', b'shared content')
+        self.blob_path = os.path.join(settings.MEDIA_ROOT, self.first.blob.file.name)
+
+    def test_blob_is_released_by_reaper(self):
+        self.first.delete()
+        # Пометка не трогает блоб: ссылку отпускает очистка
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertEqual(reap_files(), (1, 0))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.isfile(self.blob_path))
+
+        self.second.delete()
+        self.assertEqual(reap_files(), (1, 1))
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(self.blob_path))
+        self.assertFalse(FileStorage.all_objects.exists())
+
+    def test_live_files_are_not_reaped(self):
+        self.assertEqual(reap_files(), (0, 0))
+        self.assertEqual(FileStorage.objects.count(), 2)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_legacy_file_is_removed_from_disk(self):
+        name = default_storage.save('files/legacy.txt', ContentFile(b'legacy'))
+        legacy = FileStorage.objects.create(owner=self.user, original_name='legacy.txt', name='legacy.txt', file=name, size=6)
+        legacy.delete()
+        self.assertEqual(reap_files(), (1, 0))
+        self.assertFalse(default_storage.exists(name))
+
+    def test_command_reaps_in_batches(self):
+        self.first.delete()
+        self.second.delete()
+        self.assertEqual(reap_files(batch_size=1), (1, 0))
+        out = io.StringIO()
+        call_command('reap_deleted_files', batch_size=1, stdout=out)
+        self.assertIn('Удалено файлов: 1, блобов: 1', out.getvalue())
+        self.assertFalse(os.path.exists(self.blob_path))
+
+
+class SweepStorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload('a.txt', b'content')
+        self.orphan = os.path.join(settings.MEDIA_ROOT, 'files', 'ab', 'cd', 'orphan.bin')
+        os.makedirs(os.path.dirname(self.orphan))
+        with open(self.orphan, 'wb') as f:
+            f.write(b'orphan')
+
+    def sweep(self, *args):
+        out = io.StringIO()
+        call_command('sweep_storage', *args, stdout=out)
+        return out.getvalue()
+
+    def test_fresh_orphans_are_kept(self):
+        # Файл моложе --min-age может принадлежать идущей загрузке
+        output = self.sweep('--delete-orphans')
+        self.assertIn('Файлов без записей: 0', output)
+        self.assertTrue(os.path.isfile(self.orphan))
+
+    def test_old_orphans_are_deleted(self):
+        old = time.time() - 25 * 3600
+        os.utime(self.orphan, (old, old))
+        output = self.sweep('--delete-orphans', '--list')
+        self.assertIn('files/ab/cd/orphan.bin', output)
+        self.assertFalse(os.path.exists(self.orphan))
+        # Файлы, известные БД, не трогаются
+        self.assertTrue(os.path.isfile(os.path.join(settings.MEDIA_ROOT, self.file.blob.file.name)))
+
+    def test_rows_without_files_are_tombstoned(self):
+        os.remove(os.path.join(settings.MEDIA_ROOT, self.file.blob.file.name))
+        output = self.sweep('--fix-rows')
+        self.assertIn('Записей без файлов: 1, блобов без файлов: 1', output)
+        self.assertFalse(FileStorage.objects.exists())
+        self.assertTrue(FileStorage.all_objects.filter(pk=self.file.pk, deleted_at__isnull=False).exists())
+
+
+class UploadSessionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(3000)
+        response = self.client.post('/api/files/uploads/', {'name': 'big.bin', 'size': len(self.data)}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.session = response.json()['id']
+
+    def put(self, start, end):
+        return self.client.generic(
+            'PUT', f'/api/files/uploads/{self.session}/', self.data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}',
+        )
+
+    def complete(self):
+        return self.client.post(f'/api/files/uploads/{self.session}/complete/')
+
+    def test_parts_in_any_order(self):
+        self.assertEqual(self.put(2000, 3000).status_code, 200)
+        self.assertEqual(self.complete().status_code, 409)
+        self.assertEqual(self.put(0, 2000).status_code, 200)
+
+        response = self.complete()
+        self.assertEqual(response.status_code, 201, response.content)
+        file_storage = FileStorage.objects.get(pk=response.json()['id'])
+        self.assertEqual(file_storage.blob_id, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(b''.join(self.client.get(f'/api/files/{file_storage.pk}/download/').streaming_content), self.data)
+        self.assertEqual(self.complete().status_code, 404)
+
+    def test_file_changed_while_hashing(self):
+        self.put(0, 3000)
+        hash_file = blobstore.hash_file
+
+        # Повторная отправка части во время хеширования (вне блокировки сессии)
+        def rewrite(path):
+            digest = hash_file(path)
+            with open(path, 'r+b') as f:
+                f.write(b'changed')
+            os.utime(path, ns=(0, 0))
+            return digest
+
+        with mock.patch('myapp.blobstore.hash_file', side_effect=rewrite):
+            self.assertEqual(self.complete().status_code, 409)
+        self.assertFalse(FileStorage.objects.exists())
+        self.assertEqual(self.complete().status_code, 201)
+
+
+class BulkUpdateTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.upload(f'file{i}.txt', b'x') for i in range(4)]
+
+    def test_invalid_items_do_not_fail_batch(self):
+        items = [
+            {'id': str(self.files[0].pk), 'name': 'renamed.txt', 'comment': 'new'},
+            {'id': str(self.files[1].pk), 'name': 'x' * 256},
+            {'id': str(self.files[2].pk), 'name': ['list.txt']},
+            {'id': str(self.files[3].pk), 'comment': {'text': 'dict'}},
+        ]
+        response = self.client.post('/api/files/bulk/update/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()['results']
+        self.assertEqual([row['status'] for row in results], ['ok', 'invalid', 'invalid', 'invalid'])
+        self.assertNotIn('error', results[0])
+        self.assertTrue(all(row['error'] for row in results[1:]))
+
+        names = dict(FileStorage.objects.values_list('pk', 'original_name'))
+        self.assertEqual(names[self.files[0].pk], 'renamed.txt')
+        self.assertEqual(names[self.files[1].pk], 'file1.txt')
+        self.assertEqual(FileStorage.objects.get(pk=self.files[3].pk).comment, '')
+
+
+class BulkDeleteTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.upload(f'file{i}.txt', b'x' * (i + 1)) for i in range(3)]
+        self.bob = self.create_user('bob')
+        self.foreign = self.upload('foreign.txt', b'foreign', client=self.client_for(self.bob))
+
+    def delete(self, ids, client=None):
+        response = (client or self.client).post('/api/files/bulk/delete/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(row['id'], row['status']) for row in response.json()['results']]
+
+    def test_mixed_batch_gets_per_item_results(self):
+        missing = str(uuid.uuid4())
+        share_link = self.files[0].share_link
+        results = self.delete([
+            str(self.files[0].pk), str(self.foreign.pk), 'not-a-uuid', missing, str(self.files[1].pk),
+        ])
+        self.assertEqual(results, [
+            (str(self.files[0].pk), 'ok'),
+            (str(self.foreign.pk), 'forbidden'),
+            ('not-a-uuid', 'invalid'),
+            (missing, 'not_found'),
+            (str(self.files[1].pk), 'ok'),
+        ])
+
+        # Свои файлы помечены удаленными, счетчики владельца уменьшены
+        deleted = FileStorage.all_objects.filter(pk__in=[self.files[0].pk, self.files[1].pk])
+        self.assertTrue(all(row.deleted_at and row.share_link is None for row in deleted))
+        self.assertEqual(list(FileStorage.objects.filter(owner=self.user)), [self.files[2]])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.file_count, self.user.total_size), (1, 3))
+        self.assertEqual(self.client.get(f'/api/shared/{share_link}/').status_code, 404)
+
+        self.assertTrue(FileStorage.objects.filter(pk=self.foreign.pk).exists())
+        self.bob.refresh_from_db()
+        self.assertEqual((self.bob.file_count, self.bob.total_size), (1, 7))
+
+        # Повторное удаление: файлов уже нет
+        self.assertEqual(self.delete([str(self.files[0].pk)]), [(str(self.files[0].pk), 'not_found')])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.file_count, 1)
+
+    def test_admin_can_delete_foreign_files(self):
+        admin = self.client_for(self.create_user('root', is_admin=True))
+        self.assertEqual(self.delete([str(self.foreign.pk)], client=admin), [(str(self.foreign.pk), 'ok')])
+        self.bob.refresh_from_db()
+        self.assertEqual((self.bob.file_count, self.bob.total_size), (0, 0))
+
+    def test_file_deleted_concurrently_is_not_found(self):
+        ids = [str(file_storage.pk) for file_storage in self.files[:2]]
+        # Второй файл удалил параллельный запрос между проверкой прав и удалением
+        with mock.patch('myapp.views.tombstone_files', return_value=[self.files[0].pk]):
+            self.assertEqual(self.delete(ids), [(ids[0], 'ok'), (ids[1], 'not_found')])
+
+    @override_settings(BULK_MAX_ITEMS=2)
+    def test_batch_limits(self):
+        for ids in ([], 'x', [str(file_storage.pk) for file_storage in self.files]):
+            response = self.client.post('/api/files/bulk/delete/', {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(FileStorage.objects.filter(owner=self.user).count(), 3)
+
+
+class ExpireShareLinksTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.upload(f'file{i}.txt', b'x') for i in range(5)]
+        past = timezone.now() - timedelta(hours=1)
+        FileStorage.objects.filter(pk__in=[f.pk for f in self.files[:3]]).update(
+            share_link_expiry=past, share_link_max_downloads=5, share_link_downloads=2
+        )
+
+    def links(self):
+        return list(FileStorage.objects.order_by('original_name').values_list(
+            'share_link', 'share_link_max_downloads', 'share_link_downloads'
+        ))
+
+    def test_expired_links_are_revoked_in_batches(self):
+        self.assertEqual(sharing.revoke_expired_links(batch_size=2), 2)
+        self.assertEqual(sharing.revoke_expired_links(batch_size=2), 1)
+        self.assertEqual(sharing.revoke_expired_links(batch_size=2), 0)
+        links = self.links()
+        self.assertEqual(links[:3], [(None, None, 0)] * 3)
+        self.assertTrue(all(link for link, _, _ in links[3:]))
+
+    def test_revoked_link_stops_serving(self):
+        url = f'/api/shared/{self.files[0].share_link}/'
+        self.assertEqual(APIClient().get(url).status_code, 400)
+        sharing.revoke_expired_links()
+        self.assertEqual(APIClient().get(url).status_code, 404)
+
+    def test_command_sweeps_every_batch(self):
+        out = io.StringIO()
+        call_command('expire_share_links', batch_size=1, stdout=out)
+        self.assertIn('3', out.getvalue())
+        self.assertEqual(FileStorage.objects.filter(share_link__isnull=True).count(), 3)
+
+    def test_link_extended_after_select_is_kept(self):
+        extended = self.files[0]
+        base = type(FileStorage.objects.all())
+
+        # Срок ссылки продлили между выборкой пачки и UPDATE
+        class ExtendedAfterSelect(base):
+            def _fetch_all(self):
+                fetched = self._result_cache is None
+                super()._fetch_all()
+                if fetched:
+                    FileStorage.objects.filter(pk=extended.pk).update(
+                        share_link_expiry=timezone.now() + timedelta(days=1)
+                    )
+
+        def select_for_update(**kwargs):
+            files = FileStorage.objects.all()
+            files.__class__ = ExtendedAfterSelect
+            return files.select_for_update(**kwargs)
+
+        with mock.patch.object(FileStorage.objects, 'select_for_update', select_for_update):
+            self.assertEqual(sharing.revoke_expired_links(), 2)
+        self.assertEqual(FileStorage.objects.get(pk=extended.pk).share_link, extended.share_link)
+        self.assertEqual(FileStorage.objects.filter(share_link__isnull=True).count(), 2)
+
+
+class QuotaTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.set_quota(1000)
+
+    def set_quota(self, quota):
+        CustomUser.objects.filter(pk=self.user.pk).update(quota=quota)
+
+    def usage(self):
+        self.user.refresh_from_db()
+        return self.user.total_size, self.user.reserved_size
+
+    def test_rejected_by_content_length_before_body_is_read(self):
+        with mock.patch.object(BlobUploadHandler, 'receive_data_chunk') as receive:
+            response = self.client.post(
+                '/api/files/upload/', {'file': SimpleUploadedFile('big.bin', b'x' * 2000)}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 413)
+        receive.assert_not_called()
+        # Временный файл для тела даже не создавался
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'blobs', 'tmp')))
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_reservation_is_released_on_success(self):
+        self.upload('a.bin', b'x' * 600)
+        self.assertEqual(self.usage(), (600, 0))
+        # Место занято сохраненным файлом: вторая такая загрузка уже не помещается
+        response = self.client.post('/api/files/upload/', {'file': SimpleUploadedFile('b.bin', b'y' * 600)}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.usage(), (600, 0))
+
+    def test_reservation_is_released_on_errors(self):
+        # Тело не разбирается парсером multipart
+        response = self.client.generic(
+            'POST', '/api/files/upload/', b'--broken\r\nnot a part', content_type='multipart/form-data; boundary=other'
+        )
+        self.assertEqual(response.status_code // 100, 4)
+        self.assertEqual(self.usage(), (0, 0))
+        # Тело разобрано, но файла в нем нет
+        response = self.client.post('/api/files/upload/', {'comment': 'x' * 500}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_upload_session_reserves_its_size(self):
+        response = self.client.post('/api/files/uploads/', {'name': 'big.bin', 'size': 2000}, format='json')
+        self.assertEqual(response.status_code, 413)
+
+        session = self.client.post('/api/files/uploads/', {'name': 'a.bin', 'size': 700}, format='json').json()['id']
+        self.assertEqual(self.usage(), (0, 700))
+        response = self.client.post('/api/files/upload/', {'file': SimpleUploadedFile('b.bin', b'y' * 400)}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+
+        self.client.generic(
+            'PUT', f'/api/files/uploads/{session}/', b'z' * 700,
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-699/700',
+        )
+        self.assertEqual(self.client.post(f'/api/files/uploads/{session}/complete/').status_code, 201)
+        self.assertEqual(self.usage(), (700, 0))
+
+        session = self.client.post('/api/files/uploads/', {'name': 'c.bin', 'size': 300}, format='json').json()['id']
+        self.assertEqual(self.usage(), (700, 300))
+        self.assertEqual(self.client.delete(f'/api/files/uploads/{session}/').status_code, 204)
+        self.assertEqual(self.usage(), (700, 0))
+
+    def test_blob_claim_is_charged(self):
+        data = b'x' * 600
+        self.upload('a.bin', data)
+        url = f'/api/files/blobs/{hashlib.sha256(data).hexdigest()}/'
+        self.assertEqual(self.client.post(url, {'name': 'copy.bin'}, format='json').status_code, 413)
+        self.assertEqual(self.usage(), (600, 0))
+
+        self.set_quota(2000)
+        self.assertEqual(self.client.post(url, {'name': 'copy.bin'}, format='json').status_code, 201)
+        self.assertEqual(self.usage(), (1200, 0))
+
+
+@skipIf(zstandard is None, 'нужен пакет zstandard')
+class CompressedBlobTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(
+            STORAGE_COMPRESSION=True, STORAGE_COMPRESSION_FRAME_SIZE=4096, STORAGE_COMPRESSION_MIN_SIZE=1024
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = b''.join(f'line {i:05d} of a compressible text file\n'.encode() for i in range(1000))
+        self.file = self.upload('log.txt', self.data)
+        self.url = f'/api/files/{self.file.pk}/download/'
+
+    def test_stored_as_seekable_zstd(self):
+        blob = self.file.blob
+        self.assertTrue(compression.is_compressed(blob.file.name))
+        self.assertLess(blob.stored_size, len(self.data) // 2)
+        self.assertEqual(blob.size, len(self.data))
+
+        raw = compression.SeekableZstdFile(open(os.path.join(settings.MEDIA_ROOT, blob.file.name), 'rb'))
+        self.assertEqual(raw.size, len(self.data))
+        self.assertEqual(len(raw.offsets) - 1, -(-len(self.data) // 4096))
+        with io.BufferedReader(raw) as f:
+            f.seek(4090)
+            # Чтение через границы кадров
+            self.assertEqual(f.read(8200), self.data[4090:12290])
+            f.seek(-10, io.SEEK_END)
+            self.assertEqual(f.read(100), self.data[-10:])
+            f.seek(0)
+            self.assertEqual(f.read(), self.data)
+
+    def test_range_across_frames(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=4000-12300')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[4000:12301])
+        self.assertEqual(response['Content-Range'], f'bytes 4000-12300/{len(self.data)}')
+
+        response = self.client.get(self.url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_zstd_passthrough(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, zstd')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertEqual(response['ETag'], plain['ETag'][:-1] + '-zstd"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), self.file.blob.stored_size)
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True)
+        self.assertEqual(reader.read(), self.data)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='zstd;q=0').get('Content-Encoding'), None)
+
+    def test_range_with_zstd_is_decompressed(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199', HTTP_ACCEPT_ENCODING='zstd')
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+    def test_incompressible_data_is_stored_raw(self):
+        data = os.urandom(20000)
+        file_storage = self.upload('random.bin', data)
+        self.assertFalse(compression.is_compressed(file_storage.blob.file.name))
+        self.assertEqual(file_storage.blob.stored_size, len(data))
+        response = self.client.get(f'/api/files/{file_storage.pk}/download/', HTTP_ACCEPT_ENCODING='zstd')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+
+class DownloadRecorderTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.upload(f'file{i}.txt', b'x') for i in range(3)]
+        override = override_settings(
+            DOWNLOAD_STATS_FLUSH_INTERVAL=60, DOWNLOAD_STATS_BATCH_SIZE=1, DOWNLOAD_STATS_MAX_PENDING=100
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.recorder = DownloadRecorder()
+        patcher = mock.patch.object(self.recorder, 'ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stats(self, file_storage):
+        return FileStorage.objects.values_list('download_count', 'last_download').get(pk=file_storage.pk)
+
+    def test_downloads_are_merged_and_flushed(self):
+        now = timezone.now()
+        first, second, idle = self.files
+        # Отметки могут прийти не по порядку: в БД попадает последняя
+        for when in (now - timedelta(minutes=5), now, now - timedelta(minutes=1)):
+            self.recorder.record(first.pk, when)
+        self.recorder.record(second.pk, now - timedelta(hours=1))
+        self.assertEqual(self.stats(first), (0, None))
+        self.assertEqual(self.recorder.pending_for(first.pk), (now, 3))
+
+        # Один UPDATE с CASE на пачку; DOWNLOAD_STATS_BATCH_SIZE=1 - по пачке на файл
+        with self.assertNumQueries(2):
+            self.recorder.flush()
+        self.assertEqual(self.stats(first), (3, now))
+        self.assertEqual(self.stats(second), (1, now - timedelta(hours=1)))
+        self.assertEqual(self.stats(idle), (0, None))
+        self.assertEqual(self.recorder.pending, {})
+
+        self.recorder.record(first.pk, now)
+        self.recorder.flush()
+        self.assertEqual(self.stats(first)[0], 4)
+
+    def test_failed_flush_keeps_counts(self):
+        now = timezone.now()
+        self.recorder.record(self.files[0].pk, now)
+        with mock.patch.object(self.recorder, 'write', side_effect=Exception('db down')):
+            self.recorder.flush()
+        self.recorder.record(self.files[0].pk, now - timedelta(minutes=1))
+        self.assertEqual(self.recorder.pending_for(self.files[0].pk), (now, 2))
+        self.recorder.flush()
+        self.assertEqual(self.stats(self.files[0]), (2, now))
+
+    @override_settings(DOWNLOAD_STATS_MAX_PENDING=2)
+    def test_overflow_flushes_immediately(self):
+        self.recorder.record(self.files[0].pk)
+        self.assertEqual(self.stats(self.files[0])[0], 0)
+        self.recorder.record(self.files[1].pk)
+        self.assertEqual(self.stats(self.files[0])[0], 1)
+        self.assertEqual(self.stats(self.files[1])[0], 1)
+
+    def test_flusher_restarts_after_fork(self):
+        recorder = DownloadRecorder()
+        with mock.patch('myapp.download_stats.threading.Thread') as thread:
+            recorder.ensure_flusher()
+            recorder.ensure_flusher()
+            self.assertEqual(thread.return_value.start.call_count, 1)
+            # Поток родителя в дочернем процессе не существует
+            recorder.pid = -1
+            recorder.ensure_flusher()
+            self.assertEqual(thread.return_value.start.call_count, 2)
+            self.assertEqual(recorder.pid, os.getpid())
+
+
+class ShareLinkCacheTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload('report.txt', b'report')
+        self.url = f'/api/shared/{self.file.share_link}/'
+        self.anonymous = APIClient()
+        self.addCleanup(share_links.local.clear)
+
+    def disposition(self):
+        response = self.anonymous.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['Content-Disposition']
+
+    def test_cached_link_skips_database(self):
+        self.disposition()
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(share_links.resolve(self.file.share_link))
+
+    def test_entry_expires_after_ttl(self):
+        now = time.monotonic()
+        with mock.patch('myapp.caching.time.monotonic', return_value=now):
+            self.disposition()
+        # Изменение в обход сигналов видно только после истечения записи
+        FileStorage.objects.filter(pk=self.file.pk).update(original_name='stale.txt')
+        with mock.patch('myapp.caching.time.monotonic', return_value=now + settings.SHARE_LINK_LOCAL_TTL - 1):
+            self.assertIn('report.txt', self.disposition())
+        with mock.patch('myapp.caching.time.monotonic', return_value=now + settings.SHARE_LINK_LOCAL_TTL + 1):
+            self.assertIn('stale.txt', self.disposition())
+
+    def test_unknown_link_is_cached_as_missing(self):
+        unknown = uuid.uuid4()
+        now = time.monotonic()
+        with mock.patch('myapp.caching.time.monotonic', return_value=now):
+            self.assertEqual(self.anonymous.get(f'/api/shared/{unknown}/').status_code, 404)
+            with self.assertNumQueries(0):
+                self.assertIsNone(share_links.resolve(unknown))
+        FileStorage.objects.filter(pk=self.file.pk).update(share_link=unknown)
+        with mock.patch('myapp.caching.time.monotonic', return_value=now + settings.SHARE_LINK_NEGATIVE_TTL + 1):
+            self.assertEqual(self.anonymous.get(f'/api/shared/{unknown}/').status_code, 200)
+
+    def test_rename_is_visible_immediately(self):
+        self.assertIn('report.txt', self.disposition())
+        self.client.patch(f'/api/files/{self.file.pk}/rename/', {'name': 'renamed.txt'}, format='json')
+        self.assertIn('renamed.txt', self.disposition())
+        items = [{'id': str(self.file.pk), 'name': 'bulk.txt'}]
+        self.client.post('/api/files/bulk/update/', {'items': items}, format='json')
+        self.assertIn('bulk.txt', self.disposition())
+
+    def test_revoked_link_is_gone_immediately(self):
+        self.disposition()
+        FileStorage.objects.filter(pk=self.file.pk).update(share_link_expiry=timezone.now() - timedelta(seconds=1))
+        sharing.revoke_expired_links()
+        self.assertEqual(self.anonymous.get(self.url).status_code, 404)
+
+    def test_deleted_file_is_gone_immediately(self):
+        self.disposition()
+        self.assertEqual(self.client.delete(f'/api/files/{self.file.pk}/').status_code, 204)
+        self.assertEqual(self.anonymous.get(self.url).status_code, 404)
+
+    @override_settings(SHARE_LINK_CACHE_ALIAS='default')
+    def test_shared_cache_is_invalidated_for_all_workers(self):
+        self.addCleanup(caches['default'].clear)
+        self.disposition()
+        # Другой воркер: пустой кеш процесса, общий кеш уже заполнен
+        share_links.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(share_links.resolve(self.file.share_link).original_name, 'report.txt')
+        self.client.patch(f'/api/files/{self.file.pk}/rename/', {'name': 'renamed.txt'}, format='json')
+        share_links.local.clear()
+        self.assertIn('renamed.txt', self.disposition())
+
+
+class BandwidthShapingTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        # LocMemCache с одним именем общий для всех экземпляров: счетчики прошлых тестов сбрасываются
+        shaping.get_store().clear()
+        self.addCleanup(shaping.get_store().clear)
+        self.now = 100.0
+        clock = mock.patch('myapp.shaping.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        sleep = mock.patch('myapp.shaping.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def delays(self):
+        return [c.args[0] for c in self.sleep.call_args_list]
+
+    def test_reservations_are_paced_by_window(self):
+        store = LocMemCache('bandwidth-test', {})
+        self.addCleanup(store.clear)
+        # 1000 байт на окно в 1 секунду; now=10.25 - четверть окна уже прошла
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 400, 10.25), 0)
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 400, 10.25), 0)
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 400, 10.25), 0.75)
+        # Порция больше окна целиком занимает первое пустое окно
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 1500, 10.25), 1.75)
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 600, 10.25), 0.75)
+        # Другие ведра не затронуты, а прошедшие окна не занимают место
+        self.assertEqual(shaping.reserve(store, 'other', 1000, 1000, 10.25), 0)
+        self.assertEqual(shaping.reserve(store, 'k', 1000, 1000, 20.0), 0)
+
+    @override_settings(BANDWIDTH_USER_LIMIT=1000, BANDWIDTH_QUANTUM=1000, BANDWIDTH_CACHE_ALIAS='default')
+    def test_buckets_are_shared_through_cache(self):
+        self.addCleanup(caches['default'].clear)
+        # Две передачи одного пользователя в разных воркерах видят одно ведро
+        first = shaping.transfer('download', self.user)
+        second = shaping.transfer('download', self.user)
+        first.throttle(1000)
+        second.throttle(1000)
+        first.throttle(1000)
+        self.assertEqual(self.delays(), [1.0, 2.0])
+        # Ведро другого пользователя независимо
+        shaping.transfer('download', self.create_user('bob')).throttle(1000)
+        self.assertEqual(len(self.delays()), 2)
+        self.assertEqual(caches['default'].get('bwm:download:bytes'), 4000)
+
+    @override_settings(BANDWIDTH_DOWNLOAD_LIMIT=1000, BANDWIDTH_QUANTUM=500)
+    def test_global_limit_is_split_between_tenants(self):
+        alice = shaping.transfer('download', self.user)
+        bob = shaping.transfer('download', self.create_user('bob'))
+        alice.throttle(500)
+        bob.throttle(500)
+        self.assertEqual(bob.active_tenants(100), 2)
+        # У каждого из двух арендаторов - половина общего лимита
+        alice.throttle(500)
+        self.assertEqual(self.delays(), [1.0])
+
+    def test_small_transfers_are_accounted_in_quanta(self):
+        with override_settings(BANDWIDTH_USER_LIMIT=1000, BANDWIDTH_QUANTUM=1000):
+            current = shaping.transfer('upload', self.user)
+            for _ in range(9):
+                current.throttle(100)
+            self.assertEqual(shaping.get_store().get('bwm:upload:bytes'), None)
+            current.throttle(100)
+            self.assertEqual(shaping.get_store().get('bwm:upload:bytes'), 1000)
+
+    def test_limit_response_paces_body(self):
+        data = os.urandom(3000)
+        file_storage = self.upload('data.bin', data)
+        url = f'/api/files/{file_storage.pk}/download/'
+        with override_settings(BANDWIDTH_USER_LIMIT=1000, BANDWIDTH_QUANTUM=1000, FILE_DOWNLOAD_BLOCK_SIZE=1000):
+            # Диапазон читается блоками FILE_DOWNLOAD_BLOCK_SIZE: по порции на блок
+            response = self.client.get(url, HTTP_RANGE='bytes=0-2999')
+            self.assertEqual(b''.join(response.streaming_content), data)
+            self.assertEqual(self.delays(), [1.0, 2.0])
+            # 304 и ошибки не ограничиваются
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(len(self.delays()), 2)
+
+    @override_settings(BANDWIDTH_USER_LIMIT=5000, FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_offloaded_response_passes_limit_to_proxy(self):
+        file_storage = self.upload('data.bin', b'x' * 100)
+        response = self.client.get(f'/api/files/{file_storage.pk}/download/')
+        self.assertEqual(response['X-Accel-Limit-Rate'], '5000')
+
+
+@skipIf(Image is None, 'нужен пакет Pillow')
+class PipelineTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 500), (200, 30, 30)).save(buffer, 'PNG')
+        self.image = buffer.getvalue()
+        self.file = self.upload('picture.png', self.image)
+
+    def state(self, file_storage):
+        file_storage.refresh_from_db()
+        return file_storage.processing_state, file_storage.processing_attempts
+
+    def test_upload_schedules_processing_after_commit(self):
+        with override_settings(UPLOAD_PIPELINE_ENABLED=True), mock.patch('myapp.pipeline.enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                file_storage = self.upload('other.png', self.image + b'\0')
+        enqueue.assert_called_once_with(file_storage.pk)
+
+    def test_stages_run_in_sequence(self):
+        self.assertEqual(self.state(self.file), ('pending', 0))
+        self.assertEqual(pipeline.process_file(self.file.pk), 'done')
+        self.assertEqual(self.state(self.file), ('done', 1))
+        self.assertEqual(self.file.mime_type, 'image/png')
+        self.assertEqual(self.file.checksum, self.file.blob_id)
+        # Превью одно на содержимое: ключ - хеш блоба
+        self.assertEqual(self.file.thumbnail, thumbnail_name(self.file.blob_id))
+        with Image.open(os.path.join(settings.MEDIA_ROOT, self.file.thumbnail)) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE // 2))
+        # Обработанный файл повторно не берется
+        self.assertIsNone(pipeline.process_file(self.file.pk))
+        self.assertEqual(self.state(self.file), ('done', 1))
+
+    def test_thumbnail_is_shared_by_content(self):
+        pipeline.process_file(self.file.pk)
+        copy = self.upload('copy.png', self.image, client=self.client_for(self.create_user('bob')))
+        with mock.patch('myapp.pipeline.render_image') as render:
+            self.assertEqual(pipeline.process_file(copy.pk), 'done')
+        render.assert_not_called()
+        copy.refresh_from_db()
+        self.assertEqual(copy.thumbnail, thumbnail_name(self.file.blob_id))
+
+    def test_non_image_has_no_thumbnail(self):
+        text = self.upload('notes.txt', b'plain text')
+        self.assertEqual(pipeline.process_file(text.pk), 'done')
+        text.refresh_from_db()
+        self.assertEqual((text.mime_type, text.thumbnail), ('text/plain', ''))
+
+    @override_settings(
+        UPLOAD_PIPELINE_STAGES=['myapp.pipeline.sniff_mime', 'myapp.tests.flaky_stage'],
+        UPLOAD_PIPELINE_RETRIES=2, UPLOAD_PIPELINE_RETRY_DELAY=0,
+    )
+    def test_stage_is_retried(self):
+        self.addCleanup(stage_failures.update, left=0)
+        stage_failures['left'] = 2
+        self.assertEqual(pipeline.process_file(self.file.pk), 'done')
+        self.assertEqual(self.state(self.file), ('done', 1))
+        self.assertEqual(self.file.checksum, 'flaky')
+
+    @override_settings(
+        UPLOAD_PIPELINE_STAGES=['myapp.pipeline.sniff_mime', 'myapp.tests.flaky_stage'],
+        UPLOAD_PIPELINE_RETRIES=1, UPLOAD_PIPELINE_RETRY_DELAY=0, UPLOAD_PIPELINE_MAX_ATTEMPTS=2,
+    )
+    def test_failed_after_retries(self):
+        self.addCleanup(stage_failures.update, left=0)
+        stage_failures['left'] = 10
+        self.assertEqual(pipeline.process_file(self.file.pk), 'failed')
+        self.assertEqual(self.state(self.file), ('failed', 1))
+        # Результат пройденной стадии сохранен, повтор начнется с упавшей
+        self.assertEqual(self.file.mime_type, 'image/png')
+        self.assertEqual(self.file.checksum, '')
+
+        self.assertEqual(pipeline.process_file(self.file.pk), 'failed')
+        self.assertEqual(self.state(self.file), ('failed', 2))
+        # process_uploads больше не берет файл, исчерпавший UPLOAD_PIPELINE_MAX_ATTEMPTS
+        pending = FileStorage.objects.filter(
+            processing_state__in=['pending', 'failed'], processing_attempts__lt=settings.UPLOAD_PIPELINE_MAX_ATTEMPTS
+        )
+        self.assertFalse(pending.filter(pk=self.file.pk).exists())
+
+    def test_thumbnail_view(self):
+        url = f'/api/files/{self.file.pk}/thumbnail/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['processing_state'], 'pending')
+
+        pipeline.process_file(self.file.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'RIFF'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client_for(self.create_user('bob')).get(url).status_code, 403)
+
+
+class MigrateStorageLayoutTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = []
+        for i in range(3):
+            pk = uuid.uuid4()
+            name = default_storage.save(f'files/{pk}.txt', ContentFile(f'legacy {i}'.encode()))
+            self.rows.append(FileStorage.objects.create(
+                id=pk, owner=self.user, original_name=f'legacy {i}', name=f'{pk}.txt', file=name, size=8
+            ))
+        self.rows.sort(key=lambda row: row.pk)
+        self.legacy = [row.file.name for row in self.rows]
+        self.checkpoint = os.path.join(settings.MEDIA_ROOT, '.layout_checkpoint')
+
+    def migrate(self, *args):
+        out = io.StringIO()
+        call_command('migrate_storage_layout', '--sleep', '0', '--grace', '0', '--batch-size', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def names(self):
+        return [row.file.name for row in FileStorage.objects.order_by('pk')]
+
+    def sharded(self, row):
+        return f'files/{row.pk.hex[:2]}/{row.pk.hex[2:4]}/{row.pk}.txt'
+
+    def assert_readable(self):
+        for row in self.rows:
+            response = self.client.get(f'/api/files/{row.pk}/download/')
+            self.assertEqual(b''.join(response.streaming_content), row.original_name.encode())
+
+    def test_dry_run_changes_nothing(self):
+        output = self.migrate('--dry-run')
+        self.assertIn(f'{self.legacy[0]} -> {self.sharded(self.rows[0])}', output)
+        self.assertEqual(self.names(), self.legacy)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_files_move_to_fan_out_layout(self):
+        self.assertIn('Перенесено: 3, пропущено: 0', self.migrate())
+        self.assertEqual(self.names(), [self.sharded(row) for row in self.rows])
+        for name in self.legacy:
+            self.assertFalse(default_storage.exists(name))
+        self.assert_readable()
+        self.assertFalse(os.path.exists(self.checkpoint))
+        # Повторный запуск ничего не переносит
+        self.assertIn('Перенесено: 0, пропущено: 3', self.migrate())
+        self.assert_readable()
+
+    def test_resume_after_interruption(self):
+        put_file = default_storage.put_file
+        calls = []
+
+        def fail_second(name, path):
+            calls.append(name)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return put_file(name, path)
+
+        with mock.patch.object(default_storage, 'put_file', side_effect=fail_second):
+            with self.assertRaises(KeyboardInterrupt):
+                self.migrate()
+        with open(self.checkpoint) as f:
+            self.assertEqual(f.read(), str(self.rows[0].pk))
+
+        output = self.migrate()
+        self.assertIn(f'Продолжаем после записи {self.rows[0].pk}', output)
+        self.assertIn('Перенесено: 2', output)
+        self.assertEqual(self.names(), [self.sharded(row) for row in self.rows])
+        self.assert_readable()
+
+    def test_concurrent_change_is_not_overwritten(self):
+        put_file = default_storage.put_file
+        moved = self.rows[1]
+
+        # Запись перенесли параллельно, пока копировался файл
+        def move_elsewhere(name, path):
+            result = put_file(name, path)
+            if name == self.sharded(moved):
+                FileStorage.objects.filter(pk=moved.pk).update(file='files/elsewhere.txt')
+            return result
+
+        with mock.patch.object(default_storage, 'put_file', side_effect=move_elsewhere):
+            self.assertIn('Перенесено: 2, пропущено: 1', self.migrate())
+        self.assertEqual(FileStorage.objects.get(pk=moved.pk).file, 'files/elsewhere.txt')
+        self.assertFalse(default_storage.exists(self.sharded(moved)))
+        # Старый путь не удаляется: запись на него больше не ссылается, но перенос не засчитан
+        self.assertTrue(default_storage.exists(moved.file.name))
+
+
+class CheckStorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(settings.FILE_STORAGE_BASE_DIR, 'alice'))
+        self.blob_file = self.upload('a.txt', b'content')
+        self.blob = self.blob_file.blob
+        self.lost = FileStorage.objects.create(
+            owner=self.user, original_name='lost.txt', name='lost.txt', file='files/lost.txt', size=4
+        )
+        name = default_storage.save('files/short.txt', ContentFile(b'12345'))
+        self.short = FileStorage.objects.create(
+            owner=self.user, original_name='short.txt', name='short.txt', file=name, size=9
+        )
+        CustomUser.objects.filter(pk=self.user.pk).update(total_size=len(b'content') + 4 + 9)
+        self.stray = os.path.join(settings.MEDIA_ROOT, 'files', 'ab', 'cd', 'stray.bin')
+        os.makedirs(os.path.dirname(self.stray))
+        with open(self.stray, 'wb') as f:
+            f.write(b'stray')
+        old = time.time() - 25 * 3600
+        os.utime(self.stray, (old, old))
+        Blob.objects.filter(pk=self.blob.pk).update(ref_count=3)
+        self.checkpoint = os.path.join(self.root, 'check_checkpoint')
+
+    def check(self, *args):
+        out = io.StringIO()
+        call_command('check_storage', '--workers', '2', '--checkpoint', self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def test_reports_problems(self):
+        output = self.check()
+        self.assertIn(f'[missing] {self.lost.pk}: files/lost.txt', output)
+        self.assertIn(f'[size] {self.short.pk}: files/short.txt: 5 байт вместо 9', output)
+        self.assertIn('[stray] files/ab/cd/stray.bin: 5 байт', output)
+        self.assertIn(f'[refs] {self.blob.pk}: ref_count 3, ссылок 1', output)
+        self.assertIn('missing: 1, refs: 1, size: 1, stray: 1; исправлено: 0', output)
+        self.assertTrue(FileStorage.objects.filter(pk=self.lost.pk).exists())
+        self.assertTrue(os.path.exists(self.stray))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_repair(self):
+        self.assertIn('исправлено: 4', self.check('--repair'))
+        self.assertFalse(FileStorage.objects.filter(pk=self.lost.pk).exists())
+        self.assertEqual(FileStorage.objects.get(pk=self.short.pk).size, 5)
+        self.assertEqual(Blob.objects.get(pk=self.blob.pk).ref_count, 1)
+        self.assertFalse(os.path.exists(self.stray))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_size, len(b'content') + 5)
+        self.assertIn('расхождений нет', self.check())
+
+    def test_resume_after_interruption(self):
+        with mock.patch(
+            'myapp.management.commands.check_storage.Command.check_stray', side_effect=KeyboardInterrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.check('--batch-size', '1')
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state['phase'], 'stray')
+        self.assertEqual(state['counts']['files'], 3)
+
+        # Проверенные фазы не повторяются, найденное до прерывания попадает в итог
+        output = self.check()
+        self.assertIn('Продолжаем проверку: фаза stray', output)
+        self.assertNotIn('[missing]', output)
+        self.assertIn('[stray] files/ab/cd/stray.bin', output)
+        self.assertIn('Проверено файлов: 3, блобов: 1; missing: 1, refs: 1, size: 1, stray: 1', output)
+
+    def test_restart_ignores_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'phase': 'users', 'last': None, 'counts': {}}, f)
+        output = self.check('--restart')
+        self.assertNotIn('Продолжаем', output)
+        self.assertIn('[missing]', output)
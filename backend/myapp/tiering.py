@@ -0,0 +1,177 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+from . import background, compression
+from .blobstore import blob_tmp_dir
+from .caching import share_links
+from .models import Blob, FileStorage
+from .storage_backends import COLD_PREFIX, delete_stored, is_cold, is_local, locate
+
+
+# Блобы и файлы, которые сейчас возвращаются на горячий уровень в этом процессе
+_rehydrating = set()
+# Отложенные удаления старых копий после переноса
+_retiring = []
+_lock = threading.Lock()
+
+
+def cold_name(name):
+    return COLD_PREFIX + name
+
+
+def hot_name(name):
+    return name[len(COLD_PREFIX):] if is_cold(name) else name
+
+
+# Путь к содержимому на локальном диске: файл локального хранилища как есть,
+# из объектного хранилища - временная копия
+@contextmanager
+def local_copy(name):
+    storage, key = locate(name)
+    if is_local(storage):
+        yield storage.path(key)
+        return
+
+    fd, path = tempfile.mkstemp(dir=blob_tmp_dir())
+    try:
+        with os.fdopen(fd, 'wb') as dst, storage.open(key, 'rb') as src:
+            for block in iter(lambda: src.read(settings.FILE_DOWNLOAD_BLOCK_SIZE), b''):
+                dst.write(block)
+        yield path
+    finally:
+        os.remove(path)
+
+
+# Копирует содержимое под новым именем, при compress - сжимая, если проба это оправдывает.
+# Возвращает (новое имя, байт в хранилище)
+def copy_content(source_name, target_name, compress=False):
+    target_storage, target_key = locate(target_name)
+    with local_copy(source_name) as path:
+        size = os.path.getsize(path)
+        if not compress or compression.is_compressed(source_name) or not compression.probe(path, size):
+            target_storage.put_file(target_key, path)
+            return target_name, size
+
+        fd, tmp_path = tempfile.mkstemp(suffix=compression.COMPRESSED_SUFFIX, dir=blob_tmp_dir())
+        os.close(fd)
+        try:
+            stored_size = compression.compress_file(path, tmp_path)
+            target_storage.put_file(target_key + compression.COMPRESSED_SUFFIX, tmp_path)
+        finally:
+            os.remove(tmp_path)
+        return target_name + compression.COMPRESSED_SUFFIX, stored_size
+
+
+# Старая копия удаляется через TIERING_SOURCE_GRACE секунд: ответы, начатые до
+# переключения строки (архивы, диапазоны, чтение из S3), открывают файл по прежнему
+# имени уже во время отдачи тела. Если процесс завершится раньше, копию уберет sweep_storage
+def retire(name):
+    if not settings.TIERING_SOURCE_GRACE:
+        delete_stored(name)
+        return
+    timer = threading.Timer(settings.TIERING_SOURCE_GRACE, background.run_task, (delete_stored, name))
+    timer.daemon = True
+    with _lock:
+        _retiring[:] = [pending for pending in _retiring if pending.is_alive()]
+        _retiring.append(timer)
+    timer.start()
+
+
+# Для команд: дождаться удаления старых копий перед выходом
+def wait_retired():
+    with _lock:
+        pending = list(_retiring)
+    for timer in pending:
+        timer.join()
+
+
+# Перенос между уровнями: содержимое копируется вне транзакции, строки переключаются
+# под блокировкой, только если за время копирования их никто не изменил. Старая копия
+# удаляется после фиксации с задержкой (retire). Возвращает байт в хранилище или None,
+# если переноса не было.
+def relocate(source, target, compress, update):
+    target, stored_size = copy_content(source, target, compress)
+    with transaction.atomic():
+        links = update(source, target, stored_size)
+
+    if links is None:
+        # Проиграли гонку: копию удаляем, если на нее не успел переключиться параллельный перенос
+        if not (Blob.objects.filter(file=target).exists() or FileStorage.all_objects.filter(file=target).exists()):
+            delete_stored(target)
+        return None
+
+    for share_link in links:
+        share_links.invalidate(share_link)
+    retire(source)
+    return stored_size
+
+
+def update_blob(digest):
+    def update(source, target, stored_size):
+        blob = Blob.objects.select_for_update().filter(pk=digest, file=source, ref_count__gt=0).first()
+        if blob is None:
+            return None
+        blob.file = target
+        blob.stored_size = stored_size
+        blob.save(update_fields=['file', 'stored_size'])
+        files = FileStorage.all_objects.filter(blob_id=digest)
+        files.update(file=target)
+        return list(files.filter(share_link__isnull=False).values_list('share_link', flat=True))
+    return update
+
+
+def update_file(pk):
+    def update(source, target, stored_size):
+        if not FileStorage.all_objects.filter(pk=pk, file=source).update(file=target):
+            return None
+        return [link for link in FileStorage.all_objects.filter(pk=pk).values_list('share_link', flat=True) if link]
+    return update
+
+
+def freeze_blob(blob, compress=False):
+    return relocate(blob.file.name, cold_name(blob.file.name), compress, update_blob(blob.pk))
+
+
+def freeze_file(file_storage, compress=False):
+    return relocate(file_storage.file.name, cold_name(file_storage.file.name), compress, update_file(file_storage.pk))
+
+
+# Возврат на горячий уровень; содержимое переносится как есть, без распаковки
+def rehydrate(digest, pk):
+    if digest:
+        name = Blob.objects.filter(pk=digest).values_list('file', flat=True).first()
+        update = update_blob(digest)
+    else:
+        name = FileStorage.all_objects.filter(pk=pk).values_list('file', flat=True).first()
+        update = update_file(pk)
+    if name and is_cold(name):
+        relocate(name, hot_name(name), False, update)
+
+
+def run_rehydration(key, digest, pk):
+    try:
+        rehydrate(digest, pk)
+    finally:
+        with _lock:
+            _rehydrating.discard(key)
+
+
+# Первое скачивание холодного файла отдается с холодного уровня, а в фоне файл
+# возвращается на горячий; повторные скачивания того же содержимого не плодят задач.
+# С response перенос начинается, когда сервер закроет ответ: тело ответа читает файл
+# по холодному имени до самого конца отдачи
+def schedule_rehydration(file_storage, response=None):
+    if not settings.TIERING_REHYDRATE_ON_DOWNLOAD or not is_cold(file_storage.file.name):
+        return
+    if response is not None:
+        response._resource_closers.append(lambda: schedule_rehydration(file_storage))
+        return
+    key = file_storage.blob_id or file_storage.pk
+    with _lock:
+        if key in _rehydrating:
+            return
+        _rehydrating.add(key)
+    background.submit(run_rehydration, key, file_storage.blob_id, file_storage.pk)
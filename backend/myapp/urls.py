@@ -1,9 +1,13 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserProfileView, RegisterView, LoginView, logout_view,
-    AdminUserViewSet, FileListView, FileUploadView, FileDetailView,
-    FileDownloadView, FileShareView, FileRenameView, SharedFileView
+    TokenObtainView, TokenRefreshView, TokenRevokeView,
+    AdminUserViewSet, FileListView, FileSearchView, FileUploadView, FileDetailView,
+    FileDownloadView, FileShareView, FileRenameView, SharedFileView,
+    UploadSessionCreateView, UploadSessionView, UploadSessionCompleteView,
+    FileBlobView, FileArchiveView, FileBulkUpdateView, FileBulkDeleteView, FileThumbnailView,
+    BandwidthMetricsView, AdmissionMetricsView
 )
 
 router = DefaultRouter()
@@ -14,15 +18,27 @@ urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', logout_view, name='logout'),
+    path('token/', TokenObtainView.as_view(), name='token-obtain'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token-revoke'),
     
     # Профиль пользователя
     path('profile/', UserProfileView.as_view(), name='profile'),
     
     # Файловое хранилище
     path('files/', FileListView.as_view(), name='file-list'),
+    path('files/search/', FileSearchView.as_view(), name='file-search'),
     path('files/upload/', FileUploadView.as_view(), name='file-upload'),
+    path('files/uploads/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('files/uploads/<uuid:pk>/', UploadSessionView.as_view(), name='upload-session'),
+    path('files/uploads/<uuid:pk>/complete/', UploadSessionCompleteView.as_view(), name='upload-session-complete'),
+    path('files/bulk/update/', FileBulkUpdateView.as_view(), name='file-bulk-update'),
+    path('files/bulk/delete/', FileBulkDeleteView.as_view(), name='file-bulk-delete'),
+    path('files/archive/', FileArchiveView.as_view(), name='file-archive'),
+    re_path(r'^files/blobs/(?P<digest>[0-9a-fA-F]{64})/$', FileBlobView.as_view(), name='file-blob'),
     path('files/<uuid:pk>/', FileDetailView.as_view(), name='file-detail'),
     path('files/<uuid:pk>/download/', FileDownloadView.as_view(), name='file-download'),
+    path('files/<uuid:pk>/thumbnail/', FileThumbnailView.as_view(), name='file-thumbnail'),
     path('files/<uuid:pk>/share/', FileShareView.as_view(), name='file-share'),
     path('files/<uuid:pk>/rename/', FileRenameView.as_view(), name='file-rename'),
     
@@ -30,5 +46,7 @@ urlpatterns = [
     path('shared/<uuid:share_link>/', SharedFileView.as_view(), name='shared-file'),
     
     # Административный интерфейс
+    path('metrics/bandwidth/', BandwidthMetricsView.as_view(), name='bandwidth-metrics'),
+    path('metrics/admission/', AdmissionMetricsView.as_view(), name='admission-metrics'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -5,21 +5,36 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate, login, logout
 from rest_framework.response import Response
 from rest_framework import status, viewsets
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.core.files.storage import default_storage
+from django.utils.cache import get_conditional_response
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.utils import timezone
-from datetime import timedelta
-from .models import CustomUser, FileStorage
+from datetime import timedelta, datetime, time
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from .models import CustomUser, FileStorage, UploadSession, Blob
+from .archives import zip_stream
+from .authentication import issue_tokens, revoke_tokens
+from .caching import share_links
+from .deletion import tombstone_files
+from .downloads import file_response
+from .pagination import FileCursorPagination, SearchCursorPagination
+from .renderers import json_response, streaming_json_response
+from . import admission, blobstore, quotas, search, shaping, sharing
 from .serializers import (
     RegisterSerializer, LoginSerializer, UserProfileSerializer,
     UserUpdateSerializer, AdminUserSerializer, FileStorageUploadSerializer,
-    FileStorageSerializer
+    FileStorageSerializer, FILE_LIST_VALUES, file_list_row
 )
+import os
 import uuid
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_protect
+from django.db import transaction
+import re
 from django.conf import settings
 from rest_framework.renderers import JSONRenderer
 
@@ -39,6 +54,9 @@ class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        # Счетчики хранилища читаются из строки пользователя одним запросом по первичному ключу:
+        # объект пользователя мог прийти из кеша аутентификации
+        request.user.refresh_from_db(fields=['file_count', 'total_size', 'reserved_size', 'quota'])
         serializer = UserProfileSerializer(request.user)
         return Response(serializer.data)
 
@@ -115,6 +133,49 @@ def logout_view(request):
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# Токены для API-клиентов: вход по паролю выдает токен доступа и токен обновления
+class TokenObtainView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        try:
+            serializer = LoginSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response({
+                    'error': 'Неверное имя пользователя или пароль'
+                }, status=status.HTTP_401_UNAUTHORIZED)
+            user = serializer.validated_data['user']
+            token, _ = Token.objects.get_or_create(user=user)
+            return Response(issue_tokens(user, token))
+        except Exception as e:
+            print(f"Ошибка при выдаче токена: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class TokenRefreshView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        refresh = request.data.get('refresh')
+        if not refresh or not isinstance(refresh, str):
+            return Response({'error': 'Не указан токен обновления'}, status=status.HTTP_400_BAD_REQUEST)
+        token = Token.objects.select_related('user').filter(key=refresh, user__is_active=True).first()
+        if token is None:
+            return Response({'error': 'Токен обновления недействителен'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(issue_tokens(token.user, token))
+
+
+# Отзыв всех токенов пользователя; следующий вход по паролю выдаст новый токен обновления
+class TokenRevokeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        revoke_tokens(request.user)
+        return Response({'message': 'Токены отозваны'})
+
+
 class IsAdminUser(BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated and request.user.is_admin
@@ -176,8 +237,54 @@ class AdminUserViewSet(viewsets.ModelViewSet):
             )
 
 
+# Счетчики ограничения полосы: переданные байты, время ожидания, активные арендаторы
+class BandwidthMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(shaping.metrics())
+
+
+# Состояние пулов допуска запросов этого процесса воркера
+class AdmissionMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(admission.controller.stats())
+
+
+# Фильтры списка файлов: name - подстрока имени, size_min/size_max - байты,
+# date_from/date_to - дата или дата-время загрузки (ISO 8601)
+def filter_files(files, params):
+    name = params.get('name')
+    if name:
+        files = files.filter(original_name__icontains=name)
+
+    for param, lookup in (('size_min', 'size__gte'), ('size_max', 'size__lte')):
+        value = params.get(param)
+        if value:
+            try:
+                files = files.filter(**{lookup: int(value)})
+            except ValueError:
+                raise ValidationError({param: 'Неверный размер'})
+
+    for param, lookup in (('date_from', 'upload_date__gte'), ('date_to', 'upload_date__lte')):
+        value = params.get(param)
+        if value:
+            date = parse_datetime(value)
+            if date is None and parse_date(value):
+                date = datetime.combine(parse_date(value), time.max if param == 'date_to' else time.min)
+            if date is None:
+                raise ValidationError({param: 'Неверная дата'})
+            if timezone.is_naive(date):
+                date = timezone.make_aware(date)
+            files = files.filter(**{lookup: date})
+    return files
+
+
 class FileListView(APIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = FileCursorPagination
 
     def get(self, request):
         # Проверяем, если в запросе указан user_id и текущий пользователь - админ
@@ -196,13 +303,65 @@ class FileListView(APIView):
             files = FileStorage.objects.all()
         else:
             files = FileStorage.objects.filter(owner=request.user)
-        
-        serializer = FileStorageSerializer(files, many=True, context={'request': request})
-        return Response(serializer.data)
+
+        files = filter_files(files, request.query_params)
+
+        # Вывод тот же, что у FileStorageSerializer, но строки собираются из values()
+        files = files.values(*FILE_LIST_VALUES)
+        user_id = request.user.pk
+
+        # ?stream=1 - выгрузка всего списка одним потоком без пагинации
+        if request.query_params.get('stream') in ('1', 'true'):
+            return streaming_json_response(
+                files.order_by('-upload_date', '-id'),
+                lambda row: file_list_row(row, user_id)
+            )
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(files, request, view=self)
+        return json_response(paginator.get_paginated_data([file_list_row(row, user_id) for row in page]))
+
+
+class FileSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Поиск идет по файлам одного владельца: админ может указать user_id
+        owner = request.user
+        user_id = request.query_params.get('user_id')
+        if user_id and request.user.is_admin:
+            owner = CustomUser.objects.filter(id=user_id).first() if user_id.isdigit() else None
+            if owner is None:
+                return Response(
+                    {'error': 'Пользователь не найден'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+        mode = request.query_params.get('mode', 'fulltext')
+        files = filter_files(FileStorage.objects.filter(owner=owner), request.query_params)
+        files = search.search_files(files, request.query_params.get('q'), mode)
+        files = files.values(*FILE_LIST_VALUES, 'rank')
+
+        paginator = SearchCursorPagination(descending=search.is_descending(mode))
+        page = paginator.paginate_queryset(files, request, view=self)
+        user_id = request.user.pk
+        return json_response(paginator.get_paginated_data([file_list_row(row, user_id) for row in page]))
 
 
 class FileUploadView(APIView):
     permission_classes = [IsAuthenticated]
+    admission_pool = 'upload'
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Хешируем файл по мере приема, до того как DRF разберет тело запроса
+        self.upload_handler = blobstore.BlobUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Резерв по Content-Length снимается при любом исходе: принятый файл уже учтен в total_size
+        self.upload_handler.release_quota()
+        return super().finalize_response(request, response, *args, **kwargs)
 
     def post(self, request):
         try:
@@ -215,18 +374,25 @@ class FileUploadView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Создаем объект FileStorage
-            file_storage = FileStorage(
-                original_name=file_obj.name,
-                file=file_obj,
-                comment=comment,
-                size=file_obj.size,
-                owner=request.user
-            )
-            file_storage.save()
+            # Без Content-Length (chunked) место проверяется по размеру принятого файла
+            size = 0 if self.upload_handler.reserved else file_obj.size
+            # Одинаковое содержимое хранится один раз, запись ссылается на блоб
+            with transaction.atomic(), quotas.reservation(request.user.pk, size):
+                blob = blobstore.store_upload(file_obj)
+                file_storage = FileStorage(
+                    original_name=file_obj.name,
+                    file=blob.file.name,
+                    blob=blob,
+                    comment=comment,
+                    size=file_obj.size,
+                    owner=request.user
+                )
+                file_storage.save()
 
             serializer = FileStorageSerializer(file_storage, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except quotas.QuotaExceeded as e:
+            return Response({'error': str(e.detail)}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'error': str(e)}, 
@@ -234,11 +400,305 @@ class FileUploadView(APIView):
             )
 
 
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def upload_session_data(session):
+    return {
+        'id': str(session.id),
+        'original_name': session.original_name,
+        'size': session.size,
+        'offset': session.offset,
+        'received': session.received,
+        'expires': session.expires,
+    }
+
+
+class UploadSessionCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        original_name = request.data.get('name')
+        comment = request.data.get('comment', '')
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+
+        if not original_name:
+            return Response(
+                {'error': 'Имя файла не указано'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if size < 0:
+            return Response(
+                {'error': 'Неверный размер файла'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            # Место под весь файл резервируется вместе с созданием сессии, до приема первой части,
+            # и снимается при ее завершении, отмене или удалении просроченной сессии
+            with transaction.atomic():
+                if not quotas.reserve(request.user.pk, size):
+                    return Response(
+                        {'error': quotas.QuotaExceeded.default_detail},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                    )
+                session = UploadSession(
+                    original_name=original_name,
+                    comment=comment,
+                    size=size,
+                    owner=request.user
+                )
+                session.save()
+            session.prepare_file()
+            response = Response(upload_session_data(session), status=status.HTTP_201_CREATED)
+            response['Upload-Offset'] = session.offset
+            return response
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class UploadSessionView(APIView):
+    permission_classes = [IsAuthenticated]
+    admission_pool = 'upload'
+
+    def get_object(self, pk, user):
+        try:
+            return UploadSession.objects.get(pk=pk, owner=user, expires__gt=timezone.now())
+        except UploadSession.DoesNotExist:
+            raise Http404("Сессия загрузки не найдена")
+
+    # Текущее состояние сессии: клиент узнает, с какого места продолжать
+    def get(self, request, pk):
+        session = self.get_object(pk, request.user)
+        response = Response(upload_session_data(session))
+        response['Upload-Offset'] = session.offset
+        return response
+
+    # Прием части файла: Content-Range: bytes start-end/total или заголовок Upload-Offset
+    def put(self, request, pk):
+        session = self.get_object(pk, request.user)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = -1
+
+        content_range = request.META.get('HTTP_CONTENT_RANGE')
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range.strip())
+            if not match:
+                return Response(
+                    {'error': 'Неверный заголовок Content-Range'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            start, end, total = match.groups()
+            start, end = int(start), int(end) + 1
+            if total != '*' and int(total) != session.size:
+                return Response(
+                    {'error': 'Размер файла не совпадает с сессией'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if end - start != length:
+                return Response(
+                    {'error': 'Длина части не совпадает с Content-Range'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            try:
+                start = int(request.META.get('HTTP_UPLOAD_OFFSET', request.query_params.get('offset', session.offset)))
+            except ValueError:
+                start = -1
+            end = start + length
+
+        if length <= 0 or start < 0 or end > session.size:
+            return Response(
+                {'error': 'Диапазон выходит за границы файла'},
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+            )
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {'error': 'Слишком большая часть файла'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        try:
+            stream = request
+            if shaping.is_enabled():
+                stream = shaping.ShapedReader(request, shaping.transfer('upload', request.user))
+            written = session.write_chunk(start, stream, length)
+            if written != length:
+                # Соединение оборвалось: принятое начало части тоже засчитываем
+                end = start + written
+
+            with transaction.atomic():
+                session = UploadSession.objects.select_for_update().get(pk=session.pk)
+                if written:
+                    session.received = UploadSession.merge_ranges(session.received, start, end)
+                    session.save(update_fields=['received'])
+
+            response = Response(upload_session_data(session))
+            response['Upload-Offset'] = session.offset
+            return response
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def patch(self, request, pk):
+        return self.put(request, pk)
+
+    def delete(self, request, pk):
+        session = self.get_object(pk, request.user)
+        session.remove_file()
+        with transaction.atomic():
+            if UploadSession.objects.filter(pk=session.pk).delete()[0]:
+                quotas.release(session.owner_id, session.size)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    admission_pool = 'upload'
+
+    def incomplete(self, session):
+        response = Response(
+            {'error': 'Файл загружен не полностью', **upload_session_data(session)},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Upload-Offset'] = session.offset
+        return response
+
+    def post(self, request, pk):
+        try:
+            session = UploadSession.objects.get(pk=pk, owner=request.user, expires__gt=timezone.now())
+            if not session.is_complete:
+                return self.incomplete(session)
+
+            # Файл хешируется вне транзакции, чтобы чтение всего файла не держало блокировку
+            # строки сессии. Повторная отправка части могла изменить файл за это время -
+            # тогда размер или mtime не совпадут, и клиенту нужно повторить завершение
+            hashed = os.stat(session.file_path)
+            digest = blobstore.hash_file(session.file_path)
+
+            with transaction.atomic():
+                session = UploadSession.objects.select_for_update().get(
+                    pk=pk, owner=request.user, expires__gt=timezone.now()
+                )
+                if not session.is_complete:
+                    return self.incomplete(session)
+                current = os.stat(session.file_path)
+                if (current.st_size, current.st_mtime_ns) != (hashed.st_size, hashed.st_mtime_ns):
+                    return Response(
+                        {'error': 'Файл изменился во время проверки, повторите запрос'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+
+                # Собранный файл переносится в хранилище блобов жесткой ссылкой, без копирования
+                blob = blobstore.store(session.file_path, digest, session.size)
+                file_storage = FileStorage(
+                    id=session.file_id,
+                    original_name=session.original_name,
+                    name=session.name,
+                    file=blob.file.name,
+                    blob=blob,
+                    comment=session.comment,
+                    size=session.size,
+                    owner=request.user
+                )
+                file_storage.save()
+                session.delete()
+                # Файл учтен в total_size, резерв сессии больше не нужен
+                quotas.release(request.user.pk, session.size)
+            session.remove_file()
+
+            serializer = FileStorageSerializer(file_storage, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except UploadSession.DoesNotExist:
+            return Response(
+                {'error': 'Сессия загрузки не найдена'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class FileBlobView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Знание хеша не доказывает владение содержимым: поиск и создание файла по хешу
+    # доступны только для блобов, на которые уже ссылаются файлы этого пользователя.
+    # Совпадения с чужими файлами дедуплицируются при обычной загрузке, после приема байт
+    def get_blob(self, request, digest):
+        if not FileStorage.objects.filter(owner=request.user, blob_id=digest.lower()).exists():
+            return None
+        return Blob.objects.filter(pk=digest.lower()).first()
+
+    # Проверка перед загрузкой: есть ли уже у пользователя содержимое с таким SHA-256
+    def get(self, request, digest):
+        blob = self.get_blob(request, digest)
+        if blob is None:
+            return Response({'exists': False}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'exists': True, 'size': blob.size})
+
+    # Создание файла из уже хранящегося содержимого, без передачи байт
+    def post(self, request, digest):
+        original_name = request.data.get('name')
+        comment = request.data.get('comment', '')
+
+        if not original_name:
+            return Response(
+                {'error': 'Имя файла не указано'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        blob = self.get_blob(request, digest)
+        if blob is None:
+            return Response({'exists': False}, status=status.HTTP_404_NOT_FOUND)
+        size = blob.size
+
+        try:
+            # Байты не передаются, но файл занимает место в квоте наравне с загруженным
+            with transaction.atomic(), quotas.reservation(request.user.pk, size):
+                blob = blobstore.acquire(digest.lower())
+                if blob is None:
+                    return Response({'exists': False}, status=status.HTTP_404_NOT_FOUND)
+                file_storage = FileStorage(
+                    original_name=original_name,
+                    file=blob.file.name,
+                    blob=blob,
+                    comment=comment,
+                    size=blob.size,
+                    owner=request.user
+                )
+                file_storage.save()
+
+            serializer = FileStorageSerializer(file_storage, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except quotas.QuotaExceeded as e:
+            return Response({'error': str(e.detail)}, status=e.status_code)
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class FileDetailView(APIView):
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
 
     def get_object(self, pk):
-        return FileStorage.objects.get(pk=pk)
+        file_storage = FileStorage.objects.get(pk=pk)
+        self.check_object_permissions(self.request, file_storage)
+        return file_storage
 
     def get(self, request, pk):
         file_storage = self.get_object(pk)
@@ -253,39 +713,271 @@ class FileDetailView(APIView):
 
 class FileDownloadView(APIView):
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+    admission_pool = 'download'
 
     def get_object(self, pk):
-        return FileStorage.objects.get(pk=pk)
+        file_storage = FileStorage.objects.get(pk=pk)
+        self.check_object_permissions(self.request, file_storage)
+        return file_storage
 
     def get(self, request, pk):
         file_storage = self.get_object(pk)
-        file_storage.update_last_download()
-        response = FileResponse(file_storage.file, as_attachment=True)
-        response['Content-Disposition'] = f'attachment; filename="{file_storage.original_name}"'
+        response = file_response(request, file_storage, as_attachment=True)
+        # 304 и 416 не считаем скачиванием
+        if response.status_code in (200, 206):
+            file_storage.update_last_download(response)
+        return shaping.limit_response(response, user=request.user)
+
+
+class FileThumbnailView(APIView):
+    permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+    admission_pool = 'download'
+
+    # Превью не меняется после создания, поэтому кешируется браузером надолго
+    def get(self, request, pk):
+        try:
+            file_storage = FileStorage.objects.get(pk=pk)
+        except FileStorage.DoesNotExist:
+            return Response({'error': 'Файл не найден'}, status=status.HTTP_404_NOT_FOUND)
+        self.check_object_permissions(request, file_storage)
+
+        if not file_storage.thumbnail:
+            return Response(
+                {'error': 'Превью недоступно', 'processing_state': file_storage.processing_state},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        etag = f'"{os.path.basename(file_storage.thumbnail)}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(default_storage.open(file_storage.thumbnail, 'rb'), content_type='image/webp')
+        response['ETag'] = etag
+        response['Cache-Control'] = f'private, max-age={settings.THUMBNAIL_CACHE_MAX_AGE}, immutable'
         return response
 
 
+class FileArchiveView(APIView):
+    permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+    admission_pool = 'download'
+
+    # Скачивание нескольких файлов одним ZIP-архивом, собираемым на лету
+    def post(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response(
+                {'error': 'Не указан список файлов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > settings.ARCHIVE_MAX_FILES:
+            return Response(
+                {'error': f'Можно выбрать не более {settings.ARCHIVE_MAX_FILES} файлов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            ids = [uuid.UUID(str(pk)) for pk in ids]
+        except ValueError:
+            return Response(
+                {'error': 'Неверный идентификатор файла'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Владелец нужен проверке прав каждого файла: без select_related - запрос на файл
+        files = {
+            file_storage.pk: file_storage
+            for file_storage in FileStorage.objects.select_related('owner').filter(pk__in=ids)
+        }
+        missing = [str(pk) for pk in ids if pk not in files]
+        if missing:
+            return Response(
+                {'error': 'Файлы не найдены', 'ids': missing},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        ordered = list(dict.fromkeys(files[pk] for pk in ids))
+        for file_storage in ordered:
+            self.check_object_permissions(request, file_storage)
+
+        # Скачивание засчитывается, когда файл целиком отдан в архиве: прерванный
+        # архив не отмечает файлы, до которых не дошел
+        response = StreamingHttpResponse(
+            zip_stream(ordered, on_member=lambda file_storage: file_storage.update_last_download(response)),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = 'attachment; filename="files.zip"'
+        return shaping.limit_response(response, user=request.user)
+
+
+# Разбор списка id для пакетных операций: (uuid или None для неверного id, исходное значение)
+def parse_bulk_ids(values):
+    parsed = []
+    for value in values:
+        try:
+            parsed.append((uuid.UUID(str(value)), value))
+        except ValueError:
+            parsed.append((None, value))
+    return parsed
+
+
+# Права на все файлы пакета проверяются одним запросом
+def check_bulk_permissions(request, parsed_ids):
+    ids = [pk for pk, _ in parsed_ids if pk]
+    owners = dict(FileStorage.objects.filter(pk__in=ids).values_list('id', 'owner_id'))
+    results = {}
+    for pk, value in parsed_ids:
+        if pk is None:
+            results[str(value)] = 'invalid'
+        elif pk not in owners:
+            results[str(pk)] = 'not_found'
+        elif not (request.user.is_admin or owners[pk] == request.user.pk):
+            results[str(pk)] = 'forbidden'
+        else:
+            results[str(pk)] = 'ok'
+    return results
+
+
+# Ошибка в полях одного элемента пакетного изменения; None - элемент корректен
+def bulk_item_error(item):
+    if 'name' in item:
+        name = item['name']
+        if not isinstance(name, str) or not name:
+            return 'Имя файла должно быть непустой строкой'
+        max_length = FileStorage._meta.get_field('original_name').max_length
+        if len(name) > max_length:
+            return f'Имя файла длиннее {max_length} символов'
+    if 'comment' in item and item['comment'] is not None and not isinstance(item['comment'], str):
+        return 'Комментарий должен быть строкой'
+    return None
+
+
+class FileBulkUpdateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Пакетное переименование и изменение комментариев: items = [{id, name?, comment?}, ...]
+    def post(self, request):
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'Не указан список файлов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.BULK_MAX_ITEMS:
+            return Response(
+                {'error': f'Можно изменить не более {settings.BULK_MAX_ITEMS} файлов за раз'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not all(isinstance(item, dict) for item in items):
+            return Response(
+                {'error': 'Неверный формат списка файлов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        parsed_ids = parse_bulk_ids(item.get('id') for item in items)
+        results = check_bulk_permissions(request, parsed_ids)
+        changes = {}
+        # Некорректный элемент не срывает весь пакет: он получает статус invalid с текстом ошибки
+        errors = {}
+        for (pk, _), item in zip(parsed_ids, items):
+            if pk is None or results[str(pk)] != 'ok':
+                continue
+            error = bulk_item_error(item)
+            if error:
+                results[str(pk)] = 'invalid'
+                errors[str(pk)] = error
+                continue
+            changes[pk] = item
+
+        try:
+            with transaction.atomic():
+                files = list(FileStorage.objects.select_for_update().filter(pk__in=changes))
+                for file_storage in files:
+                    item = changes[file_storage.pk]
+                    if 'name' in item:
+                        file_storage.original_name = item['name']
+                    if 'comment' in item:
+                        file_storage.comment = item['comment']
+                FileStorage.objects.bulk_update(files, ['original_name', 'comment'], batch_size=500)
+
+            # bulk_update не вызывает сигналы, поэтому сбрасываем закешированные ссылки сами
+            for file_storage in files:
+                share_links.invalidate(file_storage.share_link)
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        return Response({'results': [
+            {'id': pk, 'status': result, **({'error': errors[pk]} if pk in errors else {})}
+            for pk, result in results.items()
+        ]})
+
+
+class FileBulkDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Пакетное удаление: ids = [...]; файлы помечаются удаленными, с диска их убирает фоновая очистка
+    def post(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response(
+                {'error': 'Не указан список файлов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > settings.BULK_MAX_ITEMS:
+            return Response(
+                {'error': f'Можно удалить не более {settings.BULK_MAX_ITEMS} файлов за раз'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        parsed_ids = parse_bulk_ids(ids)
+        results = check_bulk_permissions(request, parsed_ids)
+        allowed = [pk for pk, _ in parsed_ids if pk and results[str(pk)] == 'ok']
+
+        try:
+            deleted = set(tombstone_files(allowed))
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        # Файлы, удаленные параллельным запросом между проверкой и удалением
+        for pk in allowed:
+            if pk not in deleted:
+                results[str(pk)] = 'not_found'
+        return Response({'results': [{'id': pk, 'status': result} for pk, result in results.items()]})
+
+
 class FileShareView(APIView):
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
     renderer_classes = [JSONRenderer]  # Явно указываем, что возвращаем только JSON
 
     def get_object(self, pk):
         try:
-            return FileStorage.objects.get(pk=pk)
+            file_storage = FileStorage.objects.get(pk=pk)
         except FileStorage.DoesNotExist:
             raise Http404("Файл не найден")
+        self.check_object_permissions(self.request, file_storage)
+        return file_storage
+
+    def share_data(self, file_storage):
+        return {
+            'share_link': str(file_storage.share_link),
+            'share_link_expiry': file_storage.share_link_expiry,
+            'max_downloads': file_storage.share_link_max_downloads,
+            'downloads': file_storage.share_link_downloads,
+        }
 
     def get(self, request, pk):
         try:
             file_storage = self.get_object(pk)
             if not file_storage.share_link:
                 file_storage.share_link = uuid.uuid4()
-                file_storage.share_link_expiry = timezone.now() + timedelta(days=7)
+                file_storage.share_link_expiry = sharing.default_expiry()
                 file_storage.save()
             
-            share_link = str(file_storage.share_link)
             return Response(
-                {'share_link': share_link},
+                self.share_data(file_storage),
                 content_type='application/json'
             )
         except Http404 as e:
@@ -294,6 +986,8 @@ class FileShareView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
                 content_type='application/json'
             )
+        except PermissionDenied:
+            raise
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -301,12 +995,48 @@ class FileShareView(APIView):
                 content_type='application/json'
             )
 
+    # Настройки ссылки: срок действия (expires_in, секунд) и лимит скачиваний (max_downloads,
+    # null - без лимита). Счетчик скачиваний по ссылке при этом обнуляется
+    def post(self, request, pk):
+        file_storage = self.get_object(pk)
+
+        try:
+            expires_in = int(request.data.get('expires_in', settings.SHARE_LINK_TTL))
+        except (TypeError, ValueError):
+            return Response({'error': 'Неверный срок действия ссылки'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < expires_in <= settings.SHARE_LINK_MAX_TTL:
+            return Response(
+                {'error': f'Срок действия ссылки должен быть от 1 до {settings.SHARE_LINK_MAX_TTL} секунд'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_downloads = request.data.get('max_downloads')
+        if max_downloads is not None:
+            try:
+                max_downloads = int(max_downloads)
+            except (TypeError, ValueError):
+                max_downloads = 0
+            if max_downloads < 1:
+                return Response({'error': 'Неверный лимит скачиваний'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not file_storage.share_link:
+            file_storage.share_link = uuid.uuid4()
+        file_storage.share_link_expiry = timezone.now() + timedelta(seconds=expires_in)
+        file_storage.share_link_max_downloads = max_downloads
+        file_storage.share_link_downloads = 0
+        file_storage.save(update_fields=[
+            'share_link', 'share_link_expiry', 'share_link_max_downloads', 'share_link_downloads',
+        ])
+        return Response(self.share_data(file_storage))
+
 
 class FileRenameView(APIView):
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
 
     def get_object(self, pk):
-        return FileStorage.objects.get(pk=pk)
+        file_storage = FileStorage.objects.get(pk=pk)
+        self.check_object_permissions(self.request, file_storage)
+        return file_storage
 
     def patch(self, request, pk):
         file_storage = self.get_object(pk)
@@ -327,24 +1057,33 @@ class FileRenameView(APIView):
 
 class SharedFileView(APIView):
     permission_classes = [AllowAny]
+    admission_pool = 'download'
 
     def get(self, request, share_link):
         try:
             # Преобразуем share_link из строки в UUID
             share_link_uuid = uuid.UUID(str(share_link))
-            
-            file_storage = FileStorage.objects.get(share_link=share_link_uuid)
-            
+
+            # Ссылка разрешается через кеш, в том числе отрицательный
+            file_storage = share_links.resolve(share_link_uuid)
+            if file_storage is None:
+                raise FileStorage.DoesNotExist
+
             if file_storage.share_link_expiry and file_storage.share_link_expiry < timezone.now():
                 return Response({'error': 'Ссылка истекла'}, status=400)
 
-            # Обновляем только дату последнего скачивания
-            file_storage.last_download = timezone.now()
-            file_storage.save(update_fields=['last_download'])
+            response = file_response(request, file_storage, as_attachment=False)
 
-            response = FileResponse(file_storage.file, as_attachment=False)
-            response['Content-Disposition'] = f'inline; filename="{file_storage.original_name}"'
-            return response
+            if response.status_code in (200, 206):
+                # Лимит скачиваний проверяется по строке в БД, а не по кешу ссылок; ссылки без
+                # лимита обходятся без записи в БД. 304/412/416 скачиванием не считаются
+                counted = request.method != 'HEAD'
+                if sharing.is_limited(file_storage) and not sharing.consume_download(share_link_uuid, counted):
+                    response.close()
+                    return Response({'error': 'Ссылка истекла или лимит скачиваний исчерпан'}, status=410)
+                # Обновляем только дату последнего скачивания
+                file_storage.update_last_download(response)
+            return shaping.limit_response(response, share_link=share_link_uuid)
         except FileStorage.DoesNotExist:
             return Response({'error': 'Файл не найден'}, status=404)
         except ValueError as e:
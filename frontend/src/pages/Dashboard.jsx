@@ -102,20 +102,26 @@ const Dashboard = () => {
       if (userId) {
         url += `?user_id=${userId}`;
       }
-      
-      const response = await fetch(url, {
-        credentials: 'include',
-        headers: {
-          'Content-Type': 'application/json'
+
+      // Список отдается постранично, проходим по курсору до последней страницы
+      const allFiles = [];
+      while (url) {
+        const response = await fetch(url, {
+          credentials: 'include',
+          headers: {
+            'Content-Type': 'application/json'
+          }
+        });
+
+        if (!response.ok) {
+          throw new Error('Ошибка при загрузке файлов');
         }
-      });
-      
-      if (!response.ok) {
-        throw new Error('Ошибка при загрузке файлов');
+
+        const data = await response.json();
+        allFiles.push(...data.results);
+        url = data.next;
       }
-      
-      const data = await response.json();
-      setFiles(data);
+      setFiles(allFiles);
     } catch (err) {
       setError('Ошибка при загрузке списка файлов');
     }
@@ -131,18 +131,25 @@ const FileManager = () => {
     // Загрузка списка файлов
     const fetchFiles = async () => {
         try {
-            const response = await fetch(`${import.meta.env.VITE_SERVER_URL}/api/files/`, {
-                credentials: 'include'
-            });
-            if (!response.ok) {
-                if (response.status === 401) {
-                    window.location.href = '/login';
-                    return;
+            // Список отдается постранично, проходим по курсору до последней страницы
+            const allFiles = [];
+            let url = `${import.meta.env.VITE_SERVER_URL}/api/files/`;
+            while (url) {
+                const response = await fetch(url, {
+                    credentials: 'include'
+                });
+                if (!response.ok) {
+                    if (response.status === 401) {
+                        window.location.href = '/login';
+                        return;
+                    }
+                    throw new Error('Ошибка при загрузке файлов');
                 }
-                throw new Error('Ошибка при загрузке файлов');
+                const data = await response.json();
+                allFiles.push(...data.results);
+                url = data.next;
             }
-            const data = await response.json();
-            setFiles(data);
+            setFiles(allFiles);
         } catch (error) {
             console.error('Ошибка:', error);
             setError('Не удалось загрузить файлы');